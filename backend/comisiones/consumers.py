@@ -32,8 +32,13 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         message = event['message']
         status = event.get('status', 'info') # info, success, error
 
-        # Enviar el mensaje al WebSocket
-        await self.send(text_data=json.dumps({
+        payload = {
             'message': message,
             'status': status,
-        }))
\ No newline at end of file
+        }
+        # Avance de una carga de comisiones (procesar_archivo_comisiones)
+        if 'carga' in event:
+            payload['carga'] = event['carga']
+
+        # Enviar el mensaje al WebSocket
+        await self.send(text_data=json.dumps(payload))
\ No newline at end of file
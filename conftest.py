@@ -0,0 +1,11 @@
+import pytest
+from django.db import connection
+
+from intranet.benchmark import _quitar_indices_postgres
+
+
+@pytest.fixture(scope='session')
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix):
+    # Igual que base_de_pruebas: los índices GIN/trigramas solo existen en PostgreSQL
+    if connection.vendor != 'postgresql':
+        _quitar_indices_postgres()
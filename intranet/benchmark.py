@@ -0,0 +1,126 @@
+# intranet/benchmark.py
+"""
+Utilidades comunes de los comandos benchmark_*.
+
+Cada punto de entrada se mide en dos pasadas: una solo con el reloj (para
+los percentiles de latencia) y otra con tracemalloc y el conteo de
+consultas, porque ambos alteran los tiempos.
+"""
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentil(valores_ordenados, p):
+    """Percentil con interpolación lineal sobre una lista ya ordenada."""
+    if not valores_ordenados:
+        return 0.0
+    posicion = (len(valores_ordenados) - 1) * p / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(valores_ordenados) - 1)
+    fraccion = posicion - inferior
+    return valores_ordenados[inferior] + (valores_ordenados[superior] - valores_ordenados[inferior]) * fraccion
+
+
+def medir(funcion, repeticiones, calentamiento=1):
+    """
+    Ejecuta `funcion(i)` `repeticiones` veces y devuelve latencias (ms),
+    consultas por llamada y pico de memoria (MB) de una llamada instrumentada.
+    """
+    for i in range(calentamiento):
+        funcion(i)
+
+    latencias = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(calentamiento + i)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+    latencias.sort()
+
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as consultas:
+            funcion(calentamiento + repeticiones)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    resultado = {
+        'repeticiones': repeticiones,
+        'latencia_ms': {
+            'min': round(latencias[0], 3),
+            'media': round(sum(latencias) / len(latencias), 3),
+            'max': round(latencias[-1], 3),
+        },
+        'consultas': len(consultas.captured_queries),
+        'memoria_pico_mb': round(pico / (1024 * 1024), 3),
+    }
+    for p in PERCENTILES:
+        resultado['latencia_ms'][f'p{p}'] = round(percentil(latencias, p), 3)
+    return resultado
+
+
+def commit_actual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True, timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def metadatos(parametros):
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit_actual(),
+        'motor_bd': connection.vendor,
+        'parametros': parametros,
+    }
+
+
+def escribir_resultados(ruta, contenido):
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    os.makedirs(directorio, exist_ok=True)
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump(contenido, archivo, indent=2, ensure_ascii=False, default=str)
+
+
+def _quitar_indices_postgres():
+    """Los índices GIN/trigramas no existen fuera de PostgreSQL."""
+    from django.apps import apps
+    from django.contrib.postgres.indexes import PostgresIndex
+
+    for modelo in apps.get_models():
+        indices = modelo._meta.indexes
+        propios = [i for i in indices if not isinstance(i, PostgresIndex)]
+        if len(propios) != len(indices):
+            modelo._meta.indexes = propios
+
+
+@contextmanager
+def base_de_pruebas(verbosidad=0):
+    """
+    Crea la base de pruebas de Django (test_<nombre>, o SQLite en memoria)
+    a partir de los modelos, la usa durante el bloque y la destruye al salir.
+    Nunca escribe en la base configurada.
+    """
+    nombre_original = connection.settings_dict['NAME']
+    connection.settings_dict.setdefault('TEST', {})['MIGRATE'] = False
+    if connection.vendor != 'postgresql':
+        _quitar_indices_postgres()
+
+    connection.creation.create_test_db(verbosity=verbosidad, autoclobber=True, keepdb=False)
+    try:
+        yield connection.settings_dict['NAME']
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=verbosidad, keepdb=False)
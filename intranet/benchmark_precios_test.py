@@ -0,0 +1,50 @@
+"""
+Casos de pytest-benchmark del pipeline de precios, sobre el mismo catálogo
+sintético del comando benchmark_precios. Solo corren con pytest:
+
+    pytest intranet/benchmark_precios_test.py --benchmark-only
+"""
+import itertools
+import random
+
+import pytest
+from rest_framework.test import APIRequestFactory
+
+from intranet.formulas import invalidar_motor
+from intranet.management.commands.benchmark_precios import Command
+
+PRODUCTOS = 200
+LISTAS = 6
+CARGAS = 2
+
+
+@pytest.fixture
+def catalogo(db):
+    comando = Command()
+    comando.aleatorio = random.Random(42)
+    comando.factory = APIRequestFactory()
+    comando._generar_catalogo(PRODUCTOS, LISTAS, CARGAS)
+    yield comando
+    # El motor en memoria apunta a filas que se descartan con la transacción
+    invalidar_motor()
+
+
+def _medir(benchmark, caso):
+    llamadas = itertools.count()
+    benchmark(lambda: caso(next(llamadas)))
+
+
+def test_translate_prepago(benchmark, catalogo):
+    _medir(benchmark, catalogo._caso_translate_prepago)
+
+
+def test_buscar_precios(benchmark, catalogo):
+    _medir(benchmark, catalogo._caso_buscar_precios)
+
+
+def test_guardar_precios(benchmark, catalogo):
+    _medir(benchmark, catalogo._caso_guardar_precios)
+
+
+def test_motor_de_evaluacion_recursivo(benchmark, catalogo):
+    _medir(benchmark, catalogo._caso_motor_de_evaluacion_recursivo)
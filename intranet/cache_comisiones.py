@@ -0,0 +1,75 @@
+# intranet/cache_comisiones.py
+"""
+Cache de las respuestas del dashboard de asesores (reporte, comparativa y
+filtros) sobre CacheDosNiveles (ver cache_precios).
+
+La clave es (vista, rutas del usuario, parámetros de la consulta) y la
+versión de los datos es el contador de Redis del prefijo: cualquier
+escritura en comisiones (resumen_comisiones.aplicar) o en pagos y sus
+métodos (señales de PagoComision y PagoComisionMetodo) lo incrementa al
+confirmar la transacción (datos_modificados), así que invalidar es O(1) y vale para todos los
+workers. Los demás procesos dejan de servir la versión anterior a más
+tardar en SEGUNDOS_VERSION_LOCAL.
+"""
+import hashlib
+from functools import wraps
+
+from django.db import transaction
+from rest_framework.response import Response
+
+from . import models
+from .cache_precios import CacheDosNiveles
+
+PREFIJO = 'comisiones:reportes'
+MAX_ENTRADAS_LOCALES = 256
+
+cache_reportes = CacheDosNiveles(max_entradas=MAX_ENTRADAS_LOCALES, prefijo=PREFIJO)
+
+
+def invalidar_reportes_comisiones(**kwargs):
+    cache_reportes.invalidar()
+
+
+def datos_modificados():
+    """Para quien escribe en Comision o PagoComision: nueva versión al confirmar."""
+    transaction.on_commit(invalidar_reportes_comisiones)
+
+
+def _rutas_del_usuario(user):
+    """Ruta del perfil y, si es supervisor, sus rutas asignadas: lo que decide qué datos ve."""
+    ruta = models.Perfil.objects.filter(user=user).values_list('ruta_asignada', flat=True).first()
+    rutas_supervisor = ()
+    if models.user_es_supervisor_comisiones(user):
+        rutas_supervisor = tuple(sorted(
+            models.RutaAsignada.objects.filter(user=user).values_list('ruta', flat=True)
+        ))
+    return ruta or '', rutas_supervisor
+
+
+def _clave(request, vista):
+    parametros = sorted((nombre, tuple(valores)) for nombre, valores in request.query_params.lists())
+    # El host entra en la clave porque las respuestas paginadas llevan URLs absolutas
+    texto = repr((_rutas_del_usuario(request.user), request.get_host(), parametros))
+    return f'{vista}:{hashlib.sha1(texto.encode()).hexdigest()}'
+
+
+def cachear_respuesta(vista):
+    """
+    Decorador para vistas GET del dashboard (debajo del de permisos). Solo
+    se guardan las respuestas 200; las demás se devuelven sin cachear.
+    """
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        respuesta = None
+
+        def calcular():
+            nonlocal respuesta
+            respuesta = vista(request, *args, **kwargs)
+            return respuesta.data if respuesta.status_code == 200 else None
+
+        datos = cache_reportes.obtener(_clave(request, vista.__name__), calcular)
+        if respuesta is not None:
+            return respuesta
+        return Response(datos)
+
+    return envoltura
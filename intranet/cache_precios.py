@@ -0,0 +1,195 @@
+# intranet/cache_precios.py
+"""
+Cache de dos niveles para los metadatos de filtros de precios.
+
+Primer nivel: LRU en memoria del proceso. Segundo nivel: el Redis que ya
+usa Celery (alias de cache 'redis'). Las claves llevan una versión guardada
+en Redis (un contador); al guardar una Carga se incrementa la versión y se
+vacía el LRU local, los demás procesos la ven en cuanto vence su copia local
+de la versión (SEGUNDOS_VERSION_LOCAL). Si Redis no responde se sigue con el
+LRU y la BD. CacheDosNiveles también la usan otros módulos con su propio
+prefijo (p. ej. cache_comisiones).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+from . import models
+from .motor_precios import marca_de_producto
+
+logger = logging.getLogger(__name__)
+
+ALIAS_REDIS = 'redis'
+PREFIJO = 'precios:filtros'
+MAX_ENTRADAS_LOCALES = 32
+SEGUNDOS_VERSION_LOCAL = 5
+SEGUNDOS_REDIS = 60 * 60 * 24
+CARGAS_RECIENTES = 50
+
+
+def _version_inicial():
+    # Si Redis pierde el contador se reanuda desde el reloj y no desde 1,
+    # para no volver a versiones que aún tienen claves guardadas
+    return time.time_ns() // 1000
+
+
+class CacheDosNiveles:
+    def __init__(self, alias_redis=ALIAS_REDIS, max_entradas=MAX_ENTRADAS_LOCALES, prefijo=PREFIJO):
+        self.alias_redis = alias_redis
+        self.prefijo = prefijo
+        self.clave_version = f'{prefijo}:version'
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+        self._version = None
+        self._version_vence = 0.0
+        self._redis_caido_hasta = 0.0
+        self._contadores = {'hit_local': 0, 'hit_redis': 0, 'miss': 0, 'error_redis': 0}
+
+    def _redis(self):
+        if time.monotonic() < self._redis_caido_hasta:
+            return None
+        try:
+            return caches[self.alias_redis]
+        except InvalidCacheBackendError:
+            return None
+
+    def _contar(self, contador):
+        with self._lock:
+            self._contadores[contador] += 1
+
+    def _version_vigente(self):
+        ahora = time.monotonic()
+        if self._version is not None and ahora < self._version_vence:
+            return self._version
+
+        version = self._version or 'local'
+        redis = self._redis()
+        if redis is not None:
+            try:
+                version = redis.get(self.clave_version)
+                if version is None:
+                    redis.add(self.clave_version, _version_inicial(), None)
+                    version = redis.get(self.clave_version)
+            except Exception as e:
+                self._contar('error_redis')
+                logger.warning(f"Cache {self.prefijo}: Redis no disponible ({e}).")
+                version = self._version or 'local'
+                # No se reintenta hasta que vuelva a tocar revisar la versión
+                self._redis_caido_hasta = ahora + SEGUNDOS_VERSION_LOCAL
+
+        with self._lock:
+            if version != self._version:
+                self._local.clear()
+            self._version = version
+            self._version_vence = ahora + SEGUNDOS_VERSION_LOCAL
+        return version
+
+    def version(self):
+        """
+        Versión vigente, para quien guarda en su proceso algo que depende de
+        ella (p. ej. el motor de fórmulas). None si Redis no responde.
+        """
+        version = self._version_vigente()
+        return None if self._redis() is None else version
+
+    def obtener(self, clave, calcular):
+        """Devuelve el valor de `clave`; si no está en ningún nivel lo calcula con `calcular()`."""
+        version = self._version_vigente()
+
+        with self._lock:
+            if clave in self._local:
+                self._local.move_to_end(clave)
+                self._contadores['hit_local'] += 1
+                return self._local[clave]
+
+        clave_redis = f'{self.prefijo}:{version}:{clave}'
+        redis = self._redis()
+        valor = None
+        if redis is not None:
+            try:
+                valor = redis.get(clave_redis)
+            except Exception as e:
+                self._contar('error_redis')
+                logger.warning(f"Cache {self.prefijo}: no se pudo leer '{clave}' de Redis ({e}).")
+
+        if valor is not None:
+            self._contar('hit_redis')
+        else:
+            self._contar('miss')
+            valor = calcular()
+            # None es "no guardar" (p. ej. una respuesta de error)
+            if valor is None:
+                return None
+            if redis is not None:
+                try:
+                    redis.set(clave_redis, valor, SEGUNDOS_REDIS)
+                except Exception as e:
+                    self._contar('error_redis')
+                    logger.warning(f"Cache {self.prefijo}: no se pudo guardar '{clave}' en Redis ({e}).")
+
+        with self._lock:
+            self._local[clave] = valor
+            self._local.move_to_end(clave)
+            while len(self._local) > self.max_entradas:
+                self._local.popitem(last=False)
+        return valor
+
+    def invalidar(self):
+        """Incrementa la versión en Redis (O(1) para todos los procesos) y vacía el LRU local."""
+        self._redis_caido_hasta = 0.0
+        redis = self._redis()
+        if redis is not None:
+            try:
+                try:
+                    redis.incr(self.clave_version)
+                except Exception:
+                    # Sin contador (o con una versión que no es un número)
+                    redis.set(self.clave_version, _version_inicial(), None)
+            except Exception as e:
+                self._contar('error_redis')
+                logger.warning(f"Cache {self.prefijo}: no se pudo invalidar en Redis ({e}).")
+        with self._lock:
+            self._local.clear()
+            self._version = None
+            self._version_vence = 0.0
+
+    def estadisticas(self):
+        with self._lock:
+            contadores = dict(self._contadores)
+            entradas = len(self._local)
+        consultas = contadores['hit_local'] + contadores['hit_redis'] + contadores['miss']
+        aciertos = contadores['hit_local'] + contadores['hit_redis']
+        return {
+            **contadores,
+            'entradas_locales': entradas,
+            'tasa_acierto': round(aciertos / consultas, 4) if consultas else 0.0,
+        }
+
+
+cache_filtros = CacheDosNiveles()
+
+
+def marcas_disponibles():
+    """Primera palabra de cada producto cargado, en mayúsculas y ordenada."""
+    def calcular():
+        productos = models.Lista_precio.objects.values_list('producto_normalizado', flat=True).distinct()
+        return sorted({marca_de_producto(p) for p in productos if p})
+    return cache_filtros.obtener('marcas', calcular)
+
+
+def cargas_recientes():
+    """(id, fecha_carga) de las últimas cargas, de la más nueva a la más vieja."""
+    def calcular():
+        return list(
+            models.Carga.objects.order_by('-fecha_carga').values_list('id', 'fecha_carga')[:CARGAS_RECIENTES]
+        )
+    return cache_filtros.obtener('cargas_recientes', calcular)
+
+
+def invalidar_filtros_precios(**kwargs):
+    cache_filtros.invalidar()
@@ -0,0 +1,491 @@
+# intranet/formulas.py
+"""
+Capa de compilación de fórmulas de precios.
+
+Cada `Formula` y cada `Variables_prices` se parsea UNA sola vez a un AST de
+Python validado. Las variables se resuelven por nombre (no por reemplazo de
+texto) siguiendo el grafo de dependencias de la lista de precios, y el
+resultado se compila a un code object que solo depende de las entradas
+(Valor, Costo, Descuento, iva).
+
+El motor compilado se guarda en memoria del proceso y se invalida cuando
+cambia cualquier fila de Formula o Variables_prices (ver signals.py). La
+versión vigente es un contador en Redis (CacheDosNiveles, ver cache_precios)
+que comparten todos los workers de gunicorn y Celery; cada proceso lo revisa
+cada SEGUNDOS_VERSION_LOCAL. Si Redis no responde, el motor se reconstruye
+desde la BD con esa misma frecuencia.
+"""
+import ast
+import copy
+import re
+import threading
+import time
+from functools import reduce
+
+import numpy as np
+from . import models
+from .cache_precios import SEGUNDOS_VERSION_LOCAL, CacheDosNiveles
+
+
+# Lista de precios cuyas variables aplican a todas las demás.
+ID_PRECIO_GLOBAL = 1
+NOMBRE_FORMULA_PUBLICO = 'Precio publico'
+ALIAS_PRECIO_PUBLICO = ('precioPublico', 'PrecioPublico')
+
+# Palabras que las fórmulas usan como "etiqueta" de la lista y que se ignoran.
+MARCADORES_LISTA = ('Sub', 'Premium', 'Fintech', 'Addi', 'Valle')
+_RE_MARCADORES = re.compile(r'\b(?:' + '|'.join(MARCADORES_LISTA) + r')\b')
+
+# Las fórmulas con id menor a este valor usan la sintaxis antigua ('=' como
+# comparación y nombres de entrada en minúscula).
+ID_LIMITE_FORMULA_LEGACY = 9
+
+FUNCIONES_PERMITIDAS = {
+    'round': round,
+    'abs': abs,
+    'min': min,
+    'max': max,
+    'int': int,
+    'float': float,
+}
+
+
+def _potencia(base, exponente):
+    # Entre enteros Python calcularía el número exacto (9**9**9 no termina);
+    # en float da OverflowError al instante. Float y Decimal ya son acotados.
+    if isinstance(base, int) and isinstance(exponente, int):
+        base = float(base)
+    return base ** exponente
+
+
+# Funciones que inserta el compilador, no disponibles en el texto de la fórmula
+FUNCIONES_INTERNAS = {
+    '_potencia': _potencia,
+}
+
+# Equivalentes sobre arrays de NumPy para la evaluación por columnas.
+FUNCIONES_VECTORIZADAS = {
+    'round': np.round,
+    'abs': np.abs,
+    'min': lambda *xs: reduce(np.minimum, xs),
+    'max': lambda *xs: reduce(np.maximum, xs),
+    'int': np.trunc,
+    'float': lambda x: np.asarray(x, dtype=float),
+    '_si': np.where,
+    '_y': lambda *xs: reduce(np.logical_and, xs),
+    '_o': lambda *xs: reduce(np.logical_or, xs),
+    '_no': np.logical_not,
+    '_potencia': lambda base, exponente: np.power(np.asarray(base, dtype=float), exponente),
+}
+
+_NODOS_PERMITIDOS = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare,
+    ast.IfExp, ast.Name, ast.Load, ast.Constant, ast.Call,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+PREFIJO_VERSION = 'precios:formulas'
+# Compilaciones ad hoc (compilar_texto) que se guardan por motor
+MAX_COMPILADAS_TEXTO = 256
+
+
+class FormulaError(ValueError):
+    """Fórmula con sintaxis inválida, elementos no permitidos o dependencias circulares."""
+
+
+def formula_a_texto(raw) -> str:
+    """
+    Convierte el valor guardado en `formula` a texto evaluable.
+    Acepta la lista serializada de tokens ("['Valor', '*', '1.1']"),
+    una lista real o un texto plano.
+    """
+    if raw is None:
+        return ''
+    if isinstance(raw, (list, tuple)):
+        return ' '.join(str(t) for t in raw)
+
+    texto = str(raw).strip()
+    if texto.startswith('['):
+        try:
+            tokens = ast.literal_eval(texto)
+        except (ValueError, SyntaxError):
+            tokens = None
+        if isinstance(tokens, (list, tuple)):
+            return ' '.join(str(t) for t in tokens)
+    return ' '.join(texto.split())
+
+
+def normalizar_formula_legacy(texto: str) -> str:
+    """Traduce la sintaxis de las fórmulas antiguas a Python."""
+    texto = texto.replace('=', '==')
+    texto = texto.replace('> ==', '>=')
+    texto = texto.replace('< ==', '<=')
+    texto = texto.replace('costo', 'Costo')
+    texto = texto.replace('valor', 'Valor')
+    texto = texto.replace('descuento', 'Descuento')
+    return texto
+
+
+def parsear_expresion(texto: str, origen: str = '<formula>'):
+    """
+    Parsea y valida una expresión. Devuelve el nodo raíz (sin el `Expression`).
+    Una fórmula vacía equivale a 0.
+    """
+    texto = _RE_MARCADORES.sub('', texto or '').strip()
+    if not texto:
+        return ast.Constant(value=0)
+
+    try:
+        arbol = ast.parse(texto, mode='eval')
+    except SyntaxError as e:
+        raise FormulaError(f"Sintaxis inválida en '{origen}': {e.msg} ({texto})")
+
+    for nodo in ast.walk(arbol):
+        if not isinstance(nodo, _NODOS_PERMITIDOS):
+            raise FormulaError(
+                f"Elemento no permitido en '{origen}': {type(nodo).__name__}"
+            )
+        if isinstance(nodo, ast.Constant) and not isinstance(nodo.value, (int, float)):
+            raise FormulaError(f"Constante no permitida en '{origen}': {nodo.value!r}")
+        if isinstance(nodo, ast.Call):
+            if (
+                not isinstance(nodo.func, ast.Name)
+                or nodo.func.id not in FUNCIONES_PERMITIDAS
+                or nodo.keywords
+            ):
+                raise FormulaError(f"Función no permitida en '{origen}'.")
+    return arbol.body
+
+
+class _Inliner(ast.NodeTransformer):
+    """Reemplaza cada nombre de variable por su expresión ya resuelta."""
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+
+    def visit_Call(self, node):
+        # El nombre de la función no es una variable.
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def visit_Name(self, node):
+        resuelto = self.resolver(node.id)
+        if resuelto is None:
+            return node
+        return copy.deepcopy(resuelto)
+
+
+class _Potencias(ast.NodeTransformer):
+    """a ** b -> _potencia(a, b) (ver FUNCIONES_INTERNAS)."""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Pow):
+            return ast.Call(
+                func=ast.Name(id='_potencia', ctx=ast.Load()),
+                args=[node.left, node.right], keywords=[],
+            )
+        return node
+
+
+class _Vectorizador(ast.NodeTransformer):
+    """
+    Reescribe la expresión para que funcione sobre arrays completos:
+    `a if c else b` -> _si(c, a, b), and/or/not -> _y/_o/_no y las
+    comparaciones encadenadas se separan en pares.
+    """
+
+    @staticmethod
+    def _llamar(nombre, args):
+        return ast.Call(func=ast.Name(id=nombre, ctx=ast.Load()), args=args, keywords=[])
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return self._llamar('_si', [node.test, node.body, node.orelse])
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        return self._llamar('_y' if isinstance(node.op, ast.And) else '_o', node.values)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self._llamar('_no', [node.operand])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        izquierda = node.left
+        pares = []
+        for op, derecha in zip(node.ops, node.comparators):
+            pares.append(ast.Compare(left=izquierda, ops=[op], comparators=[derecha]))
+            izquierda = derecha
+        return self._llamar('_y', pares)
+
+
+class FormulaCompilada:
+    """Resultado de compilar una fórmula para una lista de precios."""
+
+    def __init__(self, nombre, price_id, expresion, dependencias):
+        self.nombre = nombre
+        self.price_id = price_id
+        expresion = _Potencias().visit(ast.Expression(body=expresion))
+        self.expresion = ast.fix_missing_locations(expresion)
+        self.codigo = compile(self.expresion, f'<formula {nombre}>', 'eval')
+        # (price_id dueño de la variable, nombre) usados directa o transitivamente
+        self.dependencias = frozenset(dependencias)
+        funciones = {id(n.func) for n in ast.walk(self.expresion) if isinstance(n, ast.Call)}
+        self.entradas = frozenset(
+            n.id for n in ast.walk(self.expresion)
+            if isinstance(n, ast.Name) and id(n) not in funciones
+        )
+
+    def evaluar(self, contexto, por_defecto=None):
+        """
+        Evalúa la fórmula con los valores de `contexto`.
+        Si `por_defecto` no es None, las entradas faltantes toman ese valor;
+        de lo contrario se levanta NameError como hacía el eval original.
+        """
+        if por_defecto is not None:
+            faltantes = self.entradas.difference(contexto)
+            if faltantes:
+                contexto = {**{n: por_defecto for n in faltantes}, **contexto}
+        return eval(self.codigo, {'__builtins__': {}, **FUNCIONES_PERMITIDAS, **FUNCIONES_INTERNAS}, contexto)
+
+    @property
+    def codigo_vectorizado(self):
+        if not hasattr(self, '_codigo_vectorizado'):
+            arbol = _Vectorizador().visit(copy.deepcopy(self.expresion))
+            arbol = ast.fix_missing_locations(arbol)
+            self._codigo_vectorizado = compile(arbol, f'<formula {self.nombre} (vectorizada)>', 'eval')
+        return self._codigo_vectorizado
+
+    def evaluar_columnas(self, columnas, largo):
+        """
+        Evalúa la fórmula sobre columnas completas (arrays de NumPy del mismo
+        largo). Devuelve siempre un array float de `largo` posiciones.
+        Levanta NameError si falta alguna entrada, igual que `evaluar`, y
+        FormulaError si alguna fila no da un número (división por cero,
+        desbordamiento), que fila a fila habría sido una excepción.
+        """
+        faltantes = self.entradas.difference(columnas)
+        if faltantes:
+            raise NameError(f"name '{sorted(faltantes)[0]}' is not defined")
+        with np.errstate(all='ignore'):
+            resultado = eval(
+                self.codigo_vectorizado,
+                {'__builtins__': {}, **FUNCIONES_VECTORIZADAS},
+                columnas,
+            )
+        resultado = np.asarray(resultado, dtype=float)
+        if resultado.shape != (largo,):
+            resultado = np.broadcast_to(resultado, (largo,)).copy()
+
+        invalidas = np.flatnonzero(~np.isfinite(resultado))
+        if invalidas.size:
+            fila = invalidas[0]
+            entradas = ', '.join(
+                f'{nombre}={valores[fila] if np.ndim(valores) else valores}'
+                for nombre, valores in sorted(columnas.items()) if nombre in self.entradas
+            )
+            raise FormulaError(
+                f"La fórmula '{self.nombre}' no da un número en {invalidas.size} fila(s) "
+                f"(división por cero o desbordamiento), p. ej. con {entradas or 'sus constantes'}."
+            )
+        return resultado
+
+    def __repr__(self):
+        return f"<FormulaCompilada {self.nombre} (precio {self.price_id})>"
+
+
+class MotorFormulas:
+    """
+    Grafo de fórmulas y variables de precios.
+    Las expresiones se parsean una vez y las compilaciones se memorizan por
+    (fórmula, lista de precios).
+    """
+
+    ENTRADAS = ('Valor', 'Costo', 'Descuento', 'iva')
+
+    def __init__(self, formulas, variables):
+        # formulas: iterable de dicts con id, nombre, price_id, formula
+        # variables: iterable de dicts con price_id, name, formula
+        self.formulas = {}
+        for f in formulas:
+            texto = formula_a_texto(f['formula'])
+            if f['id'] < ID_LIMITE_FORMULA_LEGACY:
+                texto = normalizar_formula_legacy(texto)
+            self.formulas[f['nombre']] = {
+                'id': f['id'],
+                'price_id': f['price_id'],
+                'texto': texto,
+            }
+
+        self.variables = {}
+        for v in variables:
+            self.variables.setdefault(v['price_id'], {})[v['name']] = formula_a_texto(v['formula'])
+
+        self._arboles = {}
+        self._compiladas = {}
+        self._compiladas_texto = {}
+
+    @classmethod
+    def desde_bd(cls):
+        formulas = models.Formula.objects.values('id', 'nombre', 'price_id', 'formula')
+        variables = models.Variables_prices.objects.values('price_id', 'name', 'formula')
+        return cls(list(formulas), list(variables))
+
+    # --- Resolución de nombres -------------------------------------------------
+
+    def _arbol(self, clave, texto, origen):
+        if clave not in self._arboles:
+            self._arboles[clave] = parsear_expresion(texto, origen)
+        return self._arboles[clave]
+
+    def _dueno_variable(self, price_id, nombre):
+        """Lista de precios que define la variable (la específica gana sobre la global)."""
+        if nombre in self.variables.get(price_id, {}):
+            return price_id
+        if nombre in self.variables.get(ID_PRECIO_GLOBAL, {}):
+            return ID_PRECIO_GLOBAL
+        return None
+
+    def _resolver(self, arbol, price_id, dependencias, pila, resueltas):
+        def resolver_nombre(nombre):
+            if nombre in self.ENTRADAS:
+                return None
+            if nombre in resueltas:
+                return resueltas[nombre]
+
+            if nombre in ALIAS_PRECIO_PUBLICO:
+                publico = self.formulas.get(NOMBRE_FORMULA_PUBLICO)
+                if publico is None:
+                    return None
+                clave = ('formula', NOMBRE_FORMULA_PUBLICO)
+                sub_arbol = self._arbol(clave, publico['texto'], NOMBRE_FORMULA_PUBLICO)
+            else:
+                dueno = self._dueno_variable(price_id, nombre)
+                if dueno is None:
+                    return None
+                clave = ('variable', dueno, nombre)
+                sub_arbol = self._arbol(clave, self.variables[dueno][nombre], nombre)
+                dependencias.add((dueno, nombre))
+
+            if nombre in pila:
+                ciclo = ' -> '.join(pila + [nombre])
+                raise FormulaError(f'Dependencia circular entre variables: {ciclo}')
+
+            pila.append(nombre)
+            try:
+                expresion = self._resolver(sub_arbol, price_id, dependencias, pila, resueltas)
+            finally:
+                pila.pop()
+            resueltas[nombre] = expresion
+            return expresion
+
+        return _Inliner(resolver_nombre).visit(copy.deepcopy(arbol))
+
+    # --- API pública ------------------------------------------------------------
+
+    def compilar(self, nombre_formula, price_id=None):
+        """
+        Compila la `Formula` con ese nombre. Las variables se buscan en la
+        lista de precios de la fórmula (o `price_id` si se indica).
+        """
+        datos = self.formulas.get(nombre_formula)
+        if datos is None:
+            raise FormulaError(f"No existe la fórmula '{nombre_formula}'.")
+        scope = price_id if price_id is not None else datos['price_id']
+
+        clave = ('formula', nombre_formula, scope)
+        if clave not in self._compiladas:
+            arbol = self._arbol(('formula', nombre_formula), datos['texto'], nombre_formula)
+            self._compiladas[clave] = self._compilar_arbol(nombre_formula, scope, arbol)
+        return self._compiladas[clave]
+
+    def compilar_texto(self, texto, price_id, origen='<prueba>'):
+        """Compila una expresión ad hoc (p.ej. la que se está probando en el editor)."""
+        texto = formula_a_texto(texto)
+        clave = (texto, price_id)
+        compilada = self._compiladas_texto.get(clave)
+        if compilada is None:
+            arbol = parsear_expresion(texto, origen)
+            compilada = self._compilar_arbol(origen, price_id, arbol)
+            # Los textos vienen del editor y no se repiten mucho: al llenarse se vacía
+            if len(self._compiladas_texto) >= MAX_COMPILADAS_TEXTO:
+                self._compiladas_texto.clear()
+            self._compiladas_texto[clave] = compilada
+        return compilada
+
+    def formulas_afectadas(self, cambios):
+        """
+        Nombres de las fórmulas que dependen, directa o transitivamente, de
+        alguna variable de `cambios` (pares (price_id, nombre)). Una variable
+        de la lista global afecta a todas las que usan ese nombre; una
+        específica, solo a las fórmulas de su lista (aunque hoy resuelvan a
+        la global, porque ahora la sombrea o dejó de hacerlo).
+        """
+        afectadas = []
+        for nombre_formula, datos in self.formulas.items():
+            try:
+                compilada = self.compilar(nombre_formula)
+            except FormulaError:
+                afectadas.append(nombre_formula)
+                continue
+            usadas = {nombre for _, nombre in compilada.dependencias} | compilada.entradas
+            if any(
+                nombre in usadas and price_id in (ID_PRECIO_GLOBAL, datos['price_id'])
+                for price_id, nombre in cambios
+            ):
+                afectadas.append(nombre_formula)
+        return afectadas
+
+    def _compilar_arbol(self, nombre, price_id, arbol):
+        dependencias = set()
+        expresion = self._resolver(arbol, price_id, dependencias, [nombre], {})
+        try:
+            return FormulaCompilada(nombre, price_id, expresion, dependencias)
+        except (SyntaxError, ValueError, RecursionError) as e:
+            raise FormulaError(f"No se pudo compilar '{nombre}': {e}")
+
+
+# --- Cache del motor por proceso ----------------------------------------------
+
+_lock = threading.Lock()
+_motor_cache = {'version': None, 'motor': None}
+# Solo se usa su contador de versión (no guarda valores)
+_version_formulas = CacheDosNiveles(prefijo=PREFIJO_VERSION)
+
+
+def _version_actual():
+    """Contador de Redis; sin Redis, una versión que cambia cada SEGUNDOS_VERSION_LOCAL."""
+    version = _version_formulas.version()
+    if version is None:
+        return f'local:{int(time.monotonic() // SEGUNDOS_VERSION_LOCAL)}'
+    return version
+
+
+def obtener_motor() -> MotorFormulas:
+    """Devuelve el motor compilado vigente, reconstruyéndolo si cambió la versión."""
+    version = _version_actual()
+    motor = _motor_cache['motor']
+    if motor is not None and _motor_cache['version'] == version:
+        return motor
+
+    with _lock:
+        if _motor_cache['motor'] is None or _motor_cache['version'] != version:
+            _motor_cache['motor'] = MotorFormulas.desde_bd()
+            _motor_cache['version'] = version
+        return _motor_cache['motor']
+
+
+def invalidar_motor(**kwargs):
+    """Descarta el motor compilado en este proceso y, vía Redis, en todos los demás."""
+    _version_formulas.invalidar()
+    with _lock:
+        _motor_cache['motor'] = None
+        _motor_cache['version'] = None
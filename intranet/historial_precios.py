@@ -0,0 +1,176 @@
+# intranet/historial_precios.py
+"""
+Historial de precios de una lista calculado en la base de datos.
+
+El valor anterior sale de LAG() sobre las cargas de cada producto y la
+variación (diferencial, porcentaje, indicador) se arma con CASE en el mismo
+SELECT, así que solo viaja a Python la página pedida. La paginación es por
+cursor (keyset): fecha de carga + id en el historial y producto cuando se
+pide solo la última fila de cada uno.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+from django.db.models import (
+    Case, CharField, DecimalField, ExpressionWrapper, F, Max, Q, Value, When, Window,
+)
+from django.db.models.functions import Abs, Lag, Round, RowNumber
+
+from . import models
+from .motor_precios import normalize_string
+
+PRECIO_SIMCARD = Decimal('2000')
+BASE_IVA_EXCLUIDO = Decimal('1152228')
+TASA_IVA = Decimal('0.19')
+
+_DECIMAL = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _historial_anotado(nombre_lista):
+    """Lista_precio de la lista con valor anterior y variación por producto."""
+    anterior = F('valor_anterior')
+    return (
+        models.Lista_precio.objects
+        .filter(nombre=nombre_lista)
+        .annotate(
+            fecha=F('carga__fecha_carga'),
+            valor_anterior=Window(
+                Lag('valor'),
+                partition_by=[F('producto_normalizado')],
+                order_by=[F('carga__fecha_carga').asc(), F('id').asc()],
+            ),
+        )
+        .annotate(
+            indicador=Case(
+                When(valor_anterior__isnull=True, then=Value('neutral')),
+                When(valor__gt=anterior, then=Value('up')),
+                When(valor__lt=anterior, then=Value('down')),
+                default=Value('neutral'),
+                output_field=CharField(),
+            ),
+            diferencial=Case(
+                When(valor_anterior__isnull=True, then=Value(Decimal('0'))),
+                default=Abs(F('valor') - anterior),
+                output_field=_DECIMAL,
+            ),
+            porcentaje=Case(
+                When(valor_anterior__isnull=True, then=Value(Decimal('0'))),
+                When(valor=anterior, then=Value(Decimal('0'))),
+                # Sin precio anterior positivo: una subida cuenta como 100 %
+                When(Q(valor_anterior__lte=0) & Q(valor__gt=anterior), then=Value(Decimal('100'))),
+                When(valor_anterior__lte=0, then=Value(Decimal('0'))),
+                default=Round(
+                    ExpressionWrapper(Abs(F('valor') - anterior) * Value(Decimal('100.00')) / anterior, output_field=_DECIMAL),
+                    2,
+                ),
+                output_field=_DECIMAL,
+            ),
+        )
+    )
+
+
+def _formatear_fila(fila):
+    valor_actual = fila['valor']
+    iva = valor_actual * TASA_IVA if valor_actual >= BASE_IVA_EXCLUIDO else Decimal('0')
+    return {
+        'equipo': fila['producto'],
+        'fecha': fila['fecha'],
+        'equipo sin IVA': float(valor_actual),
+        'valor_anterior': float(fila['valor_anterior'] or 0),
+        'precio simcard': float(PRECIO_SIMCARD),
+        'IVA simcard': float(PRECIO_SIMCARD * TASA_IVA),
+        'IVA equipo': float(iva),
+        'total': float(PRECIO_SIMCARD * (1 + TASA_IVA) + valor_actual + iva),
+        'indicador': fila['indicador'],
+        'diferencial': float(fila['diferencial']),
+        'porcentaje': float(fila['porcentaje']),
+    }
+
+
+def _leer_limite(limite):
+    if limite in (None, ''):
+        return None
+    limite = int(limite)
+    if limite <= 0:
+        raise ValueError('El límite debe ser mayor que cero.')
+    return limite
+
+
+def historial_precios(nombre_lista, equipo=None, solo_ultimo=False, cursor=None, limite=None):
+    """
+    Historial de `nombre_lista`, opcionalmente de un solo equipo.
+
+    - solo_ultimo: solo la carga más reciente de cada producto, ordenado por
+      producto; el cursor es {'producto': <producto normalizado>}.
+    - si no, todas las cargas de la más nueva a la más vieja; el cursor es
+      {'fecha': <iso>, 'id': <id>} de la última fila recibida.
+
+    Devuelve (filas, siguiente_cursor); siguiente_cursor es None al final.
+    """
+    limite = _leer_limite(limite)
+    qs = _historial_anotado(nombre_lista)
+    if equipo is not None:
+        qs = qs.filter(producto_normalizado=normalize_string(equipo))
+
+    campos = ('id', 'producto', 'producto_normalizado', 'fecha', 'valor',
+              'valor_anterior', 'indicador', 'diferencial', 'porcentaje')
+
+    if solo_ultimo:
+        # El filtro por producto no cambia las particiones, así que va en el
+        # WHERE interno; el de fila_reciente se aplica sobre la ventana.
+        if cursor:
+            qs = qs.filter(producto_normalizado__gt=cursor['producto'])
+        qs = qs.annotate(
+            fila_reciente=Window(
+                RowNumber(),
+                partition_by=[F('producto_normalizado')],
+                order_by=[F('carga__fecha_carga').desc(), F('id').desc()],
+            ),
+        ).filter(fila_reciente=1).order_by('producto_normalizado')
+    else:
+        # LAG solo mira cargas más viejas: recortar las más nuevas que el
+        # cursor no altera el valor anterior de las filas que quedan.
+        if cursor:
+            fecha = datetime.fromisoformat(cursor['fecha'])
+            qs = qs.filter(
+                Q(carga__fecha_carga__lt=fecha)
+                | Q(carga__fecha_carga=fecha, id__lt=int(cursor['id']))
+            )
+        qs = qs.order_by('-carga__fecha_carga', '-id')
+
+    qs = qs.values(*campos)
+    filas = list(qs[:limite + 1] if limite else qs)
+
+    siguiente = None
+    if limite and len(filas) > limite:
+        filas = filas[:limite]
+        ultima = filas[-1]
+        if solo_ultimo:
+            siguiente = {'producto': ultima['producto_normalizado']}
+        else:
+            siguiente = {'fecha': ultima['fecha'].isoformat(), 'id': ultima['id']}
+    return filas, siguiente
+
+
+def descuentos_vigentes(productos_normalizados):
+    """Último valor de la lista 'descuento' para cada producto pedido."""
+    ultimos = (
+        models.Lista_precio.objects
+        .filter(nombre='descuento', producto_normalizado__in=productos_normalizados)
+        .order_by('producto_normalizado', '-carga__fecha_carga', '-id')
+        .values_list('producto_normalizado', 'valor')
+    )
+    descuentos = {}
+    for producto, valor in ultimos:
+        descuentos.setdefault(producto, valor)
+    return descuentos
+
+
+def fecha_ultima_carga(nombre_lista):
+    return models.Lista_precio.objects.filter(nombre=nombre_lista).aggregate(
+        fecha=Max('carga__fecha_carga')
+    )['fecha']
+
+
+def formatear_historial(filas):
+    return [_formatear_fila(fila) for fila in filas]
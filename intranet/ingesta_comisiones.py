@@ -0,0 +1,663 @@
+# intranet/ingesta_comisiones.py
+"""
+Ingesta por columnas de los archivos de liquidación de comisiones.
+
+El Excel se lee en modo de solo lectura de openpyxl, por bloques de filas,
+sin cargar el libro completo en memoria. Cada bloque se limpia, filtra y clasifica con operaciones de pandas/NumPy
+sobre columnas completas (sin iterrows) y las filas válidas salen como
+tuplas en el orden de COLUMNAS_COMISION, listas para el cargador masivo.
+
+En PostgreSQL el cargador copia las tuplas con COPY a una tabla UNLOGGED de
+paso, descarta ahí las filas inválidas y repetidas con SQL por conjuntos y
+las pasa a intranet_comision con un solo INSERT ... SELECT ligado a la
+ComisionCarga, sin las filas cuya clave natural ya había cargado otra carga. En otros motores (SQLite local) hace lo mismo con
+bulk_create por lotes.
+"""
+import hashlib
+import io
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import date
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from billiard import Pool
+from django.contrib.auth.models import User
+from django.db import connection, models as db_models, transaction
+from django.utils import timezone
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+
+from . import models, resumen_comisiones
+
+logger = logging.getLogger(__name__)
+
+TAMANO_BLOQUE = 5000
+
+# Clave del candado de PostgreSQL que serializa el anti-join + INSERT de los bloques
+CANDADO_INSERCION = int.from_bytes(hashlib.md5(b'intranet_comision_insercion').digest()[:4], 'big')
+
+# Orden de las tuplas que produce iterar_filas_comisiones
+COLUMNAS_COMISION = (
+    'asesor_identificador', 'asesor_id', 'iccid', 'distribuidor', 'producto', 'co_id',
+    'prim_llamada_activacion', 'min', 'idpos', 'punto_de_venta', 'ruta', 'comision_final',
+    'pago', 'mes_liquidacion', 'mes_pago', 'estado',
+)
+
+# Meses en español para MES PAGO / MES LIQUIDACIÓN ("setiembre" también se usa)
+NUMERO_MES = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7,
+    'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12,
+}
+
+# Columnas del Excel que pasan sin limpiar (columna del Excel -> campo)
+COLUMNAS_CRUDAS = {
+    'DISTRIBUIDOR': 'distribuidor',
+    'CO_ID': 'co_id',
+    'RUTA': 'ruta',
+}
+
+
+def _bloques(filas, tamano):
+    filas = iter(filas)
+    while True:
+        bloque = list(islice(filas, tamano))
+        if not bloque:
+            return
+        yield bloque
+
+
+# --- Lectura del Excel por bloques -----------------------------------------------
+
+def _celda_texto(valor):
+    """Valor de celda como lo deja pd.read_excel(dtype=str): texto o None."""
+    if valor is None or valor == '' or valor in ERROR_CODES:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _cabecera(fila):
+    """Nombres de columna como los arma pandas (Unnamed: n, duplicados con .n)."""
+    nombres, vistos = [], {}
+    for i, valor in enumerate(fila):
+        nombre = str(valor).strip() if valor not in (None, '') else f'Unnamed: {i}'
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f'{nombre}.{vistos[nombre]}'
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
+
+
+def bloques_de_hoja(hoja, filas_por_bloque=TAMANO_BLOQUE):
+    """
+    DataFrames (columnas de texto/None) de `filas_por_bloque` filas de una
+    hoja abierta en modo read_only; la primera fila es la cabecera.
+    """
+    # Hay archivos que declaran mal sus dimensiones: se leen todas las filas
+    hoja.reset_dimensions()
+    filas = hoja.iter_rows(values_only=True)
+    primera = next(filas, None)
+    if primera is None:
+        return
+    columnas = _cabecera(primera)
+    ancho = len(columnas)
+
+    for bloque in _bloques(filas, filas_por_bloque):
+        datos = [
+            [_celda_texto(v) for v in fila[:ancho]] + [None] * (ancho - len(fila))
+            for fila in bloque
+        ]
+        yield pd.DataFrame(datos, columns=columnas, dtype=object)
+
+
+def abrir_libro(origen):
+    """Libro en modo de solo lectura (ruta o archivo abierto); hay que cerrarlo."""
+    return load_workbook(origen, read_only=True, data_only=True)
+
+
+def leer_bloques_excel(origen, filas_por_bloque=TAMANO_BLOQUE):
+    """(nombre_hoja, DataFrame) por cada bloque de cada hoja del libro."""
+    libro = abrir_libro(origen)
+    try:
+        for hoja in libro.worksheets:
+            for df in bloques_de_hoja(hoja, filas_por_bloque):
+                yield hoja.title, df
+    finally:
+        libro.close()
+
+
+def _quitar_repetidas(df, preparada, vistas):
+    """
+    Quita de `df` las filas con ICCID que, ya limpias, repiten una fila
+    vista antes (en este bloque o en uno anterior) y agrega las nuevas a
+    `vistas` (huellas de 64 bits). Devuelve (df, repetidas, huellas de las
+    filas con ICCID que quedan, indexadas como `df`).
+    """
+    con_iccid = (preparada['iccid'] != '').to_numpy()
+    if not con_iccid.any():
+        return df, 0, pd.Series(dtype='uint64')
+    huellas = pd.util.hash_pandas_object(preparada.loc[con_iccid], index=False)
+    repetidas = huellas.duplicated().to_numpy() | np.array([h in vistas for h in huellas.tolist()], dtype=bool)
+    vistas.update(huellas[~repetidas].tolist())
+    if not repetidas.any():
+        return df, 0, huellas
+    return df.drop(index=huellas.index[repetidas]), int(repetidas.sum()), huellas[~repetidas]
+
+
+def _dividir_hoja(ruta, indice_hoja, directorio, mes_pago=None, filas_por_bloque=TAMANO_BLOQUE):
+    """
+    Lee una hoja del libro, la revisa y guarda cada bloque (sin las filas
+    repetidas dentro de la hoja) como pickle en `directorio`. Puede correr
+    en un proceso del pool: no toca la base de datos.
+
+    Devuelve (entradas del manifiesto, huellas de cada bloque) para quitar
+    después las filas que se repiten entre hojas.
+    """
+    libro = abrir_libro(ruta)
+    try:
+        hoja = libro.worksheets[indice_hoja]
+        entradas, huellas_bloques = [], []
+        vistas = set()
+        desde = 0
+        for df in bloques_de_hoja(hoja, filas_por_bloque):
+            if 'MES PAGO' not in df.columns:
+                raise ValueError(f'Falta la columna obligatoria "MES PAGO" en la hoja \'{hoja.title}\'.')
+            # Sin asesores: la limpieza no depende de ellos salvo asesor_id
+            preparada = preparar_hoja(df, {})
+            _revisar_mes(preparada, hoja.title, mes_pago)
+            leidas = len(df)
+            df, duplicadas, huellas = _quitar_repetidas(df, preparada, vistas)
+
+            ruta_bloque = os.path.join(directorio, f'{indice_hoja:03d}-{len(entradas):05d}.pkl')
+            df.to_pickle(ruta_bloque)
+            entradas.append({
+                'hoja': hoja.title, 'desde': desde, 'filas': len(df),
+                'duplicadas': duplicadas, 'ruta': ruta_bloque,
+            })
+            huellas_bloques.append(huellas)
+            desde += leidas
+        return entradas, huellas_bloques
+    finally:
+        libro.close()
+
+
+def _quitar_repetidas_entre_hojas(partes):
+    """
+    Cada hoja se revisó por separado: reescribe los bloques que traen filas
+    ya vistas en una hoja anterior (caso raro, así que casi nunca reescribe).
+    """
+    vistas = set()
+    for entradas, huellas_bloques in partes:
+        for entrada, huellas in zip(entradas, huellas_bloques):
+            valores = huellas.tolist()
+            repetidas = np.array([h in vistas for h in valores], dtype=bool)
+            vistas.update(valores)
+            if repetidas.any():
+                df = pd.read_pickle(entrada['ruta']).drop(index=huellas.index[repetidas])
+                df.to_pickle(entrada['ruta'])
+                entrada['filas'] = len(df)
+                entrada['duplicadas'] += int(repetidas.sum())
+
+
+def dividir_libro(ruta, directorio, mes_pago=None, procesos=1, filas_por_bloque=TAMANO_BLOQUE):
+    """
+    Revisa el libro completo y lo divide en bloques guardados como pickle en
+    `directorio` para procesarlos en tareas separadas. Con varias hojas y
+    `procesos` > 1 cada hoja se lee en su propio proceso (billiard, que
+    funciona dentro de los workers de Celery); una sola hoja se lee aquí
+    mismo, porque openpyxl la recorre de principio a fin y no se puede partir.
+
+    Antes de que se inserte nada, lanza ValueError si a una hoja le falta la
+    columna MES PAGO o si alguna fila trae un mes distinto de `mes_pago`.
+    Las filas repetidas se quitan aquí para todo el archivo, así que dos
+    bloques nunca traen la misma fila.
+
+    Devuelve el manifiesto: una lista de {'hoja', 'desde', 'filas',
+    'duplicadas', 'ruta'} en el orden del libro ('desde' es la fila de datos
+    de la hoja donde empieza el bloque; 'duplicadas', las filas quitadas).
+    """
+    os.makedirs(directorio, exist_ok=True)
+    libro = abrir_libro(ruta)
+    try:
+        n_hojas = len(libro.sheetnames)
+    finally:
+        libro.close()
+
+    argumentos = [(ruta, i, directorio, mes_pago, filas_por_bloque) for i in range(n_hojas)]
+    procesos = min(procesos or 1, n_hojas)
+    inicio = time.perf_counter()
+    try:
+        if procesos > 1:
+            with Pool(procesos) as pool:
+                partes = pool.starmap(_dividir_hoja, argumentos)
+        else:
+            partes = [_dividir_hoja(*args) for args in argumentos]
+        if len(partes) > 1:
+            _quitar_repetidas_entre_hojas(partes)
+    except Exception:
+        shutil.rmtree(directorio, ignore_errors=True)
+        raise
+
+    manifiesto = [entrada for entradas, _ in partes for entrada in entradas]
+    logger.info(
+        f"Libro dividido en {len(manifiesto)} bloques ({n_hojas} hojas, "
+        f"{procesos} procesos) en {time.perf_counter() - inicio:.2f}s."
+    )
+    return manifiesto
+
+
+def leer_bloque(entrada):
+    """(nombre_hoja, DataFrame) de una entrada del manifiesto de dividir_libro."""
+    return entrada['hoja'], pd.read_pickle(entrada['ruta'])
+
+
+# --- Limpieza y clasificación ---------------------------------------------------
+
+def _texto(df, columna):
+    """Columna como texto sin espacios a los lados; vacía si no existe."""
+    if columna not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    return df[columna].fillna('').astype(str).str.strip()
+
+
+def _fecha_excel(serie):
+    """Números de serie de Excel (días desde 1899-12-30) a date / None."""
+    numeros = pd.to_numeric(serie, errors='coerce')
+    fechas = pd.to_datetime(numeros, origin='1899-12-30', unit='D', errors='coerce')
+    return fechas.dt.date.replace({pd.NaT: None})
+
+
+def mes_desde_texto(texto):
+    """'Diciembre 2025' -> date(2025, 12, 1); None si no es un mes-año en español."""
+    if not isinstance(texto, str):
+        return None
+    partes = texto.lower().split()
+    if len(partes) != 2 or partes[0] not in NUMERO_MES:
+        return None
+    anio = partes[1]
+    if len(anio) != 4 or not anio.isdigit():
+        return None
+    return date(int(anio), NUMERO_MES[partes[0]], 1)
+
+
+def meses_desde_texto(serie):
+    """
+    Serie de mes-año en español a date del primer día / None, sin tocar el
+    locale del proceso. Cada valor distinto se interpreta una sola vez.
+    """
+    codigos, unicos = pd.factorize(serie)
+    # El código -1 (valores nulos) cae en el None del final
+    fechas = np.array([mes_desde_texto(v) for v in unicos] + [None], dtype=object)
+    return pd.Series(fechas[codigos], index=serie.index, dtype=object)
+
+
+def _sin_nulos(serie):
+    """Serie de objetos con None en lugar de NaN/NaT."""
+    serie = serie.astype(object)
+    return serie.where(serie.notna(), None)
+
+
+def mapa_usuarios(identificadores):
+    """username -> id de los usuarios que coinciden con los asesores del archivo."""
+    return dict(User.objects.filter(username__in=identificadores).values_list('username', 'id'))
+
+
+def preparar_hoja(df, usuarios_ids):
+    """
+    Devuelve un DataFrame con una columna por campo de COLUMNAS_COMISION y
+    solo las filas que se deben cargar.
+
+    - Filas sin ICCID, PRODUCTO, IDPOS ni PUNTO DE VENTA se descartan.
+    - Caso especial (sin ICCID ni PRODUCTO): se carga solo si trae IDPOS.
+    - Caso normal: requiere ICCID y PRODUCTO.
+    - Estado 'Acumulada' para casos especiales o PAGO con "acumulado";
+      'Pendiente' en cualquier otro caso.
+    """
+    iccid = _texto(df, 'ICCID')
+    producto = _texto(df, 'PRODUCTO')
+    idpos = _texto(df, 'IDPOS')
+    punto_de_venta = _texto(df, 'PUNTO DE VENTA')
+
+    sin_iccid = (iccid == '').to_numpy()
+    sin_producto = (producto == '').to_numpy()
+    sin_idpos = (idpos == '').to_numpy()
+    especial = sin_iccid & sin_producto
+    vacia = especial & sin_idpos & (punto_de_venta == '').to_numpy()
+    validas = ~vacia & np.where(especial, ~sin_idpos, ~sin_iccid & ~sin_producto)
+
+    pago = _texto(df, 'PAGO').str.lower()
+    acumulada = especial | pago.str.contains('acumulado', regex=False).to_numpy()
+
+    asesor = _texto(df, 'ASESOR')
+    salida = pd.DataFrame({
+        'asesor_identificador': asesor,
+        'asesor_id': _sin_nulos(asesor.map(usuarios_ids).astype('Int64')),
+        'iccid': iccid,
+        'producto': producto,
+        'min': df['MIN'].fillna('').astype(str) if 'MIN' in df.columns else '',
+        'idpos': idpos,
+        'punto_de_venta': punto_de_venta,
+        'pago': pago,
+        'estado': np.where(acumulada, 'Acumulada', 'Pendiente'),
+    }, index=df.index)
+
+    for columna, campo in COLUMNAS_CRUDAS.items():
+        salida[campo] = _sin_nulos(df[columna]) if columna in df.columns else None
+
+    salida['prim_llamada_activacion'] = (
+        _fecha_excel(df['PRIM_LLAMADA_ACTIVACION']) if 'PRIM_LLAMADA_ACTIVACION' in df.columns else None
+    )
+    salida['mes_liquidacion'] = meses_desde_texto(df['MES LIQUIDACIÓN']) if 'MES LIQUIDACIÓN' in df.columns else None
+    salida['mes_pago'] = meses_desde_texto(df['MES PAGO']) if 'MES PAGO' in df.columns else None
+    if 'COMISION FINAL' in df.columns:
+        comision = pd.to_numeric(df['COMISION FINAL'], errors='coerce')
+        salida['comision_final'] = _sin_nulos(comision.round(2))
+    else:
+        salida['comision_final'] = None
+
+    return salida.loc[validas, list(COLUMNAS_COMISION)]
+
+
+def _revisar_mes(preparada, nombre, mes_pago):
+    """ValueError si alguna fila de `preparada` trae un mes de pago distinto de `mes_pago` (date)."""
+    if mes_pago is None:
+        return
+    otros = set(preparada['mes_pago'].dropna()) - {mes_pago}
+    if otros:
+        meses = ', '.join(sorted(m.strftime('%Y-%m') for m in otros))
+        raise ValueError(
+            f"Solo se permite un mes de PAGO por archivo; la hoja '{nombre}' trae también: {meses}."
+        )
+
+
+def iterar_filas_comisiones(bloques, mes_pago=None):
+    """
+    Tuplas (en el orden de COLUMNAS_COMISION) de los bloques
+    (nombre_hoja, DataFrame). Los asesores se buscan una vez por bloque y
+    solo los que no se habían visto.
+
+    Con `mes_pago` (date) lanza ValueError si algún bloque trae otro mes.
+    """
+    usuarios_ids = {}
+    vistos = set()
+    for nombre, df in bloques:
+        if 'ASESOR' in df.columns:
+            nuevos = {v for v in _texto(df, 'ASESOR').unique() if v} - vistos
+            if nuevos:
+                usuarios_ids.update(mapa_usuarios(nuevos))
+                vistos |= nuevos
+        preparada = preparar_hoja(df, usuarios_ids)
+        _revisar_mes(preparada, nombre, mes_pago)
+        logger.info(f"Hoja '{nombre}': {len(preparada)} de {len(df)} filas válidas en el bloque.")
+        yield from preparada.itertuples(index=False, name=None)
+
+
+def _limites():
+    """Largo máximo de cada campo de texto y tope absoluto de comision_final."""
+    opts = models.Comision._meta
+    largos = {
+        i: opts.get_field(campo).max_length
+        for i, campo in enumerate(COLUMNAS_COMISION)
+        if isinstance(opts.get_field(campo), db_models.CharField)
+    }
+    decimal = opts.get_field('comision_final')
+    return largos, 10 ** (decimal.max_digits - decimal.decimal_places)
+
+
+# --- PostgreSQL: COPY a tabla de paso --------------------------------------------
+
+def _valor_csv(valor):
+    if valor is None:
+        return '\\N'
+    return '"' + str(valor).replace('"', '""') + '"'
+
+
+def _tipo_paso(campo):
+    """Tipos laxos en la tabla de paso: la validación se hace después con SQL."""
+    field = models.Comision._meta.get_field(campo)
+    if isinstance(field, (db_models.CharField, db_models.TextField)):
+        return 'text'
+    if isinstance(field, db_models.DecimalField):
+        return 'numeric'
+    return field.rel_db_type(connection) if field.is_relation else field.db_type(connection)
+
+
+# --- Huellas: archivo completo y clave natural de cada fila -----------------------
+
+def hash_archivo(ruta, tamano_lectura=1024 * 1024):
+    """sha256 del contenido del archivo, leído por partes."""
+    huella = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for parte in iter(lambda: archivo.read(tamano_lectura), b''):
+            huella.update(parte)
+    return huella.hexdigest()
+
+
+def clave_natural_comision(iccid, producto, mes_pago, idpos):
+    """md5 de (iccid, producto, mes_pago, idpos); igual al que arma _sql_clave_natural."""
+    texto = f"{iccid}|{producto or ''}|{mes_pago.isoformat() if mes_pago else ''}|{idpos}"
+    return hashlib.md5(texto.encode('utf-8')).hexdigest()
+
+
+def _sql_clave_natural(alias):
+    q = connection.ops.quote_name
+    return (
+        f"CASE WHEN {alias}.{q('iccid')} <> '' THEN md5("
+        f"{alias}.{q('iccid')} || '|' || coalesce({alias}.{q('producto')}, '') || '|' || "
+        f"coalesce(to_char({alias}.{q('mes_pago')}, 'YYYY-MM-DD'), '') || '|' || {alias}.{q('idpos')}"
+        f") END"
+    )
+
+
+# --- Cargador ---------------------------------------------------------------------
+
+def _marcar_exitosa(carga, resultado):
+    carga.estado = 'success'
+    carga.registros_creados = resultado['creadas']
+    carga.filas_procesadas = resultado['filas']
+    carga.save(update_fields=['estado', 'registros_creados', 'filas_procesadas'])
+
+
+def _cargar_postgres(filas, carga, tamano_bloque, progreso, confirmar):
+    q = connection.ops.quote_name
+    opts = models.Comision._meta
+    # Varias tareas pueden cargar bloques de la misma carga a la vez
+    tabla = q(f'{opts.db_table}_paso_{carga.id}_{uuid.uuid4().hex[:8]}')
+    columnas_paso = ', '.join(q(c) for c in COLUMNAS_COMISION)
+    columnas_destino = ', '.join(q(opts.get_field(c).column) for c in COLUMNAS_COMISION)
+    largos, tope = _limites()
+
+    condiciones_invalidas = [
+        f'char_length({q(COLUMNAS_COMISION[i])}) > {largo}' for i, largo in largos.items()
+    ] + [f'abs({q("comision_final")}) >= {tope}']
+
+    resultado = {}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE UNLOGGED TABLE {tabla} (fila bigserial, "
+            + ', '.join(f'{q(c)} {_tipo_paso(c)}' for c in COLUMNAS_COMISION)
+            + ")"
+        )
+        try:
+            sql_copy = f"COPY {tabla} ({columnas_paso}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+            leidas = 0
+            for bloque in _bloques(filas, tamano_bloque):
+                buffer = io.StringIO()
+                for fila in bloque:
+                    buffer.write(','.join(_valor_csv(v) for v in fila))
+                    buffer.write('\n')
+                buffer.seek(0)
+                cursor.copy_expert(sql_copy, buffer)
+                leidas += len(bloque)
+                progreso(leidas)
+            resultado['filas'] = leidas
+
+            # Filas que no caben en intranet_comision
+            cursor.execute(f"DELETE FROM {tabla} WHERE {' OR '.join(condiciones_invalidas)}")
+            resultado['descartadas'] = cursor.rowcount
+
+            # Filas repetidas (idénticas y con ICCID): se deja la primera
+            cursor.execute(
+                f"DELETE FROM {tabla} WHERE fila IN ("
+                f"  SELECT fila FROM ("
+                f"    SELECT fila, row_number() OVER (PARTITION BY {columnas_paso} ORDER BY fila) AS n"
+                f"    FROM {tabla} WHERE {q('iccid')} <> ''"
+                f"  ) repetidas WHERE n > 1"
+                f")"
+            )
+            resultado['duplicadas'] = cursor.rowcount
+
+            # Anti-join por la clave natural (índice hash): solo entran filas
+            # que no estaban en otra carga; las de la misma carga no cuentan,
+            # así el resultado no depende de cómo se repartió el archivo en
+            # bloques. RETURNING las agrupa para el resumen mensual.
+            clave = q('clave_natural')
+            columna_carga = q(opts.get_field('carga').column)
+            columnas_resumen = ', '.join(
+                q(opts.get_field(c).column) for c in resumen_comisiones.CLAVE
+            )
+            with transaction.atomic():
+                # Revisar e insertar es atómico frente a bloques de otras
+                # cargas: el candado se suelta al confirmar
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CANDADO_INSERCION])
+                cursor.execute(
+                    f"WITH nuevas AS ("
+                    f"  INSERT INTO {q(opts.db_table)} ({columnas_destino}, "
+                    f"  {columna_carga}, {q(opts.get_field('fecha_carga').column)}, {clave}) "
+                    f"  SELECT {columnas_paso}, %s, %s, {clave} FROM ("
+                    f"    SELECT p.*, {_sql_clave_natural('p')} AS {clave} FROM {tabla} p"
+                    f"  ) s "
+                    f"  WHERE s.{clave} IS NULL OR NOT EXISTS ("
+                    f"    SELECT 1 FROM {q(opts.db_table)} c WHERE c.{clave} = s.{clave} AND c.{columna_carga} <> %s"
+                    f"  ) ORDER BY s.fila"
+                    f"  RETURNING {columnas_resumen}, {q(opts.get_field('comision_final').column)}"
+                    f") "
+                    f"SELECT {columnas_resumen}, count(*), sum({q(opts.get_field('comision_final').column)}) "
+                    f"FROM nuevas GROUP BY {columnas_resumen}",
+                    [carga.id, timezone.now(), carga.id],
+                )
+                grupos = cursor.fetchall()
+                resumen_comisiones.aplicar(resumen_comisiones.desde_grupos(grupos))
+                resultado['creadas'] = sum(grupo[6] for grupo in grupos)
+                resultado['existentes'] = (
+                    leidas - resultado['descartadas'] - resultado['duplicadas'] - resultado['creadas']
+                )
+                confirmar(resultado)
+        finally:
+            cursor.execute(f"DROP TABLE IF EXISTS {tabla}")
+    return resultado
+
+
+# --- Otros motores: bulk_create por lotes ------------------------------------------
+
+def _filas_limpias(filas, resultado):
+    """Mismas reglas que en PostgreSQL, fila por fila."""
+    largos, tope = _limites()
+    indice_iccid = COLUMNAS_COMISION.index('iccid')
+    indice_comision = COLUMNAS_COMISION.index('comision_final')
+    vistas = set()
+    for fila in filas:
+        resultado['filas'] += 1
+        comision = fila[indice_comision]
+        if any(fila[i] is not None and len(str(fila[i])) > largo for i, largo in largos.items()) or (
+            comision is not None and abs(comision) >= tope
+        ):
+            resultado['descartadas'] += 1
+            continue
+        if fila[indice_iccid]:
+            if fila in vistas:
+                resultado['duplicadas'] += 1
+                continue
+            vistas.add(fila)
+        yield fila
+
+
+def _claves_existentes(claves, carga, tamano_consulta=500):
+    """Claves ya cargadas por otras cargas (las de `carga` no cuentan, como en PostgreSQL)."""
+    existentes = set()
+    claves = list(claves)
+    for i in range(0, len(claves), tamano_consulta):
+        existentes.update(
+            models.Comision.objects
+            .filter(clave_natural__in=claves[i:i + tamano_consulta])
+            .exclude(carga=carga)
+            .values_list('clave_natural', flat=True)
+        )
+    return existentes
+
+
+def _cargar_bulk_create(filas, carga, tamano_bloque, progreso, confirmar):
+    resultado = {'filas': 0, 'descartadas': 0, 'duplicadas': 0, 'existentes': 0, 'creadas': 0}
+    indices_clave = [COLUMNAS_COMISION.index(c) for c in ('iccid', 'producto', 'mes_pago', 'idpos')]
+    with transaction.atomic():
+        for bloque in _bloques(_filas_limpias(filas, resultado), tamano_bloque):
+            claves = [
+                clave_natural_comision(*(fila[i] for i in indices_clave)) if fila[indices_clave[0]] else None
+                for fila in bloque
+            ]
+            existentes = _claves_existentes({c for c in claves if c}, carga)
+            nuevas = [
+                models.Comision(**dict(zip(COLUMNAS_COMISION, fila)), carga=carga, clave_natural=clave)
+                for fila, clave in zip(bloque, claves)
+                if clave is None or clave not in existentes
+            ]
+            models.Comision.objects.bulk_create(nuevas)
+            resumen_comisiones.aplicar(resumen_comisiones.agrupar_filas(nuevas))
+            resultado['creadas'] += len(nuevas)
+            resultado['existentes'] += len(bloque) - len(nuevas)
+            progreso(resultado['filas'])
+        confirmar(resultado)
+    return resultado
+
+
+def _filas_por_segundo(filas, segundos):
+    return round(filas / segundos) if segundos > 0 else filas
+
+
+def cargar_comisiones(filas, carga, tamano_bloque=TAMANO_BLOQUE, progreso=None, confirmar=None):
+    """
+    Carga las tuplas como Comision de `carga` (ComisionCarga). Dentro de la
+    misma transacción que inserta las filas llama a `confirmar(resultado)`;
+    por defecto deja la carga en 'success' con los registros creados.
+
+    Las filas con ICCID cuya clave natural (iccid, producto, mes_pago,
+    idpos) ya está en Comision de otra carga no se insertan de nuevo.
+
+    `progreso(filas_procesadas, filas_por_segundo)` se llama después de cada
+    bloque. Devuelve estadísticas: filas leídas, descartadas (no caben en la
+    tabla), duplicadas (en el archivo), existentes (ya cargadas antes),
+    creadas, segundos y filas por segundo.
+    """
+    inicio = time.perf_counter()
+
+    def avance(procesadas):
+        if progreso is not None:
+            progreso(procesadas, _filas_por_segundo(procesadas, time.perf_counter() - inicio))
+
+    if confirmar is None:
+        def confirmar(resultado):
+            _marcar_exitosa(carga, resultado)
+
+    if connection.vendor == 'postgresql':
+        resultado = _cargar_postgres(filas, carga, tamano_bloque, avance, confirmar)
+    else:
+        resultado = _cargar_bulk_create(filas, carga, tamano_bloque, avance, confirmar)
+
+    segundos = time.perf_counter() - inicio
+    resultado['segundos'] = round(segundos, 3)
+    resultado['filas_por_segundo'] = _filas_por_segundo(resultado['filas'], segundos)
+    logger.info(
+        f"Carga de comisiones {carga.id}: {resultado['creadas']} de {resultado['filas']} filas "
+        f"({resultado['descartadas']} descartadas, {resultado['duplicadas']} duplicadas, "
+        f"{resultado['existentes']} ya existentes) "
+        f"en {resultado['segundos']}s ({resultado['filas_por_segundo']} filas/s)."
+    )
+    return resultado
@@ -0,0 +1,212 @@
+# intranet/ingesta_precios.py
+"""
+Ingesta de cargas de precios (guardar_precios).
+
+Las filas de la hoja se convierten en un generador de tuplas y se cargan en
+bloques acotados: en PostgreSQL con COPY FROM STDIN y en otros motores con
+bulk_create por lotes. Todo ocurre dentro de la misma transacción que crea
+la Carga, el snapshot y las excepciones de IVA.
+"""
+import decimal
+import io
+import logging
+import os
+import time
+from itertools import islice
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from django.db import connection, transaction
+
+from . import models
+from .motor_precios import normalize_string
+from .snapshot_precios import construir_snapshot_carga
+
+logger = logging.getLogger(__name__)
+
+TAMANO_BLOQUE = 5000
+COLUMNAS_COPY = ('carga', 'producto', 'producto_normalizado', 'nombre', 'valor')
+
+
+def iterar_filas_precios(cabecera, items, carga_id):
+    """
+    Recorre la hoja fila por fila y produce tuplas
+    (carga_id, producto, producto_normalizado, nombre, valor).
+    """
+    # Creamos un diccionario para mapear los nombres de la cabecera a sus índices
+    header_map = {item['text']: i for i, item in enumerate(cabecera)}
+    product_name_index = header_map.get('Equipo')
+    if product_name_index is None:
+        return
+
+    campos = [(nombre, index) for nombre, index in header_map.items() if nombre != 'Equipo']
+
+    for precio_row in items:
+        if product_name_index >= len(precio_row):
+            continue
+        producto = precio_row[product_name_index]
+        producto_normalizado = normalize_string(producto)[:100]
+
+        for nombre_campo, index in campos:
+            if index >= len(precio_row):
+                continue
+            valor_raw = precio_row[index]
+            if valor_raw is None:
+                continue
+            try:
+                # Limpiamos el valor de comas (,) y lo convertimos a un decimal
+                valor = decimal.Decimal(str(valor_raw).replace(',', ''))
+            except (decimal.InvalidOperation, ValueError):
+                logger.warning(
+                    f"Omitiendo valor inválido '{valor_raw}' "
+                    f"para el producto '{producto}' en el campo '{nombre_campo}'"
+                )
+                continue
+            yield (carga_id, producto, producto_normalizado, nombre_campo, valor)
+
+
+def _bloques(filas, tamano):
+    filas = iter(filas)
+    while True:
+        bloque = list(islice(filas, tamano))
+        if not bloque:
+            return
+        yield bloque
+
+
+def _valor_csv(valor):
+    if valor is None:
+        return '\\N'
+    return '"' + str(valor).replace('"', '""') + '"'
+
+
+def _copy_postgres(filas, tamano_bloque):
+    opts = models.Lista_precio._meta
+    columnas = ', '.join(
+        connection.ops.quote_name(opts.get_field(c).column) for c in COLUMNAS_COPY
+    )
+    sql = (
+        f"COPY {connection.ops.quote_name(opts.db_table)} ({columnas}) "
+        f"FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    )
+
+    total = 0
+    with connection.cursor() as cursor:
+        for bloque in _bloques(filas, tamano_bloque):
+            buffer = io.StringIO()
+            for fila in bloque:
+                buffer.write(','.join(_valor_csv(v) for v in fila))
+                buffer.write('\n')
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+            total += len(bloque)
+    return total
+
+
+def _bulk_create(filas, tamano_bloque):
+    total = 0
+    for bloque in _bloques(filas, tamano_bloque):
+        models.Lista_precio.objects.bulk_create([
+            models.Lista_precio(
+                carga_id=carga_id,
+                producto=producto,
+                producto_normalizado=producto_normalizado,
+                nombre=nombre,
+                valor=valor,
+            )
+            for carga_id, producto, producto_normalizado, nombre, valor in bloque
+        ])
+        total += len(bloque)
+    return total
+
+
+def cargar_filas_precios(filas, tamano_bloque=TAMANO_BLOQUE):
+    """Inserta las tuplas en Lista_precio por bloques. Devuelve cuántas filas cargó."""
+    if connection.vendor == 'postgresql':
+        return _copy_postgres(filas, tamano_bloque)
+    return _bulk_create(filas, tamano_bloque)
+
+
+def guardar_entradas_carga(carga, entradas):
+    """
+    Guarda las entradas de las fórmulas ([producto, valor, costo, descuento]
+    por producto) para poder recalcular la carga después.
+    """
+    registros = {}
+    for fila in entradas or []:
+        try:
+            producto, valor, costo, descuento = fila[:4]
+            valores = [decimal.Decimal(str(v if v not in (None, '') else 0)) for v in (valor, costo, descuento)]
+        except (decimal.InvalidOperation, ValueError, TypeError):
+            logger.warning(f"Omitiendo entrada inválida {fila!r}")
+            continue
+        if producto and producto not in registros:
+            registros[producto] = models.EntradaCarga(
+                carga=carga,
+                producto=producto,
+                producto_normalizado=normalize_string(producto)[:100],
+                valor=valores[0],
+                costo=valores[1],
+                descuento=valores[2],
+            )
+    models.EntradaCarga.objects.bulk_create(registros.values(), batch_size=TAMANO_BLOQUE)
+    return len(registros)
+
+
+def _rss_pico_mb():
+    """
+    Pico de RSS del proceso (getrusage): no instrumenta las asignaciones
+    como tracemalloc, así que sirve en cada petición. Es el pico de toda la
+    vida del proceso, no solo de esta carga.
+    """
+    if resource is None:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB; macOS en bytes
+    divisor = 1024 * 1024 if os.uname().sysname == 'Darwin' else 1024
+    return round(kb / divisor, 1)
+
+
+def guardar_carga_precios(cabecera, items, iva_excepciones, entradas=None):
+    """
+    Crea la Carga con sus Lista_precio, las entradas de las fórmulas, el
+    snapshot y las excepciones de IVA en una sola transacción.
+    Devuelve (carga, estadisticas).
+    """
+    inicio = time.perf_counter()
+
+    with transaction.atomic():
+        nueva_carga = models.Carga.objects.create()
+        filas = cargar_filas_precios(iterar_filas_precios(cabecera, items, nueva_carga.id))
+        segundos_carga = time.perf_counter() - inicio
+
+        guardar_entradas_carga(nueva_carga, entradas)
+        construir_snapshot_carga(nueva_carga)
+
+        # ==== guardar excepciones de IVA para prepago ====
+        if isinstance(iva_excepciones, list):
+            # Limpiamos vacíos / None
+            iva_excepciones_limpias = [p for p in iva_excepciones if p]
+
+            # Para prepago, pisamos las excepciones anteriores
+            models.IvaExcepcion.objects.filter(tipo='prepago').delete()
+            models.IvaExcepcion.objects.bulk_create([
+                models.IvaExcepcion(producto=p, tipo='prepago')
+                for p in iva_excepciones_limpias
+            ])
+
+    segundos_total = time.perf_counter() - inicio
+    estadisticas = {
+        'filas': filas,
+        'segundos': round(segundos_total, 3),
+        'filas_por_segundo': round(filas / segundos_carga) if segundos_carga > 0 else filas,
+        'rss_pico_mb': _rss_pico_mb(),
+    }
+    logger.info(
+        f"Carga de precios {nueva_carga.id}: {filas} filas en {estadisticas['segundos']}s "
+        f"({estadisticas['filas_por_segundo']} filas/s, RSS pico del proceso {estadisticas['rss_pico_mb']} MB)."
+    )
+    return nueva_carga, estadisticas
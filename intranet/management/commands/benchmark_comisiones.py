@@ -0,0 +1,298 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date
+from functools import wraps
+from statistics import median
+from unittest import mock
+
+from dateutil.relativedelta import relativedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from openpyxl import Workbook
+
+from intranet import models, tasks
+from intranet.benchmark import base_de_pruebas, escribir_resultados, metadatos
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASE_POR_DEFECTO = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'benchmarks', 'comisiones_base.json',
+)
+MESES = (
+    'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+    'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre',
+)
+COLUMNAS_EXCEL = (
+    'ASESOR', 'ICCID', 'DISTRIBUIDOR', 'PRODUCTO', 'CO_ID', 'PRIM_LLAMADA_ACTIVACION', 'MIN',
+    'IDPOS', 'PUNTO DE VENTA', 'RUTA', 'COMISION FINAL', 'PAGO', 'MES LIQUIDACIÓN', 'MES PAGO',
+)
+PRODUCTOS = ('PREPAGO', 'POSPAGO', 'PORTABILIDAD', 'KIT PREPAGO', 'RECARGA')
+FASES = ('lectura', 'transformacion', 'vencimiento', 'insercion')
+# Métricas del resumen que se comparan con la base: (clave, True si más es mejor)
+METRICAS = (
+    ('filas_por_segundo', True),
+    ('segundos', False),
+    ('consultas', False),
+    ('rss_pico_mb', False),
+) + tuple((f'fases.{fase}', False) for fase in FASES)
+
+
+def _mes_texto(mes):
+    return f'{MESES[mes.month - 1]} {mes.year}'
+
+
+def _rss_pico_mb():
+    """Pico de RSS del proceso (y de los procesos hijos que ya terminaron)."""
+    if resource is None:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux lo da en KB; macOS en bytes
+    divisor = 1024 * 1024 if os.uname().sysname == 'Darwin' else 1024
+    return round(kb / divisor, 1)
+
+
+def _valor(resumen, clave):
+    for parte in clave.split('.'):
+        resumen = (resumen or {}).get(parte)
+    return resumen
+
+
+class Cronometro:
+    """Acumula el tiempo de las funciones de tasks que corresponden a cada fase."""
+
+    def __init__(self):
+        self.segundos = defaultdict(float)
+
+    def funcion(self, fase, funcion):
+        @wraps(funcion)
+        def medida(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                self.segundos[fase] += time.perf_counter() - inicio
+        return medida
+
+    def generador(self, fase, funcion):
+        """Solo cuenta el tiempo dentro del generador, no el de quien lo consume."""
+        @wraps(funcion)
+        def medido(*args, **kwargs):
+            iterador = funcion(*args, **kwargs)
+            while True:
+                inicio = time.perf_counter()
+                try:
+                    valor = next(iterador)
+                except StopIteration:
+                    return
+                finally:
+                    self.segundos[fase] += time.perf_counter() - inicio
+                yield valor
+        return medido
+
+    def parches(self):
+        return [
+            mock.patch.object(tasks, 'leer_bloques_excel', self.generador('lectura', tasks.leer_bloques_excel)),
+            mock.patch.object(tasks, 'dividir_libro', self.funcion('lectura', tasks.dividir_libro)),
+            mock.patch.object(tasks, 'leer_bloque', self.funcion('lectura', tasks.leer_bloque)),
+            mock.patch.object(tasks, 'iterar_filas_comisiones', self.generador('transformacion', tasks.iterar_filas_comisiones)),
+            mock.patch.object(tasks, '_vencer_antes_de_cargar', self.funcion('vencimiento', tasks._vencer_antes_de_cargar)),
+            mock.patch.object(tasks, 'cargar_comisiones', self.funcion('carga', tasks.cargar_comisiones)),
+        ]
+
+    def fases(self):
+        # cargar_comisiones consume el generador de transformación: se descuenta
+        segundos = dict(self.segundos)
+        segundos['insercion'] = segundos.pop('carga', 0.0) - segundos.get('transformacion', 0.0)
+        return {fase: round(segundos.get(fase, 0.0), 3) for fase in FASES}
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera libros de liquidación sintéticos, los carga con procesar_archivo_comisiones en modo '
+        'eager sobre una base de pruebas y mide filas/s, pico de RSS, consultas SQL y tiempo por fase '
+        '(lectura, transformación, vencimiento, inserción). Compara con una base guardada en JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=20000, help='Filas por archivo.')
+        parser.add_argument('--hojas', type=int, default=1, help='Hojas por archivo (las filas se reparten).')
+        parser.add_argument('--asesores', type=int, default=200, help='Asesores distintos.')
+        parser.add_argument('--especiales', type=float, default=0.05, help='Proporción de filas sin ICCID ni PRODUCTO.')
+        parser.add_argument('--repeticiones', type=int, default=3, help='Archivos medidos, uno por mes consecutivo.')
+        parser.add_argument('--procesos', type=int, default=1, help='COMISIONES_PROCESOS_LECTURA durante la medición.')
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--salida', default='benchmark_comisiones.json', help='Archivo JSON de resultados.')
+        parser.add_argument('--base', default=BASE_POR_DEFECTO, help='JSON de referencia con el que se compara.')
+        parser.add_argument('--guardar-base', action='store_true', help='Guarda los resultados como nueva base.')
+
+    def handle(self, *args, **options):
+        for opcion in ('filas', 'hojas', 'asesores', 'repeticiones', 'procesos'):
+            if options[opcion] < 1:
+                raise CommandError(f'--{opcion} debe ser mayor que cero.')
+        if not 0 <= options['especiales'] < 1:
+            raise CommandError('--especiales debe estar entre 0 y 1.')
+
+        parametros = {
+            clave: options[clave]
+            for clave in ('filas', 'hojas', 'asesores', 'especiales', 'repeticiones', 'procesos', 'semilla')
+        }
+        self.parametros = parametros
+        self.aleatorio = random.Random(options['semilla'])
+        self.directorio = tempfile.mkdtemp(prefix='benchmark_comisiones_')
+        app = tasks.procesar_archivo_comisiones.app
+        configuracion_celery = {
+            clave: app.conf[clave] for clave in ('task_always_eager', 'task_eager_propagates', 'result_backend')
+        }
+
+        try:
+            app.conf.update(task_always_eager=True, task_eager_propagates=True, result_backend='cache+memory://')
+            with base_de_pruebas(verbosidad=max(options['verbosity'] - 1, 0)) as nombre_bd, \
+                    override_settings(COMISIONES_PROCESOS_LECTURA=options['procesos']):
+                self.stdout.write(self.style.NOTICE(f'Base de pruebas: {nombre_bd}'))
+                contenido = {'meta': metadatos(parametros), 'resultados': self._medir(options)}
+        finally:
+            app.conf.update(configuracion_celery)
+            shutil.rmtree(self.directorio, ignore_errors=True)
+
+        contenido['comparacion'] = self._comparar(options['base'], contenido['resultados']['resumen'])
+        escribir_resultados(options['salida'], contenido)
+        self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['salida']}"))
+        if options['guardar_base']:
+            escribir_resultados(options['base'], {key: contenido[key] for key in ('meta', 'resultados')})
+            self.stdout.write(self.style.SUCCESS(f"Base actualizada en {options['base']}"))
+
+    # --- Datos sintéticos ------------------------------------------------------
+
+    def _generar_libro(self, mes, n_filas, n_hojas, n_asesores, especiales, desde):
+        """Libro de liquidación de `mes`; los ICCID empiezan en `desde` para no repetir filas."""
+        libro = Workbook(write_only=True)
+        por_hoja = -(-n_filas // n_hojas)
+        mes_pago = _mes_texto(mes)
+        mes_liquidacion = _mes_texto(mes - relativedelta(months=1))
+        activacion = (mes - relativedelta(months=1) - date(1899, 12, 30)).days
+        for h in range(n_hojas):
+            hoja = libro.create_sheet(f'Hoja{h + 1}')
+            hoja.append(COLUMNAS_EXCEL)
+            for i in range(h * por_hoja, min((h + 1) * por_hoja, n_filas)):
+                especial = self.aleatorio.random() < especiales
+                pdv = self.aleatorio.randrange(n_asesores * 20)
+                hoja.append((
+                    f'asesor{self.aleatorio.randrange(n_asesores):05d}',
+                    None if especial else f'8957{desde + i:015d}',
+                    'DISTRIBUIDOR BENCHMARK',
+                    None if especial else self.aleatorio.choice(PRODUCTOS),
+                    f'{self.aleatorio.randrange(10 ** 8):08d}',
+                    activacion + self.aleatorio.randrange(28),
+                    f'3{self.aleatorio.randrange(10 ** 9):09d}',
+                    f'{100000 + pdv}',
+                    f'PUNTO {pdv}',
+                    f'RUTA {pdv % 50:02d}',
+                    round(self.aleatorio.uniform(1000, 60000), 2),
+                    'Acumulado' if especial or self.aleatorio.random() < 0.1 else 'Pago',
+                    mes_liquidacion,
+                    mes_pago,
+                ))
+        ruta = os.path.join(self.directorio, f'liquidacion_{mes:%Y_%m}.xlsx')
+        libro.save(ruta)
+        return ruta
+
+    # --- Medición --------------------------------------------------------------
+
+    def _cargar(self, ruta, usuario):
+        resultado = tasks.procesar_archivo_comisiones.delay(ruta, usuario.id, os.path.basename(ruta)).get()
+        carga = models.ComisionCarga.objects.order_by('-id').first()
+        if carga is None or carga.estado != 'success':
+            raise CommandError(f'La carga de {os.path.basename(ruta)} no terminó bien: {resultado}')
+        return carga
+
+    def _medir(self, options):
+        User.objects.bulk_create([User(username=f'asesor{i:05d}') for i in range(options['asesores'])])
+        usuario = User.objects.create(username='benchmark')
+        mes = date(2025, 1, 1)
+
+        def generar(mes, repeticion):
+            return self._generar_libro(
+                mes, options['filas'], options['hojas'], options['asesores'], options['especiales'],
+                repeticion * options['filas'],
+            )
+
+        # El primer mes solo deja comisiones abiertas para que el vencimiento tenga trabajo
+        self.stdout.write('Cargando el mes previo...')
+        self._cargar(generar(mes, 0), usuario)
+
+        corridas = []
+        for repeticion in range(1, options['repeticiones'] + 1):
+            mes += relativedelta(months=1)
+            self.stdout.write(f'Generando {_mes_texto(mes)} ({options["filas"]} filas)...')
+            ruta = generar(mes, repeticion)
+
+            cronometro = Cronometro()
+            parches = cronometro.parches()
+            for parche in parches:
+                parche.start()
+            try:
+                inicio = time.perf_counter()
+                with CaptureQueriesContext(connection) as consultas:
+                    carga = self._cargar(ruta, usuario)
+                segundos = time.perf_counter() - inicio
+            finally:
+                for parche in reversed(parches):
+                    parche.stop()
+
+            corrida = {
+                'mes': f'{mes:%Y-%m}',
+                'filas': options['filas'],
+                'creadas': carga.registros_creados,
+                'segundos': round(segundos, 3),
+                'filas_por_segundo': round(options['filas'] / segundos) if segundos > 0 else None,
+                'consultas': len(consultas.captured_queries),
+                'rss_pico_mb': _rss_pico_mb(),
+                'fases': cronometro.fases(),
+            }
+            corridas.append(corrida)
+            self.stdout.write(
+                f"  {corrida['filas_por_segundo']} filas/s, {corrida['consultas']} consultas, "
+                f"RSS {corrida['rss_pico_mb']} MB, fases {json.dumps(corrida['fases'])}"
+            )
+
+        resumen = {
+            clave: median(c[clave] for c in corridas)
+            for clave in ('segundos', 'filas_por_segundo', 'consultas')
+        }
+        resumen['rss_pico_mb'] = corridas[-1]['rss_pico_mb']
+        resumen['fases'] = {fase: round(median(c['fases'][fase] for c in corridas), 3) for fase in FASES}
+        return {'corridas': corridas, 'resumen': resumen}
+
+    def _comparar(self, ruta_base, resumen):
+        if not ruta_base or not os.path.exists(ruta_base):
+            self.stdout.write(self.style.WARNING('No hay base para comparar.'))
+            return None
+        with open(ruta_base, encoding='utf-8') as archivo:
+            base = json.load(archivo)
+
+        self.stdout.write(f"Comparación con {ruta_base} (commit {base['meta'].get('commit')}, {base['meta'].get('motor_bd')}):")
+        if base['meta'].get('parametros') != self.parametros:
+            self.stdout.write(self.style.WARNING(f"  La base se midió con otros parámetros: {base['meta'].get('parametros')}"))
+        comparacion = {}
+        for clave, mas_es_mejor in METRICAS:
+            anterior = _valor(base['resultados']['resumen'], clave)
+            actual = _valor(resumen, clave)
+            if not anterior or actual is None:
+                continue
+            cambio = round((actual - anterior) / anterior * 100, 1)
+            comparacion[clave] = {'base': anterior, 'actual': actual, 'cambio_pct': cambio}
+            mejora = cambio >= 0 if mas_es_mejor else cambio <= 0
+            estilo = self.style.SUCCESS if mejora else self.style.WARNING
+            self.stdout.write(estilo(f'  {clave}: {anterior} -> {actual} ({cambio:+}%)'))
+        return comparacion
@@ -0,0 +1,160 @@
+import random
+
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory
+
+from intranet import models, views
+from intranet.benchmark import base_de_pruebas, escribir_resultados, medir, metadatos
+from intranet.formulas import invalidar_motor, obtener_motor
+from intranet.ingesta_precios import guardar_carga_precios
+from intranet.motor_precios import calcular_matriz_prepago
+
+MARCAS = ('SAMSUNG', 'XIAOMI', 'MOTOROLA', 'APPLE', 'HONOR', 'OPPO', 'TECNO', 'ZTE')
+LISTAS_BASE = (
+    'Precio publico', 'Precio sub', 'Precio premium', 'Precio Fintech',
+    'Precio Addi', 'Precio Adelantos Valle', 'Costo',
+)
+PUNTOS_DE_ENTRADA = ('translate_prepago', 'buscar_precios', 'guardar_precios', 'motor_de_evaluacion_recursivo')
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide translate_prepago, buscar_precios, guardar_precios y motor_de_evaluacion_recursivo '
+        'sobre un catálogo sintético en una base de pruebas y guarda los resultados en JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=500, help='Productos del catálogo (N).')
+        parser.add_argument('--listas', type=int, default=6, help='Listas de precios con fórmula (M).')
+        parser.add_argument('--cargas', type=int, default=5, help='Cargas históricas previas (K).')
+        parser.add_argument('--repeticiones', type=int, default=10, help='Llamadas medidas por punto de entrada.')
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--solo', nargs='+', choices=PUNTOS_DE_ENTRADA, help='Mide solo estos puntos de entrada.')
+        parser.add_argument('--salida', default='benchmark_precios.json', help='Archivo JSON de resultados.')
+
+    def handle(self, *args, **options):
+        for opcion in ('productos', 'listas', 'cargas', 'repeticiones'):
+            if options[opcion] < 1:
+                raise CommandError(f'--{opcion} debe ser mayor que cero.')
+
+        parametros = {
+            'productos': options['productos'],
+            'listas': options['listas'],
+            'cargas': options['cargas'],
+            'repeticiones': options['repeticiones'],
+            'semilla': options['semilla'],
+        }
+        puntos = options['solo'] or PUNTOS_DE_ENTRADA
+
+        with base_de_pruebas(verbosidad=max(options['verbosity'] - 1, 0)) as nombre_bd:
+            self.stdout.write(self.style.NOTICE(f'Base de pruebas: {nombre_bd}'))
+            self.aleatorio = random.Random(options['semilla'])
+            self.factory = APIRequestFactory()
+
+            self.stdout.write('Generando catálogo sintético...')
+            self._generar_catalogo(options['productos'], options['listas'], options['cargas'])
+
+            contenido = {'meta': metadatos(parametros), 'resultados': {}}
+            for punto in puntos:
+                self.stdout.write(f'Midiendo {punto}...')
+                resultado = medir(getattr(self, f'_caso_{punto}'), options['repeticiones'])
+                contenido['resultados'][punto] = resultado
+                latencia = resultado['latencia_ms']
+                self.stdout.write(
+                    f"  p50 {latencia['p50']} ms, p95 {latencia['p95']} ms, "
+                    f"{resultado['consultas']} consultas, pico {resultado['memoria_pico_mb']} MB"
+                )
+
+        escribir_resultados(options['salida'], contenido)
+        self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['salida']}"))
+
+    # --- Datos sintéticos ------------------------------------------------------
+
+    def _generar_catalogo(self, n_productos, n_listas, n_cargas):
+        usuario = User.objects.create(username='benchmark')
+        nombres_listas = list(LISTAS_BASE[:n_listas]) + [
+            f'Precio sintetico {i}' for i in range(max(n_listas - len(LISTAS_BASE), 0))
+        ]
+
+        # La primera lista es la global (ID_PRECIO_GLOBAL): sus variables aplican a todas
+        permisos = [models.Permisos_precio.objects.create(permiso=nombre, active=True) for nombre in nombres_listas]
+        models.Variables_prices.objects.create(price=permisos[0], name='margen', formula="['1.12']")
+        models.Variables_prices.objects.create(price=permisos[0], name='ajuste', formula="['0']")
+        for i, permiso in enumerate(permisos[1:], start=1):
+            models.Variables_prices.objects.create(price=permiso, name='ajuste', formula=f"['{1000 * i}']")
+            models.Variables_prices.objects.create(
+                price=permiso, name='tope', formula="['min', '(', 'Valor', '*', '0.95', ',', 'Costo', '*', 'margen', ')']"
+            )
+
+        # Ids altos para que ninguna fórmula caiga en la sintaxis antigua
+        for i, (nombre, permiso) in enumerate(zip(nombres_listas, permisos)):
+            if i == 0:
+                texto = "['Valor', '-', 'Descuento']"
+            else:
+                texto = "['(', 'tope', '+', 'ajuste', ')', 'if', 'Valor', '>', '1000000', 'else', '(', 'Costo', '*', 'margen', '+', 'ajuste', ')']"
+            models.Formula.objects.create(
+                id=100 + i, price_id=permiso, nombre=nombre, formula=texto, usuario=usuario
+            )
+        invalidar_motor()
+
+        self.catalogo = []
+        traducciones = []
+        for i in range(n_productos):
+            marca = MARCAS[i % len(MARCAS)]
+            stok = f'{marca} MODELO {i:05d} {self.aleatorio.choice((64, 128, 256))}GB'
+            valor = self.aleatorio.randrange(300000, 4000000, 1000)
+            costo = int(valor * self.aleatorio.uniform(0.7, 0.9))
+            descuento = self.aleatorio.choice((0, 0, 0, 50000))
+            self.catalogo.append([f'{stok} ORIGEN', valor, descuento, costo])
+            traducciones.append(models.Traducciones(
+                equipo=f'{stok} ORIGEN', stok=stok, iva=False, active=True, tipo='prepago'
+            ))
+        for traduccion in traducciones:
+            traduccion.save()
+
+        self.nombres_listas = nombres_listas
+        self.precios = list(models.Formula.objects.order_by('id'))
+        for _ in range(n_cargas):
+            guardar_carga_precios(*self._matriz_variada(), [])
+
+    def _matriz_variada(self):
+        """Matriz de precios del catálogo con una variación aleatoria de ±5 %."""
+        filas = [
+            {
+                'stok': equipo.replace(' ORIGEN', ''),
+                'valor': valor * self.aleatorio.uniform(0.95, 1.05),
+                'descuento': descuento,
+                'costo': costo,
+            }
+            for equipo, valor, descuento, costo in self.catalogo
+        ]
+        compiladas = {precio.id: obtener_motor().compilar(precio.nombre) for precio in self.precios}
+        return calcular_matriz_prepago(pd.DataFrame(filas), self.precios, compiladas, set())
+
+    # --- Casos -----------------------------------------------------------------
+
+    def _caso_translate_prepago(self, i):
+        respuesta = views.translate_prepago(self.factory.post('/translate-prepago', self.catalogo, format='json'))
+        assert respuesta.status_code == 200 and respuesta.data['validate'], respuesta.data
+
+    def _caso_buscar_precios(self, i):
+        filtros = {'listas_precios': self.nombres_listas}
+        if i % 2:
+            filtros['marcas'] = [MARCAS[i % len(MARCAS)]]
+        respuesta = views.buscar_precios(self.factory.post('/buscar_precios', {'filtros': filtros}, format='json'))
+        assert respuesta.status_code == 200, respuesta.data
+
+    def _caso_guardar_precios(self, i):
+        cabecera, items = self._matriz_variada()
+        respuesta = views.guardar_precios(
+            self.factory.post('/guardar-precios', {'cabecera': cabecera, 'items': items}, format='json')
+        )
+        assert respuesta.status_code == 200, respuesta.data
+
+    def _caso_motor_de_evaluacion_recursivo(self, i):
+        equipo, valor, descuento, costo = self.catalogo[i % len(self.catalogo)]
+        contexto = {'Valor': float(valor), 'Costo': float(costo), 'Descuento': float(descuento), 'iva': 1152228}
+        for precio in self.precios:
+            views.motor_de_evaluacion_recursivo(precio.formula, precio.price_id_id, contexto)
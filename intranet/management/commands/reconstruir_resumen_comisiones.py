@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from intranet import resumen_comisiones
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye ComisionResumenMensual desde Comision o verifica que coincidan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo compara el resumen con Comision; termina con error si hay diferencias.'
+        )
+
+    def handle(self, *args, **options):
+        if options['verificar']:
+            diferencias = resumen_comisiones.diferencias()
+            for clave, (guardado, real) in sorted(diferencias.items(), key=str)[:50]:
+                self.stdout.write(f'  {clave}: resumen {guardado} / Comision {real}')
+            if diferencias:
+                raise CommandError(f'El resumen tiene {len(diferencias)} grupo(s) distintos de Comision.')
+            self.stdout.write(self.style.SUCCESS('El resumen coincide con Comision.'))
+            return
+
+        grupos = resumen_comisiones.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'Resumen reconstruido: {grupos} grupo(s).'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from intranet.models import Carga
+from intranet.snapshot_precios import construir_snapshot_carga
+
+
+class Command(BaseCommand):
+    help = 'Construye la tabla PrecioSnapshot para cargas de precios históricas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carga', type=int, help='Reconstruye solo la carga con este ID.')
+        parser.add_argument(
+            '--todas',
+            action='store_true',
+            help='Reconstruye también las cargas que ya tienen snapshot.'
+        )
+
+    def handle(self, *args, **options):
+        cargas = Carga.objects.order_by('fecha_carga')
+
+        if options['carga']:
+            cargas = cargas.filter(id=options['carga'])
+            if not cargas.exists():
+                raise CommandError(f"La carga con ID {options['carga']} no existe.")
+        elif not options['todas']:
+            cargas = cargas.filter(snapshots__isnull=True).distinct()
+
+        total_cargas = cargas.count()
+        if not total_cargas:
+            self.stdout.write(self.style.SUCCESS('No hay cargas pendientes por procesar.'))
+            return
+
+        self.stdout.write(self.style.NOTICE(f'Procesando {total_cargas} carga(s)...'))
+        total_filas = 0
+        for carga in cargas.iterator():
+            filas = construir_snapshot_carga(carga)
+            total_filas += filas
+            self.stdout.write(f'  {carga} -> {filas} filas')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Snapshot completado: {total_filas} filas en {total_cargas} carga(s).'
+        ))
@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
+from django.db import transaction
+from intranet import resumen_comisiones
 from intranet.models import Comision, Configuracion # Ajusta la ruta a tus modelos
 
 class Command(BaseCommand):
@@ -33,8 +35,10 @@ class Command(BaseCommand):
             
             comisiones_para_actualizar = Comision.objects.filter(estado__in=estados_a_vencer)
             
-            # .update() es una operación masiva y muy eficiente
-            num_actualizadas = comisiones_para_actualizar.update(estado='Vencida')
+            # .update() es una operación masiva y muy eficiente; el resumen mensual se mueve en la misma transacción
+            with transaction.atomic():
+                resumen_comisiones.mover(comisiones_para_actualizar, estado='Vencida')
+                num_actualizadas = comisiones_para_actualizar.update(estado='Vencida')
 
             if num_actualizadas > 0:
                 self.stdout.write(self.style.SUCCESS(f"¡Éxito! Se actualizaron {num_actualizadas} comisiones a estado 'Vencida'."))
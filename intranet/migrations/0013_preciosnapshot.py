@@ -0,0 +1,46 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0012_alter_comision_comision_final_comisioncarga_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecioSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('producto', models.CharField(max_length=100, null=True)),
+                ('producto_normalizado', models.CharField(blank=True, default='', max_length=100)),
+                ('nombre', models.CharField(max_length=100, null=True)),
+                ('valor', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('iva_equipo', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('kits', models.JSONField(default=list)),
+                ('costo', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('descuento', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('es_promo', models.BooleanField(default=False)),
+                ('valor_anterior', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('kits_anteriores', models.JSONField(default=list)),
+                ('costo_anterior', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('descuento_anterior', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('indicador', models.CharField(default='neutral', max_length=10)),
+                ('diferencial', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('porcentaje', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('carga', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='intranet.carga')),
+                ('carga_anterior', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='intranet.carga')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['carga', 'nombre', 'producto_normalizado'], name='snapshot_carga_nombre_idx'), models.Index(fields=['producto_normalizado', 'nombre'], name='snapshot_producto_nombre_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='preciosnapshot',
+            constraint=models.UniqueConstraint(fields=('carga', 'producto', 'nombre'), name='unique_snapshot_carga_producto_nombre'),
+        ),
+    ]
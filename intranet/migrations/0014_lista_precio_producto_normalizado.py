@@ -0,0 +1,50 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:49
+
+import re
+
+from django.db import migrations, models
+
+
+def normalizar(s):
+    # Copia de motor_precios.normalize_string para que la migración no dependa del código actual
+    if not isinstance(s, str):
+        return ""
+    s = re.sub(r'[\s\xa0-]+', ' ', s).strip()
+    return s.lower()[:100]
+
+
+def llenar_producto_normalizado(apps, schema_editor):
+    Lista_precio = apps.get_model('intranet', 'Lista_precio')
+    pendientes = []
+    for precio in Lista_precio.objects.only('id', 'producto').iterator(chunk_size=5000):
+        precio.producto_normalizado = normalizar(precio.producto)
+        pendientes.append(precio)
+        if len(pendientes) >= 5000:
+            Lista_precio.objects.bulk_update(pendientes, ['producto_normalizado'])
+            pendientes = []
+    if pendientes:
+        Lista_precio.objects.bulk_update(pendientes, ['producto_normalizado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0013_preciosnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lista_precio',
+            name='producto_normalizado',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.RunPython(llenar_producto_normalizado, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='lista_precio',
+            index=models.Index(fields=['carga', 'nombre', 'producto_normalizado'], name='lp_carga_nombre_prod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lista_precio',
+            index=models.Index(fields=['producto_normalizado', 'nombre', 'carga'], name='lp_prod_nombre_carga_idx'),
+        ),
+    ]
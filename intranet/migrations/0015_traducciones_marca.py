@@ -0,0 +1,54 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:55
+
+import re
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+def marca(stok):
+    # Copia de motor_precios.marca_de_producto para que la migración no dependa del código actual
+    if not isinstance(stok, str):
+        return ''
+    normalizado = re.sub(r'[\s\xa0-]+', ' ', stok).strip().lower()
+    return normalizado.split(' ')[0].upper()[:100] if normalizado else ''
+
+
+def llenar_marca(apps, schema_editor):
+    Traducciones = apps.get_model('intranet', 'Traducciones')
+    pendientes = []
+    for traduccion in Traducciones.objects.only('id', 'stok').iterator(chunk_size=5000):
+        traduccion.marca = marca(traduccion.stok)
+        pendientes.append(traduccion)
+        if len(pendientes) >= 5000:
+            Traducciones.objects.bulk_update(pendientes, ['marca'])
+            pendientes = []
+    if pendientes:
+        Traducciones.objects.bulk_update(pendientes, ['marca'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0014_lista_precio_producto_normalizado'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='traducciones',
+            name='marca',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100),
+        ),
+        migrations.RunPython(llenar_marca, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='traducciones',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('equipo'), name='gin_trgm_ops'), name='trad_equipo_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='traducciones',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('stok'), name='gin_trgm_ops'), name='trad_stok_trgm_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0015_traducciones_marca'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntradaCarga',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('producto', models.CharField(max_length=255)),
+                ('producto_normalizado', models.CharField(blank=True, default='', max_length=100)),
+                ('valor', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('costo', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('descuento', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('carga', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entradas', to='intranet.carga')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='entradacarga',
+            constraint=models.UniqueConstraint(fields=('carga', 'producto'), name='unique_entrada_carga_producto'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0016_entradacarga'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comisioncarga',
+            name='filas_por_segundo',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comisioncarga',
+            name='filas_procesadas',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
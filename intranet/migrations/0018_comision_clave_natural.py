@@ -0,0 +1,55 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:06
+
+import hashlib
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+def clave(iccid, producto, mes_pago, idpos):
+    # Copia de ingesta_comisiones.clave_natural_comision para que la migración no dependa del código actual
+    texto = f"{iccid}|{producto or ''}|{mes_pago.isoformat() if mes_pago else ''}|{idpos}"
+    return hashlib.md5(texto.encode('utf-8')).hexdigest()
+
+
+def llenar_clave_natural(apps, schema_editor):
+    Comision = apps.get_model('intranet', 'Comision')
+    pendientes = []
+    filas = Comision.objects.exclude(iccid='').only('id', 'iccid', 'producto', 'mes_pago', 'idpos')
+    for comision in filas.iterator(chunk_size=5000):
+        comision.clave_natural = clave(comision.iccid, comision.producto, comision.mes_pago, comision.idpos)
+        pendientes.append(comision)
+        if len(pendientes) >= 5000:
+            Comision.objects.bulk_update(pendientes, ['clave_natural'])
+            pendientes = []
+    if pendientes:
+        Comision.objects.bulk_update(pendientes, ['clave_natural'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0017_comisioncarga_progreso'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comision',
+            name='clave_natural',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='comisioncarga',
+            name='hash_archivo',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(llenar_clave_natural, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comision',
+            index=django.contrib.postgres.indexes.HashIndex(fields=['clave_natural'], name='comision_clave_hash_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='comisioncarga',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado__in', ['processing', 'success'])), fields=('hash_archivo',), name='unique_comisioncarga_hash_vigente'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0018_comision_clave_natural'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pagocomision',
+            index=models.Index(fields=['idpos', 'fecha_pago'], name='pagocomision_idpos_fecha_idx'),
+        ),
+    ]
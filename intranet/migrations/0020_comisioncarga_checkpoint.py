@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0019_pagocomision_idpos_fecha'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comisioncarga',
+            name='checkpoint',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='comisioncarga',
+            name='ruta_archivo',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+    ]
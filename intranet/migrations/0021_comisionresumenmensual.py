@@ -0,0 +1,65 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:18
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def llenar_resumen(apps, schema_editor):
+    Comision = apps.get_model('intranet', 'Comision')
+    Resumen = apps.get_model('intranet', 'ComisionResumenMensual')
+    grupos = (
+        Comision.objects.order_by()
+        .values('mes_pago', 'ruta', 'idpos', 'asesor_identificador', 'producto', 'estado')
+        .annotate(cantidad=Count('id'), total=Sum('comision_final'))
+    )
+    # ruta y producto nulos se juntan con '' (igual que resumen_comisiones)
+    acumulado = {}
+    for g in grupos.iterator(chunk_size=5000):
+        clave = (g['mes_pago'], g['ruta'] or '', g['idpos'] or '', g['asesor_identificador'] or '',
+                 g['producto'] or '', g['estado'])
+        cantidad, total = acumulado.get(clave, (0, 0))
+        acumulado[clave] = (cantidad + g['cantidad'], total + (g['total'] or 0))
+    Resumen.objects.bulk_create(
+        [
+            Resumen(mes_pago=c[0], ruta=c[1], idpos=c[2], asesor_identificador=c[3], producto=c[4],
+                    estado=c[5], cantidad=cantidad, total=total)
+            for c, (cantidad, total) in acumulado.items()
+        ],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0020_comisioncarga_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComisionResumenMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes_pago', models.DateField(blank=True, null=True)),
+                ('ruta', models.CharField(blank=True, default='', max_length=100)),
+                ('idpos', models.CharField(max_length=50)),
+                ('asesor_identificador', models.CharField(max_length=250)),
+                ('producto', models.CharField(blank=True, default='', max_length=100)),
+                ('estado', models.CharField(max_length=20)),
+                ('cantidad', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ruta', 'mes_pago'], name='resumen_comision_ruta_mes_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='comisionresumenmensual',
+            constraint=models.UniqueConstraint(condition=models.Q(('mes_pago__isnull', False)), fields=('mes_pago', 'ruta', 'idpos', 'asesor_identificador', 'producto', 'estado'), name='unique_resumen_comision_mes'),
+        ),
+        migrations.AddConstraint(
+            model_name='comisionresumenmensual',
+            constraint=models.UniqueConstraint(condition=models.Q(('mes_pago__isnull', True)), fields=('ruta', 'idpos', 'asesor_identificador', 'producto', 'estado'), name='unique_resumen_comision_sin_mes'),
+        ),
+        migrations.RunPython(llenar_resumen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:21
+
+from django.db import migrations, models
+from decimal import Decimal, InvalidOperation
+
+import django.db.models.deletion
+
+
+def llenar_metodos(apps, schema_editor):
+    PagoComision = apps.get_model('intranet', 'PagoComision')
+    PagoComisionMetodo = apps.get_model('intranet', 'PagoComisionMetodo')
+    filas = []
+    for pago_id, metodos in PagoComision.objects.values_list('id', 'metodos_pago').iterator(chunk_size=5000):
+        if not isinstance(metodos, dict):
+            continue
+        for metodo, valor in metodos.items():
+            try:
+                valor = Decimal(str(valor)).quantize(Decimal('0.01'))
+            except (InvalidOperation, ValueError, TypeError):
+                valor = Decimal('0')
+            filas.append(PagoComisionMetodo(pago_id=pago_id, metodo=str(metodo)[:100], valor=valor))
+        if len(filas) >= 5000:
+            PagoComisionMetodo.objects.bulk_create(filas)
+            filas = []
+    PagoComisionMetodo.objects.bulk_create(filas)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0021_comisionresumenmensual'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PagoComisionMetodo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metodo', models.CharField(max_length=100)),
+                ('valor', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('pago', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metodos', to='intranet.pagocomision')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pagocomisionmetodo',
+            constraint=models.UniqueConstraint(fields=('pago', 'metodo'), name='unique_pagocomision_metodo'),
+        ),
+        migrations.RunPython(llenar_metodos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0022_pagocomisionmetodo'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comision',
+            index=models.Index(models.OrderBy(models.F('prim_llamada_activacion'), descending=True), models.OrderBy(models.F('fecha_carga'), descending=True), models.OrderBy(models.F('id'), descending=True), condition=models.Q(('estado__in', ['Pendiente', 'Acumulada']), models.Q(('pagos__isnull', True), ('producto__startswith', 'SALDO PENDIENTE'), _connector='OR')), name='comision_pendientes_keyset_idx'),
+        ),
+    ]
@@ -1,9 +1,16 @@
-from django.db import models
+from decimal import Decimal, InvalidOperation
+
+from django.db import models, transaction
 from django.contrib.auth.hashers import make_password, check_password
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.conf import settings
 
+from django.contrib.postgres.indexes import GinIndex, HashIndex, OpClass
+from django.db.models.functions import Upper
+
+from .motor_precios import marca_de_producto, normalize_string
+
 class Perfil(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     ruta_asignada = models.CharField(
@@ -22,8 +29,22 @@ class Traducciones(models.Model):
     iva = models.BooleanField()
     active = models.BooleanField()
     tipo = models.CharField(max_length=255)
+    # marca_de_producto(stok); se llena al guardar para filtrar marcas con IN
+    marca = models.CharField(max_length=100, blank=True, default='', db_index=True)
+
+    class Meta:
+        indexes = [
+            # Trigramas sobre UPPER(col): es la expresión que usa icontains en PostgreSQL
+            GinIndex(OpClass(Upper('equipo'), name='gin_trgm_ops'), name='trad_equipo_trgm_idx'),
+            GinIndex(OpClass(Upper('stok'), name='gin_trgm_ops'), name='trad_stok_trgm_idx'),
+        ]
+
     def __str__(self) -> str:
         return self.equipo
+
+    def save(self, *args, **kwargs):
+        self.marca = marca_de_producto(self.stok)[:100]
+        super().save(*args, **kwargs)
     
 class Permisos(models.Model):
     permiso = models.CharField(max_length=255, unique=True)
@@ -59,9 +80,87 @@ class Carga(models.Model):
 class Lista_precio(models.Model):
     carga = models.ForeignKey(Carga, on_delete=models.CASCADE, related_name='precios')
     producto = models.CharField(max_length=100, null=True)
+    # normalize_string(producto); se llena al insertar para no normalizar en cada consulta
+    producto_normalizado = models.CharField(max_length=100, blank=True, default='')
     nombre = models.CharField(max_length=100, null=True)
     valor = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['carga', 'nombre', 'producto_normalizado'], name='lp_carga_nombre_prod_idx'),
+            models.Index(fields=['producto_normalizado', 'nombre', 'carga'], name='lp_prod_nombre_carga_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.producto_normalizado = normalize_string(self.producto)[:100]
+        super().save(*args, **kwargs)
+
+class PrecioSnapshot(models.Model):
+    """
+    Precio de una lista en una carga, ya resuelto contra la carga anterior
+    (kits, costo, descuento, IVA, total y variación). Se construye al guardar
+    la carga y es lo que consulta buscar_precios.
+    """
+    carga = models.ForeignKey(Carga, on_delete=models.CASCADE, related_name='snapshots')
+    producto = models.CharField(max_length=100, null=True)
+    producto_normalizado = models.CharField(max_length=100, blank=True, default='')
+    nombre = models.CharField(max_length=100, null=True)
+
+    valor = models.DecimalField(max_digits=10, decimal_places=2)
+    iva_equipo = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    kits = models.JSONField(default=list)
+    costo = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    descuento = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    es_promo = models.BooleanField(default=False)
+
+    carga_anterior = models.ForeignKey(
+        Carga, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    valor_anterior = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    kits_anteriores = models.JSONField(default=list)
+    costo_anterior = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    descuento_anterior = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    indicador = models.CharField(max_length=10, default='neutral')
+    diferencial = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    porcentaje = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['carga', 'producto', 'nombre'],
+                name='unique_snapshot_carga_producto_nombre'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['carga', 'nombre', 'producto_normalizado'], name='snapshot_carga_nombre_idx'),
+            models.Index(fields=['producto_normalizado', 'nombre'], name='snapshot_producto_nombre_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto} - {self.nombre} ({self.carga_id})"
+
+class EntradaCarga(models.Model):
+    """
+    Valor, costo y descuento de origen de cada producto de una carga: lo que
+    recibieron las fórmulas. Permite recalcular listas sin volver a subir la hoja.
+    """
+    carga = models.ForeignKey(Carga, on_delete=models.CASCADE, related_name='entradas')
+    producto = models.CharField(max_length=255)
+    producto_normalizado = models.CharField(max_length=100, blank=True, default='')
+    valor = models.DecimalField(max_digits=14, decimal_places=2)
+    costo = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    descuento = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['carga', 'producto'], name='unique_entrada_carga_producto')
+        ]
+
+    def __str__(self):
+        return f"{self.producto} ({self.carga_id})"
+
 class Permisos_precio(models.Model):
     permiso = models.CharField(max_length=255, unique=True)
     active = models.BooleanField()
@@ -237,6 +336,51 @@ class PagoComision(models.Model):
         usuario = self.creado_por.username if self.creado_por else "Usuario Desconocido"
         return f"Pago por {usuario} de {self.monto_total_pagado} el {self.fecha_pago.strftime('%Y-%m-%d')}"
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.sincronizar_metodos()
+
+    def sincronizar_metodos(self):
+        """Copia metodos_pago en PagoComisionMetodo (una fila por método)."""
+        self.metodos.all().delete()
+        if isinstance(self.metodos_pago, dict):
+            PagoComisionMetodo.objects.bulk_create([
+                PagoComisionMetodo(pago=self, metodo=str(metodo)[:100], valor=PagoComisionMetodo.valor_decimal(valor))
+                for metodo, valor in self.metodos_pago.items()
+            ])
+
+    class Meta:
+        indexes = [
+            # "¿El PDV tuvo pagos en el período?" (vencimiento de comisiones)
+            models.Index(fields=['idpos', 'fecha_pago'], name='pagocomision_idpos_fecha_idx'),
+        ]
+
+
+class PagoComisionMetodo(models.Model):
+    """
+    metodos_pago de un PagoComision, una fila por método, para que las
+    gráficas de métodos de pago sean un GROUP BY. Lo escribe PagoComision.save().
+    """
+    pago = models.ForeignKey(PagoComision, on_delete=models.CASCADE, related_name='metodos')
+    metodo = models.CharField(max_length=100)
+    valor = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['pago', 'metodo'], name='unique_pagocomision_metodo')
+        ]
+
+    @staticmethod
+    def valor_decimal(valor):
+        try:
+            return Decimal(str(valor)).quantize(Decimal('0.01'))
+        except (InvalidOperation, ValueError, TypeError):
+            return Decimal('0')
+
+    def __str__(self):
+        return f"{self.metodo}: {self.valor} (pago {self.pago_id})"
+
 class Configuracion(models.Model):
     """Guarda pares clave-valor para ajustes generales del sistema."""
     clave = models.CharField(max_length=50, unique=True, primary_key=True)
@@ -274,6 +418,18 @@ class ComisionCarga(models.Model):
     registros_creados = models.PositiveIntegerField(default=0)
     detalle = models.TextField(blank=True, null=True)
 
+    # sha256 del archivo: el mismo archivo no se carga dos veces
+    hash_archivo = models.CharField(max_length=64, blank=True, null=True)
+
+    # Para reanudar una carga interrumpida: el archivo se conserva hasta que
+    # la carga termina y el checkpoint guarda qué pasos y bloques ya se confirmaron
+    ruta_archivo = models.CharField(max_length=500, blank=True, null=True)
+    checkpoint = models.JSONField(default=dict, blank=True)
+
+    # Avance mientras la tarea procesa el archivo
+    filas_procesadas = models.PositiveIntegerField(default=0)
+    filas_por_segundo = models.PositiveIntegerField(default=0)
+
     rolled_back_at = models.DateTimeField(null=True, blank=True)
     rolled_back_by = models.ForeignKey(
         User,
@@ -286,6 +442,16 @@ class ComisionCarga(models.Model):
     def __str__(self):
         return f"Carga #{self.id} - {self.file_name or 'sin_nombre'} - {self.estado}"
 
+    class Meta:
+        constraints = [
+            # Una carga revertida o con error no bloquea volver a subir el archivo
+            models.UniqueConstraint(
+                fields=['hash_archivo'],
+                condition=models.Q(estado__in=['processing', 'success']),
+                name='unique_comisioncarga_hash_vigente',
+            ),
+        ]
+
 class Comision(models.Model):
     carga = models.ForeignKey(
         "ComisionCarga",                 # <-- string para evitar problemas de orden
@@ -351,6 +517,10 @@ class Comision(models.Model):
 
     observacion = models.TextField(blank=True, null=True)
 
+    # md5 de (iccid, producto, mes_pago, idpos) de las filas que vienen del
+    # archivo; con esto una carga parcial repetida solo inserta filas nuevas
+    clave_natural = models.CharField(max_length=32, blank=True, null=True, editable=False)
+
     def __str__(self):
         return f"Comisión para {self.asesor_identificador} - ICCID: {self.iccid}"
 
@@ -358,6 +528,60 @@ class Comision(models.Model):
         verbose_name = "Comisión"
         verbose_name_plural = "Comisiones"
         ordering = ['-prim_llamada_activacion']
+        indexes = [
+            HashIndex(fields=['clave_natural'], name='comision_clave_hash_idx'),
+            # Listado de pendientes del admin (paginacion.ORDEN_COMISIONES):
+            # solo las filas de la vista por defecto, en el orden del listado
+            models.Index(
+                models.F('prim_llamada_activacion').desc(),
+                models.F('fecha_carga').desc(),
+                models.F('id').desc(),
+                name='comision_pendientes_keyset_idx',
+                condition=(
+                    models.Q(estado__in=['Pendiente', 'Acumulada'])
+                    & (models.Q(pagos__isnull=True) | models.Q(producto__startswith='SALDO PENDIENTE'))
+                ),
+            ),
+        ]
+
+
+class ComisionResumenMensual(models.Model):
+    """
+    Cantidad y suma de comision_final de Comision por (mes_pago, ruta, idpos,
+    asesor_identificador, producto, estado). Lo mantienen en la misma
+    transacción quienes escriben en Comision (ver resumen_comisiones) y es lo
+    que leen los tableros. ruta y producto nulos se guardan como ''.
+    """
+    mes_pago = models.DateField(null=True, blank=True)
+    ruta = models.CharField(max_length=100, blank=True, default='')
+    idpos = models.CharField(max_length=50)
+    asesor_identificador = models.CharField(max_length=250)
+    producto = models.CharField(max_length=100, blank=True, default='')
+    estado = models.CharField(max_length=20)
+
+    cantidad = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['mes_pago', 'ruta', 'idpos', 'asesor_identificador', 'producto', 'estado'],
+                condition=models.Q(mes_pago__isnull=False),
+                name='unique_resumen_comision_mes',
+            ),
+            # NULL no choca con NULL en un índice único: las filas sin mes van aparte
+            models.UniqueConstraint(
+                fields=['ruta', 'idpos', 'asesor_identificador', 'producto', 'estado'],
+                condition=models.Q(mes_pago__isnull=True),
+                name='unique_resumen_comision_sin_mes',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['ruta', 'mes_pago'], name='resumen_comision_ruta_mes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.mes_pago} {self.ruta} {self.idpos} {self.estado}: {self.cantidad}"
         
 # ---------------- ROLES PARA COMISIONES ----------------
 
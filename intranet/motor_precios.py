@@ -0,0 +1,157 @@
+# intranet/motor_precios.py
+"""
+Reglas de precios prepago (IVA, kits) y cálculo por lotes de las listas.
+
+En vez de recorrer el catálogo fila por fila, cada fórmula compilada se
+evalúa una sola vez sobre las columnas completas (valor, costo, descuento)
+y las reglas de kits / IVA se aplican como máscaras de NumPy.
+"""
+import re
+from decimal import Decimal
+
+import numpy as np
+
+# Umbral (sin IVA) a partir del cual el equipo paga IVA.
+UMBRAL_IVA = 1152228
+TASA_IVA = 0.19
+# Simcard con IVA incluido (2000 * 1.19).
+SIMCARD_CON_IVA = 2380
+
+# (texto contenido en el nombre de la lista, columna de kit que genera)
+KITS_POR_LISTA = (
+    ('Precio Fintech', 'Kit Fintech'),
+    ('Precio Addi', 'Kit Addi'),
+    ('Precio premium', 'Kit Premium'),
+    ('Precio sub', 'Kit Sub'),
+    ('Precio Adelantos Valle', 'Kit Valle'),
+)
+
+# Listas donde lo que supera el umbral se pasa al kit.
+LISTAS_KIT_TOPE = ('Precio Fintech', 'Precio Addi', 'Precio Adelantos Valle')
+# Listas donde el kit es el IVA del precio calculado.
+LISTAS_KIT_IVA = ('Precio premium', 'Precio sub')
+
+
+# Función para normalizar cadenas
+def normalize_string(s):
+    if not isinstance(s, str):
+        return ""
+    s = re.sub(r'[\s\xa0-]+', ' ', s).strip()
+    return s.lower()
+
+
+def marca_de_producto(s):
+    """Marca de un producto: primera palabra normalizada, en mayúsculas."""
+    normalizado = normalize_string(s)
+    return normalizado.split(' ')[0].upper() if normalizado else ''
+
+
+def apply_iva_kit_rules(equipo_sin_iva, nombre_lista, kits_list, base_iva_excluido, TASA_IVA):
+    """
+    Función centralizada para aplicar las reglas de negocio del IVA y los Kits.
+    """
+    kits_modificados = [dict(k) for k in kits_list] # Crear una copia para no alterar los datos originales
+    iva_equipo = Decimal('0')
+
+    if equipo_sin_iva > base_iva_excluido:
+        # REGLA 1: Si el equipo supera el umbral del IVA.
+        iva_equipo = equipo_sin_iva * TASA_IVA
+        kit_iva_nombre = "kit " + nombre_lista.replace("Precio ", "").lower()
+        for kit in kits_modificados:
+            if kit.get('nombre', '').lower() == kit_iva_nombre:
+                kit['valor'] = 0.0 # Anula el kit correspondiente
+                break
+    else:
+        # REGLA 2: Si el equipo NO supera el umbral del IVA.
+        if nombre_lista.lower() == 'precio premium':
+            # CORRECCIÓN: Para "Precio Premium" bajo el umbral, no se hace ninguna modificación.
+            pass
+        else:
+            # REGLA 2.2 (GENERAL): Para otras listas, el IVA se representa en el "Kit Premium".
+            iva_as_kit_premium = equipo_sin_iva * TASA_IVA
+            kit_found = False
+            for kit in kits_modificados:
+                if kit.get('nombre', '').lower() == 'kit premium':
+                    kit['valor'] = float(iva_as_kit_premium)
+                    kit_found = True
+                    break
+            if not kit_found:
+                kits_modificados.append({'nombre': 'Kit Premium', 'valor': float(iva_as_kit_premium)})
+    
+    return iva_equipo, kits_modificados
+
+
+def kit_de_lista(nombre_lista):
+    """Nombre de la columna de kit que acompaña a la lista, o None."""
+    for clave, kit in KITS_POR_LISTA:
+        if clave in nombre_lista:
+            return kit
+    return None
+
+
+def construir_cabecera(precios):
+    """Cabecera de la matriz: Equipo, cada lista (con su kit si aplica) y descuento."""
+    cabecera = [{'text': 'Equipo', 'value': '0'}]
+    for precio in precios:
+        cabecera.append({'text': precio.nombre, 'value': str(len(cabecera))})
+        kit = kit_de_lista(precio.nombre)
+        if kit:
+            cabecera.append({'text': kit, 'value': str(len(cabecera))})
+    cabecera.append({'text': 'descuento', 'value': str(len(cabecera))})
+    return cabecera
+
+
+def aplicar_reglas_kit(nombre_lista, resultado, valor, forzar_iva, iva=UMBRAL_IVA):
+    """
+    Aplica las reglas de kit/IVA de una lista sobre columnas completas.
+    Devuelve (resultado, kit); kit es None si la lista no lleva columna de kit.
+    """
+    if any(clave in nombre_lista for clave in LISTAS_KIT_TOPE):
+        # El umbral mezcla el precio calculado + simcard con el valor original.
+        mascara = (resultado + SIMCARD_CON_IVA >= iva) & (valor < iva)
+        kit = np.where(mascara, resultado - iva + SIMCARD_CON_IVA, 0.0)
+        resultado = np.where(mascara, iva - SIMCARD_CON_IVA, resultado)
+        return resultado, kit
+
+    if any(clave in nombre_lista for clave in LISTAS_KIT_IVA):
+        mascara = (valor >= iva) | forzar_iva
+        return resultado, np.where(mascara, resultado * TASA_IVA, 0.0)
+
+    return resultado, None
+
+
+def calcular_matriz_prepago(productos, precios, formulas_compiladas, iva_excepciones, iva=UMBRAL_IVA):
+    """
+    Calcula todas las listas de precios para todo el catálogo de una vez.
+
+    `productos` es un DataFrame con las columnas stok, valor, costo y
+    descuento (se conserva la primera fila de cada stok). Devuelve
+    (cabecera, data) con el mismo formato que espera el front.
+    """
+    productos = productos.drop_duplicates('stok', keep='first')
+    largo = len(productos)
+
+    valor = productos['valor'].to_numpy(dtype=float)
+    columnas_entrada = {
+        'Valor': valor,
+        'Costo': productos['costo'].to_numpy(dtype=float),
+        'Descuento': productos['descuento'].to_numpy(dtype=float),
+        'iva': iva,
+    }
+    forzar_iva = productos['stok'].isin(iva_excepciones).to_numpy()
+
+    columnas_salida = [productos['stok'].tolist()]
+    for precio in precios:
+        try:
+            resultado = formulas_compiladas[precio.id].evaluar_columnas(columnas_entrada, largo)
+        except NameError:
+            resultado = np.zeros(largo)
+
+        resultado, kit = aplicar_reglas_kit(precio.nombre, resultado, valor, forzar_iva, iva)
+        columnas_salida.append(resultado.tolist())
+        if kit is not None:
+            columnas_salida.append(kit.tolist())
+    columnas_salida.append(productos['descuento'].tolist())
+
+    data = [list(fila) for fila in zip(*columnas_salida)]
+    return construir_cabecera(precios), data
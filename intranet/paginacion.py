@@ -0,0 +1,144 @@
+# intranet/paginacion.py
+"""
+Paginación por cursor (keyset) para listados grandes de Comision.
+
+En vez de OFFSET, cada página continúa desde la última fila de la anterior
+con una comparación de filas sobre (prim_llamada_activacion, fecha_carga,
+id), que PostgreSQL resuelve con el índice parcial de pendientes (ver
+Comision.Meta.indexes): el costo de una página no depende de su
+profundidad. El total exacto (COUNT(*)) no se calcula; si se pide
+?conteo=estimado se devuelve el estimado del planificador.
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from django.db import connection
+from django.db.models import BooleanField, F
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Orden del listado: la del índice comision_pendientes_keyset_idx. En
+# PostgreSQL DESC ya deja los nulos primero (el índice no lo declara porque
+# SQLite no acepta NULLS FIRST en índices); aquí se pide explícito porque
+# SQLite los ordena al final.
+ORDEN_COMISIONES = (
+    F('prim_llamada_activacion').desc(nulls_first=True),
+    F('fecha_carga').desc(),
+    F('id').desc(),
+)
+
+
+def conteo_estimado(queryset):
+    """
+    Número de filas estimado sin recorrerlas: las que calcula EXPLAIN para la
+    consulta (el listado siempre lleva filtros, así que reltuples de la tabla
+    no sirve). Fuera de PostgreSQL, count().
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    with connection.cursor() as cursor:
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ComisionesKeysetPagination(BasePagination):
+    """
+    ?cursor= (vacío para la primera página) activa este modo; `next` trae el
+    cursor de la página siguiente o None en la última.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+
+    def get_page_size(self, request):
+        try:
+            tamano = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(tamano, 1), self.max_page_size)
+
+    @staticmethod
+    def _codificar(comision):
+        posicion = [
+            comision.prim_llamada_activacion.isoformat() if comision.prim_llamada_activacion else None,
+            comision.fecha_carga.isoformat(),
+            comision.id,
+        ]
+        return base64.urlsafe_b64encode(json.dumps(posicion).encode()).decode()
+
+    @staticmethod
+    def _decodificar(texto):
+        try:
+            prim, fecha_carga, pk = json.loads(base64.urlsafe_b64decode(texto.encode()))
+            return (
+                date.fromisoformat(prim) if prim else None,
+                datetime.fromisoformat(fecha_carga),
+                int(pk),
+            )
+        except (ValueError, TypeError):
+            raise NotFound('Cursor inválido.')
+
+    @staticmethod
+    def _despues_de(queryset, posicion):
+        """Filas que van después de `posicion` en ORDEN_COMISIONES (DESC, nulos primero)."""
+        prim, fecha_carga, pk = posicion
+        ops = connection.ops
+        prim = ops.adapt_datefield_value(prim)
+        fecha_carga = ops.adapt_datetimefield_value(fecha_carga)
+        q = ops.quote_name
+        tabla = q(queryset.model._meta.db_table)
+        prim_col = f"{tabla}.{q('prim_llamada_activacion')}"
+        resto = f"({tabla}.{q('fecha_carga')}, {tabla}.{q('id')})"
+        if prim is None:
+            # Aún en el tramo de nulos: sigue el resto del tramo y luego todas las fechas
+            condicion = RawSQL(
+                f"({prim_col} IS NULL AND {resto} < (%s, %s)) OR {prim_col} IS NOT NULL",
+                (fecha_carga, pk), output_field=BooleanField(),
+            )
+        else:
+            # Comparación de filas: PostgreSQL la usa como límite del índice
+            condicion = RawSQL(
+                f"({prim_col}, {tabla}.{q('fecha_carga')}, {tabla}.{q('id')}) < (%s, %s, %s)",
+                (prim, fecha_carga, pk), output_field=BooleanField(),
+            )
+        return queryset.filter(condicion)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size_actual = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        self.conteo = conteo_estimado(queryset) if request.query_params.get('conteo') == 'estimado' else None
+
+        queryset = queryset.order_by(*ORDEN_COMISIONES)
+        if cursor:
+            queryset = self._despues_de(queryset, self._decodificar(cursor))
+
+        # Una fila de más para saber si hay página siguiente
+        filas = list(queryset[:self.page_size_actual + 1])
+        self.hay_siguiente = len(filas) > self.page_size_actual
+        self.filas = filas[:self.page_size_actual]
+        return self.filas
+
+    def get_next_link(self):
+        if not self.hay_siguiente:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self._codificar(self.filas[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.conteo,
+            'count_estimado': self.conteo is not None,
+            'next': self.get_next_link(),
+            'results': data,
+        })
@@ -0,0 +1,106 @@
+# intranet/recalculo_precios.py
+"""
+Recálculo incremental de precios cuando cambian variables de las fórmulas.
+
+Con el grafo de dependencias del motor (FormulaCompilada.dependencias) se
+sabe qué listas dependen de las variables modificadas. Solo esas columnas
+(y sus kits) se recalculan con las entradas guardadas de la última carga;
+el resultado es una carga derivada que copia el resto de la carga original.
+"""
+import logging
+import time
+from itertools import chain
+
+import pandas as pd
+from django.db import transaction
+
+from . import models
+from .formulas import obtener_motor
+from .ingesta_precios import TAMANO_BLOQUE, cargar_filas_precios, iterar_filas_precios
+from .motor_precios import calcular_matriz_prepago
+from .snapshot_precios import construir_snapshot_carga
+
+logger = logging.getLogger(__name__)
+
+
+class RecalculoError(ValueError):
+    pass
+
+
+def _filas_copiadas(carga_origen, carga_id, excluir):
+    """Filas de la carga original que no cambian, como tuplas para cargar_filas_precios."""
+    filas = (
+        models.Lista_precio.objects
+        .filter(carga=carga_origen)
+        .exclude(nombre__in=excluir)
+        .order_by('id')
+        .values_list('producto', 'producto_normalizado', 'nombre', 'valor')
+    )
+    for producto, producto_normalizado, nombre, valor in filas.iterator(chunk_size=TAMANO_BLOQUE):
+        yield (carga_id, producto, producto_normalizado, nombre, valor)
+
+
+def recalcular_por_variables(cambios, carga=None):
+    """
+    Recalcula las listas afectadas por `cambios` (pares (price_id, nombre) de
+    Variables_prices) sobre `carga` (por defecto la última).
+
+    Devuelve (carga_derivada, resumen); carga_derivada es None si ninguna
+    lista depende de esas variables.
+    """
+    inicio = time.perf_counter()
+    if carga is None:
+        carga = models.Carga.objects.order_by('-fecha_carga').first()
+        if carga is None:
+            raise RecalculoError('No hay cargas de precios para recalcular.')
+
+    entradas = list(carga.entradas.values_list('producto', 'valor', 'costo', 'descuento'))
+    if not entradas:
+        raise RecalculoError(
+            f'La carga {carga.id} no tiene entradas guardadas; hay que subir la hoja de nuevo.'
+        )
+
+    motor = obtener_motor()
+    nombres = motor.formulas_afectadas(set(cambios))
+    resumen = {'carga_origen': carga.id, 'listas': nombres, 'filas': 0}
+    if not nombres:
+        resumen['segundos'] = round(time.perf_counter() - inicio, 3)
+        return None, resumen
+
+    precios = list(models.Formula.objects.filter(nombre__in=nombres).order_by('id'))
+    formulas_compiladas = {precio.id: motor.compilar(precio.nombre) for precio in precios}
+    iva_excepciones = set(
+        models.IvaExcepcion.objects.filter(tipo='prepago').values_list('producto', flat=True)
+    )
+
+    productos = pd.DataFrame(entradas, columns=['stok', 'valor', 'costo', 'descuento'])
+    cabecera, data = calcular_matriz_prepago(productos, precios, formulas_compiladas, iva_excepciones)
+    # El descuento es una entrada, no cambia: se copia de la carga original
+    cabecera = [columna for columna in cabecera if columna['text'] != 'descuento']
+    recalculadas = [columna['text'] for columna in cabecera if columna['text'] != 'Equipo']
+
+    with transaction.atomic():
+        derivada = models.Carga.objects.create(
+            descripcion=f"Recálculo de la carga {carga.id}: {', '.join(nombres)}"[:255]
+        )
+        resumen['filas'] = cargar_filas_precios(chain(
+            _filas_copiadas(carga, derivada.id, recalculadas),
+            iterar_filas_precios(cabecera, data, derivada.id),
+        ))
+        models.EntradaCarga.objects.bulk_create([
+            models.EntradaCarga(
+                carga=derivada, producto=e.producto, producto_normalizado=e.producto_normalizado,
+                valor=e.valor, costo=e.costo, descuento=e.descuento,
+            )
+            for e in carga.entradas.all()
+        ], batch_size=TAMANO_BLOQUE)
+        construir_snapshot_carga(derivada)
+
+    resumen['carga'] = derivada.id
+    resumen['columnas'] = recalculadas
+    resumen['segundos'] = round(time.perf_counter() - inicio, 3)
+    logger.info(
+        f"Recálculo de la carga {carga.id} -> {derivada.id}: {len(recalculadas)} columnas, "
+        f"{resumen['filas']} filas en {resumen['segundos']}s."
+    )
+    return derivada, resumen
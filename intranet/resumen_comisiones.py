@@ -0,0 +1,264 @@
+# intranet/resumen_comisiones.py
+"""
+Mantenimiento incremental de ComisionResumenMensual.
+
+Quien escribe en Comision aplica aquí, en su misma transacción, la
+diferencia que produce: filas nuevas (sumar), filas que se borran (restar),
+filas que cambian de estado o producto con un UPDATE masivo (mover) o unas
+pocas filas que se editan una a una (actualizar). Las diferencias se
+agrupan en SQL y se aplican con INSERT ... ON CONFLICT DO UPDATE, así que
+el costo depende de los grupos tocados y no del tamaño de Comision.
+
+Un UPDATE que toca casi todas las filas abiertas (el vencimiento de cambio
+de mes) cambia tantos grupos que sale más barato rehacer en SQL los meses
+afectados (reconstruir_meses).
+"""
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import models
+from .cache_comisiones import datos_modificados
+
+CLAVE = ('mes_pago', 'ruta', 'idpos', 'asesor_identificador', 'producto', 'estado')
+TAMANO_LOTE = 500
+
+
+def _clave(mes_pago, ruta, idpos, asesor_identificador, producto, estado):
+    return (mes_pago, ruta or '', idpos or '', asesor_identificador or '', producto or '', estado)
+
+
+def _decimal(valor):
+    if valor is None:
+        return Decimal('0')
+    return valor if isinstance(valor, Decimal) else Decimal(str(valor))
+
+
+def _acumular(deltas, clave, cantidad, total, signo=1):
+    actual = deltas.get(clave, (0, Decimal('0')))
+    deltas[clave] = (actual[0] + signo * cantidad, actual[1] + signo * _decimal(total))
+
+
+def combinar(*grupos):
+    """Suma varios diccionarios clave -> (cantidad, total)."""
+    deltas = {}
+    for grupo in grupos:
+        for clave, (cantidad, total) in grupo.items():
+            _acumular(deltas, clave, cantidad, total)
+    return deltas
+
+
+def negar(deltas):
+    return {clave: (-cantidad, -total) for clave, (cantidad, total) in deltas.items()}
+
+
+def _grupos(queryset, reemplazos, con_clave_actual):
+    """
+    Filas agrupadas de `queryset` con cantidad_grupo y total_grupo. Agrupa
+    por la clave nueva (los campos de `reemplazos` como nuevo_<campo>) y, con
+    `con_clave_actual`, también por la clave actual.
+    """
+    anotaciones = {
+        f'nuevo_{campo}': valor if hasattr(valor, 'resolve_expression') else Value(valor)
+        for campo, valor in reemplazos.items() if campo in CLAVE
+    }
+    campos = [
+        campo for campo in CLAVE
+        if con_clave_actual or f'nuevo_{campo}' not in anotaciones
+    ] + list(anotaciones)
+    return (
+        queryset.order_by()
+        .annotate(**anotaciones)
+        .values(*campos)
+        .annotate(cantidad_grupo=Count('pk'), total_grupo=Sum('comision_final'))
+    )
+
+
+def _clave_nueva(fila):
+    return _clave(*(fila.get(f'nuevo_{campo}', fila.get(campo)) for campo in CLAVE))
+
+
+def agrupar(queryset, **reemplazos):
+    """
+    Cantidad y suma de comision_final de `queryset` por clave del resumen.
+    `reemplazos` (valores o expresiones) sustituyen campos de la clave: es la
+    clave que tendrán las filas después de un update(**reemplazos).
+    """
+    deltas = {}
+    for fila in _grupos(queryset, reemplazos, con_clave_actual=False):
+        _acumular(deltas, _clave_nueva(fila), fila['cantidad_grupo'], fila['total_grupo'])
+    return deltas
+
+
+def agrupar_filas(comisiones):
+    """Igual que agrupar, para objetos Comision que aún no se han leído de la BD."""
+    deltas = {}
+    for comision in comisiones:
+        clave = _clave(*(getattr(comision, campo) for campo in CLAVE))
+        _acumular(deltas, clave, 1, comision.comision_final)
+    return deltas
+
+
+def desde_grupos(grupos):
+    """Tuplas (campos de CLAVE..., cantidad, total) ya agrupadas en SQL."""
+    deltas = {}
+    for *clave, cantidad, total in grupos:
+        _acumular(deltas, _clave(*clave), cantidad, total)
+    return deltas
+
+
+def _orden(item):
+    # Mismo orden en todas las transacciones para no cruzar bloqueos
+    clave = item[0]
+    return (clave[0] is not None, clave[0] or '') + clave[1:]
+
+
+def aplicar(deltas):
+    """Aplica las diferencias al resumen; los grupos que quedan en cero se borran."""
+    # Todo escritor de Comision pasa por aquí: los reportes en cache caducan
+    datos_modificados()
+    filas = sorted(
+        ((clave, cantidad, total) for clave, (cantidad, total) in deltas.items() if cantidad or total),
+        key=_orden,
+    )
+    if not filas:
+        return
+
+    q = connection.ops.quote_name
+    opts = models.ComisionResumenMensual._meta
+    tabla = q(opts.db_table)
+    columnas = [q(opts.get_field(campo).column) for campo in CLAVE + ('cantidad', 'total')]
+    cantidad, total = columnas[-2:]
+    actualizar = (
+        f"DO UPDATE SET {cantidad} = {tabla}.{cantidad} + excluded.{cantidad}, "
+        f"{total} = {tabla}.{total} + excluded.{total}"
+    )
+    # Una restricción única parcial por caso: con mes y sin mes (NULL)
+    conflictos = {
+        True: f"ON CONFLICT ({', '.join(columnas[:6])}) WHERE {columnas[0]} IS NOT NULL",
+        False: f"ON CONFLICT ({', '.join(columnas[1:6])}) WHERE {columnas[0]} IS NULL",
+    }
+    marcador = '(' + ', '.join(['%s'] * len(columnas)) + ')'
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for con_mes in (False, True):
+            grupo = [fila for fila in filas if (fila[0][0] is not None) == con_mes]
+            for i in range(0, len(grupo), TAMANO_LOTE):
+                lote = grupo[i:i + TAMANO_LOTE]
+                cursor.execute(
+                    f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES "
+                    + ', '.join([marcador] * len(lote))
+                    + f" {conflictos[con_mes]} {actualizar}",
+                    [valor for clave, n, suma in lote for valor in (*clave, n, suma)],
+                )
+        meses = {fila[0][0] for fila in filas}
+        vacios = models.ComisionResumenMensual.objects.filter(cantidad=0)
+        if None in meses:
+            meses.discard(None)
+            vacios.filter(mes_pago__isnull=True).delete()
+        if meses:
+            vacios.filter(mes_pago__in=meses).delete()
+
+
+def sumar(queryset):
+    aplicar(agrupar(queryset))
+
+
+def restar(queryset):
+    """Llamar antes de borrar las filas de `queryset`."""
+    aplicar(negar(agrupar(queryset)))
+
+
+def mover(queryset, **cambios):
+    """
+    Llamar antes de queryset.update(**cambios): las filas salen de su grupo
+    actual y entran al que les dan los cambios (estado, producto, ...).
+    Un solo GROUP BY por la clave actual y la nueva. Devuelve la agrupación
+    por clave nueva (clave -> (cantidad, total)), p. ej. para contar.
+    """
+    if not set(cambios) & set(CLAVE):
+        return {}
+    deltas = {}
+    nuevos = {}
+    for fila in _grupos(queryset, cambios, con_clave_actual=True):
+        cantidad, total = fila['cantidad_grupo'], fila['total_grupo']
+        _acumular(deltas, _clave(*(fila[campo] for campo in CLAVE)), cantidad, total, signo=-1)
+        _acumular(deltas, _clave_nueva(fila), cantidad, total)
+        _acumular(nuevos, _clave_nueva(fila), cantidad, total)
+    aplicar(deltas)
+    return nuevos
+
+
+@contextmanager
+def actualizar(pks):
+    """
+    Para ediciones fila a fila: resta las comisiones `pks`, deja correr el
+    bloque y suma las que sigan existiendo con sus valores nuevos.
+    """
+    pks = list(pks)
+    antes = agrupar(models.Comision.objects.filter(pk__in=pks))
+    yield
+    aplicar(combinar(negar(antes), agrupar(models.Comision.objects.filter(pk__in=pks))))
+
+
+def reconstruir_meses(meses):
+    """
+    Rehace los grupos de los meses `meses` (None: filas sin mes) desde
+    Comision con un DELETE y un INSERT ... SELECT ... GROUP BY, sin pasar
+    los grupos por Python. Para después de un UPDATE masivo.
+    """
+    meses = set(meses)
+    if not meses:
+        return
+    datos_modificados()
+    filtro = Q(mes_pago__in=[mes for mes in meses if mes is not None])
+    if None in meses:
+        filtro |= Q(mes_pago__isnull=True)
+
+    q = connection.ops.quote_name
+    opts = models.ComisionResumenMensual._meta
+    columnas = ', '.join(q(opts.get_field(campo).column) for campo in CLAVE + ('cantidad', 'total'))
+    # Mismas normalizaciones que _clave: ruta, idpos, asesor y producto nulos como ''
+    grupos = (
+        models.Comision.objects.filter(filtro).order_by()
+        .values(
+            mes=F('mes_pago'),
+            ruta_=Coalesce('ruta', Value('')),
+            idpos_=Coalesce('idpos', Value('')),
+            asesor_=Coalesce('asesor_identificador', Value('')),
+            producto_=Coalesce('producto', Value('')),
+            estado_=F('estado'),
+        )
+        .annotate(cantidad_grupo=Count('pk'), total_grupo=Sum('comision_final', default=0))
+    )
+    sql, params = grupos.query.sql_with_params()
+    with transaction.atomic(), connection.cursor() as cursor:
+        models.ComisionResumenMensual.objects.filter(filtro).delete()
+        cursor.execute(f"INSERT INTO {q(opts.db_table)} ({columnas}) {sql}", params)
+
+
+def reconstruir():
+    """Rehace todo el resumen desde Comision. Devuelve el número de grupos."""
+    deltas = agrupar(models.Comision.objects.all())
+    with transaction.atomic():
+        models.ComisionResumenMensual.objects.all().delete()
+        aplicar(deltas)
+    return len(deltas)
+
+
+def diferencias():
+    """Grupos en los que el resumen guardado no coincide con Comision: clave -> (guardado, real)."""
+    reales = agrupar(models.Comision.objects.all())
+    guardados = {
+        _clave(*fila[:6]): (fila[6], fila[7])
+        for fila in models.ComisionResumenMensual.objects.values_list(*CLAVE, 'cantidad', 'total')
+    }
+    vacio = (0, Decimal('0'))
+    return {
+        clave: (guardados.get(clave, vacio), reales.get(clave, vacio))
+        for clave in guardados.keys() | reales.keys()
+        if guardados.get(clave, vacio) != reales.get(clave, vacio)
+    }
@@ -0,0 +1,37 @@
+# intranet/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import models
+from .cache_comisiones import datos_modificados
+from .cache_precios import invalidar_filtros_precios
+from .formulas import invalidar_motor
+
+
+@receiver([post_save, post_delete], sender=models.Formula)
+@receiver([post_save, post_delete], sender=models.Variables_prices)
+def invalidar_formulas_compiladas(sender, **kwargs):
+    """Cualquier cambio en fórmulas o variables obliga a recompilar."""
+    invalidar_motor()
+    # Otra vez al confirmar: un worker que reconstruyó antes del commit leyó
+    # los datos viejos y los guardó con la versión nueva
+    transaction.on_commit(invalidar_motor)
+
+
+@receiver([post_save, post_delete], sender=models.Carga)
+def invalidar_cache_filtros_precios(sender, **kwargs):
+    """Marcas y cargas recientes cambian con cada carga; se invalida al confirmar."""
+    transaction.on_commit(invalidar_filtros_precios)
+
+
+@receiver([post_save, post_delete], sender=models.PagoComision)
+@receiver([post_save, post_delete], sender=models.PagoComisionMetodo)
+def invalidar_cache_reportes_comisiones(sender, **kwargs):
+    """
+    fecha_pago (filtro de mes), métodos de pago y comprobantes se ven en los
+    reportes aunque no cambie ninguna Comision: p. ej. al editar un pago.
+    PagoComision.save() escribe los métodos con bulk_create, que no emite
+    señales; el post_save del pago los cubre.
+    """
+    datos_modificados()
@@ -0,0 +1,242 @@
+# intranet/snapshot_precios.py
+"""
+Construcción de la tabla PrecioSnapshot ("precio actual vs anterior").
+
+Lo que antes calculaba buscar_precios en cada búsqueda (precio de la carga
+anterior, kits, costo, descuento, reglas de IVA y variación) se resuelve una
+sola vez cuando se guarda la carga (o con reconstruir_snapshot_precios para
+las cargas viejas). Las lecturas no escriben: para una carga sin snapshot
+las filas se calculan en memoria desde Lista_precio.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import OuterRef, Q, Subquery
+
+from . import models
+from .motor_precios import apply_iva_kit_rules
+
+logger = logging.getLogger(__name__)
+
+BASE_IVA_EXCLUIDO = Decimal('1152228')
+TASA_IVA = Decimal('0.19')
+PRECIO_SIMCARD = Decimal('2000')
+
+
+def calcular_variacion_precio(actual, iva_actual, anterior, iva_anterior):
+    """Compara equipo + IVA del equipo contra la carga anterior."""
+    variacion = {'indicador': 'neutral', 'diferencial': Decimal('0'), 'porcentaje': Decimal('0')}
+    if anterior is None:
+        return variacion
+
+    total_actual = actual + iva_actual
+    total_anterior = anterior + iva_anterior
+    if total_anterior > 0:
+        diferencial = total_actual - total_anterior
+        indicador = 'up' if diferencial > 0 else 'down' if diferencial < 0 else 'neutral'
+        porcentaje = (diferencial / total_anterior) * 100
+        variacion = {
+            'indicador': indicador,
+            'diferencial': round(diferencial, 0),
+            'porcentaje': round(porcentaje, 0),
+        }
+    return variacion
+
+
+def _mapas_complementarios(cargas_ids, productos_normalizados):
+    """Kits, costos y descuentos por (producto normalizado, carga)."""
+    filas = models.Lista_precio.objects.filter(
+        carga_id__in=cargas_ids,
+        producto_normalizado__in=productos_normalizados,
+    ).filter(
+        (Q(nombre__icontains='Kit') & ~Q(nombre__icontains='Descuento Kit'))
+        | Q(nombre='Costo')
+        | Q(nombre='descuento')
+    ).order_by('id').values_list('producto_normalizado', 'nombre', 'valor', 'carga_id')
+
+    mapa_kits = defaultdict(list)
+    mapa_costos = {}
+    mapa_descuentos = {}
+    for producto_normalizado, nombre, valor, carga_id in filas:
+        key = (producto_normalizado, carga_id)
+        if nombre == 'Costo':
+            mapa_costos[key] = valor
+        elif nombre == 'descuento':
+            mapa_descuentos[key] = valor
+        else:
+            mapa_kits[key].append({'nombre': nombre, 'valor': float(valor)})
+    return mapa_kits, mapa_costos, mapa_descuentos
+
+
+def _redondear_como_bd(snapshot):
+    """Decimales al número de posiciones del campo, como quedan al guardarlos."""
+    for campo in snapshot._meta.fields:
+        if campo.get_internal_type() == 'DecimalField':
+            valor = getattr(snapshot, campo.attname)
+            if valor is not None:
+                valor = Decimal(valor).quantize(Decimal(1).scaleb(-campo.decimal_places))
+                # La BD no guarda -0
+                setattr(snapshot, campo.attname, valor if valor else abs(valor))
+    return snapshot
+
+
+def calcular_snapshot_carga(carga, nombres=None, productos_normalizados=None):
+    """
+    Filas de PrecioSnapshot de una carga, sin guardarlas. `nombres` y
+    `productos_normalizados` limitan el cálculo a esas listas y productos.
+    """
+    subquery_precio_anterior = models.Lista_precio.objects.filter(
+        producto_normalizado=OuterRef('producto_normalizado'),
+        nombre=OuterRef('nombre'),
+        carga__fecha_carga__lt=carga.fecha_carga,
+    ).order_by('-carga__fecha_carga').values('id')[:1]
+
+    actuales = models.Lista_precio.objects.filter(carga=carga)
+    if nombres is not None:
+        actuales = actuales.filter(nombre__in=nombres)
+    if productos_normalizados is not None:
+        actuales = actuales.filter(producto_normalizado__in=productos_normalizados)
+    actuales = list(
+        actuales
+        .annotate(id_precio_anterior=Subquery(subquery_precio_anterior))
+        .order_by('id')
+        .values('producto', 'producto_normalizado', 'nombre', 'valor', 'id_precio_anterior')
+    )
+
+    ids_anteriores = {p['id_precio_anterior'] for p in actuales if p['id_precio_anterior']}
+    mapa_precios_anteriores = {
+        p['id']: p
+        for p in models.Lista_precio.objects.filter(id__in=ids_anteriores).values('id', 'carga_id', 'valor')
+    }
+
+    cargas_ids = {carga.id} | {p['carga_id'] for p in mapa_precios_anteriores.values()}
+    productos = {p['producto_normalizado'] for p in actuales if p['producto_normalizado']}
+    mapa_kits, mapa_costos, mapa_descuentos = _mapas_complementarios(cargas_ids, productos)
+
+    snapshots = []
+    vistos = set()
+    for precio in actuales:
+        clave = (precio['producto'], precio['nombre'])
+        if clave in vistos:
+            continue  # filas repetidas en la hoja: se conserva la primera
+        vistos.add(clave)
+
+        prod_lower = precio['producto_normalizado']
+        nombre_lista = precio['nombre'] or ''
+        equipo_sin_iva = precio['valor']
+
+        iva_equipo, kits = apply_iva_kit_rules(
+            equipo_sin_iva, nombre_lista, mapa_kits.get((prod_lower, carga.id), []),
+            BASE_IVA_EXCLUIDO, TASA_IVA
+        )
+
+        anterior = mapa_precios_anteriores.get(precio['id_precio_anterior'])
+        carga_anterior_id = anterior['carga_id'] if anterior else None
+        valor_anterior = anterior['valor'] if anterior else None
+        kits_anteriores = mapa_kits.get((prod_lower, carga_anterior_id), []) if anterior else []
+        iva_anterior = Decimal('0')
+        if anterior:
+            iva_anterior, _ = apply_iva_kit_rules(
+                valor_anterior, nombre_lista, kits_anteriores, BASE_IVA_EXCLUIDO, TASA_IVA
+            )
+
+        variacion = calcular_variacion_precio(equipo_sin_iva, iva_equipo, valor_anterior, iva_anterior)
+        descuento = Decimal(mapa_descuentos.get((prod_lower, carga.id), Decimal('0')))
+        total = (
+            equipo_sin_iva + iva_equipo + PRECIO_SIMCARD + (PRECIO_SIMCARD * TASA_IVA)
+            + sum(Decimal(str(k.get('valor', '0'))) for k in kits)
+        )
+
+        snapshots.append(_redondear_como_bd(models.PrecioSnapshot(
+            carga=carga,
+            producto=precio['producto'],
+            producto_normalizado=prod_lower,
+            nombre=precio['nombre'],
+            valor=equipo_sin_iva,
+            iva_equipo=iva_equipo,
+            kits=kits,
+            costo=mapa_costos.get((prod_lower, carga.id), Decimal('0')),
+            descuento=descuento,
+            total=total,
+            es_promo=descuento > 0,
+            carga_anterior_id=carga_anterior_id,
+            valor_anterior=valor_anterior,
+            kits_anteriores=[dict(k) for k in kits_anteriores],
+            costo_anterior=mapa_costos.get((prod_lower, carga_anterior_id), Decimal('0')) if anterior else Decimal('0'),
+            descuento_anterior=mapa_descuentos.get((prod_lower, carga_anterior_id), Decimal('0')) if anterior else Decimal('0'),
+            indicador=variacion['indicador'],
+            diferencial=variacion['diferencial'],
+            porcentaje=variacion['porcentaje'],
+        )))
+    return snapshots
+
+
+def construir_snapshot_carga(carga):
+    """
+    (Re)construye el snapshot de una carga. Devuelve el número de filas creadas.
+    """
+    snapshots = calcular_snapshot_carga(carga)
+    with transaction.atomic():
+        models.PrecioSnapshot.objects.filter(carga=carga).delete()
+        models.PrecioSnapshot.objects.bulk_create(snapshots, batch_size=2000)
+
+    logger.info(f"Snapshot de precios de la carga {carga.id}: {len(snapshots)} filas.")
+    return len(snapshots)
+
+
+def _ultimos_ids_snapshot(nombres, productos_normalizados):
+    """Id del snapshot más reciente de cada (producto, lista)."""
+    snapshots = models.PrecioSnapshot.objects.filter(
+        nombre__in=nombres, producto_normalizado__in=productos_normalizados,
+    ).order_by('producto', 'nombre', '-carga__fecha_carga', '-id')
+    if connection.vendor == 'postgresql':
+        return list(snapshots.distinct('producto', 'nombre').values_list('id', flat=True))
+
+    # DISTINCT ON solo existe en PostgreSQL: el primero de cada par en Python
+    ids = {}
+    for id_snapshot, producto, nombre in snapshots.values_list('id', 'producto', 'nombre'):
+        ids.setdefault((producto, nombre), id_snapshot)
+    return list(ids.values())
+
+
+def ultimos_snapshots(nombres, productos_normalizados):
+    """
+    Último precio de cada (producto, lista) entre todas las cargas, de la
+    carga más nueva a la más vieja. Si ese último precio es de una carga sin
+    snapshot, la fila se calcula en memoria desde Lista_precio.
+    """
+    ultimos = {
+        (snap.producto, snap.nombre): snap
+        for snap in models.PrecioSnapshot.objects
+        .filter(id__in=_ultimos_ids_snapshot(nombres, productos_normalizados))
+        .select_related('carga')
+    }
+
+    cargas_sin_snapshot = models.Carga.objects.filter(snapshots__isnull=True)
+    candidatas = (
+        models.Lista_precio.objects
+        .filter(carga__in=cargas_sin_snapshot, nombre__in=nombres, producto_normalizado__in=productos_normalizados)
+        .order_by('producto', 'nombre', '-carga__fecha_carga', '-id')
+        .values_list('producto', 'nombre', 'carga_id', 'carga__fecha_carga')
+    )
+    pendientes = defaultdict(set)
+    vistos = set()
+    for producto, nombre, carga_id, fecha_carga in candidatas:
+        if (producto, nombre) in vistos:
+            continue
+        vistos.add((producto, nombre))
+        snap = ultimos.get((producto, nombre))
+        if snap is None or snap.carga.fecha_carga < fecha_carga:
+            pendientes[carga_id].add((producto, nombre))
+
+    for carga in models.Carga.objects.filter(id__in=pendientes):
+        pares = pendientes[carga.id]
+        for snap in calcular_snapshot_carga(
+            carga, nombres={n for _, n in pares}, productos_normalizados=productos_normalizados,
+        ):
+            if (snap.producto, snap.nombre) in pares:
+                ultimos[(snap.producto, snap.nombre)] = snap
+
+    return sorted(ultimos.values(), key=lambda snap: (snap.carga.fecha_carga, snap.id or 0), reverse=True)
@@ -1,21 +1,29 @@
-import pandas as pd
-import numpy as np
-from celery import shared_task
-from django.db import transaction
+from celery import chord, shared_task
+from django.db import IntegrityError, transaction
 from django.contrib.auth.models import User
-from django.db.models import Max
+from django.db.models import Case, Count, Exists, Max, OuterRef, Value, When
 from django.core.mail import send_mail, EmailMessage
 from django.conf import settings
-from . import models
+from . import models, resumen_comisiones
+from .ingesta_comisiones import (
+    cargar_comisiones, dividir_libro, hash_archivo, iterar_filas_comisiones,
+    leer_bloque, leer_bloques_excel, meses_desde_texto,
+)
 import os
+import shutil
 import time
 import logging
-import locale
 import base64
 from datetime import date, datetime, time as dt_time
 from dateutil.relativedelta import relativedelta
 from calendar import monthrange
 from django.utils import timezone
+from asgiref.sync import async_to_sync
+
+try:
+    from channels.layers import get_channel_layer
+except ImportError:  # Sin channels no hay notificaciones en vivo, solo el email
+    get_channel_layer = None
 
 # Obtenemos un logger de Celery para ver los mensajes en la consola del worker
 logger = logging.getLogger(__name__)
@@ -84,6 +92,30 @@ El equipo de Tu App
         )
 
 
+# --- NOTIFICACIONES EN VIVO (NotificationConsumer) ---
+def notificar_usuario(user_id, message, status='info', carga=None):
+    """
+    Envía un evento al grupo `user_{id}_notifications` del NotificationConsumer.
+    Si se pasa `carga` (ComisionCarga) se incluye su avance.
+    """
+    channel_layer = get_channel_layer() if get_channel_layer else None
+    if channel_layer is None:
+        return
+    evento = {'type': 'send_notification', 'message': message, 'status': status}
+    if carga is not None:
+        evento['carga'] = {
+            'id': carga.id,
+            'estado': carga.estado,
+            'filas_procesadas': carga.filas_procesadas,
+            'filas_por_segundo': carga.filas_por_segundo,
+            'registros_creados': carga.registros_creados,
+        }
+    try:
+        async_to_sync(channel_layer.group_send)(f'user_{user_id}_notifications', evento)
+    except Exception as e:
+        logger.warning(f"No se pudo enviar la notificación al usuario {user_id}: {e}")
+
+
 # --- FUNCIÓN HELPER PARA OBTENER FECHA DE CORTE (SIN CAMBIOS) ---
 def _get_fecha_corte_helper():
     """Obtiene el día de corte desde el modelo Configuracion. Si no existe, devuelve 1."""
@@ -101,10 +133,13 @@ def _get_fecha_corte_helper():
 
 
 # ---- INICIO: FUNCIÓN HELPER PARA VENCER POR INACTIVIDAD (CORREGIDA Y MEJORADA) ----
-def _vencer_por_inactividad_helper(mes_de_referencia):
+def _vencer_por_inactividad_helper(mes_de_referencia, vencer_activos=False):
     """
     Lógica para vencer comisiones de PDV inactivos durante el ciclo de pago anterior.
-    DEVUELVE: Una tupla (mensaje_string, lista_pdv_activos).
+    Con vencer_activos=True (cambio de mes) también vence las de los PDV activos,
+    en la misma sentencia.
+    DEVUELVE: Una tupla (mensaje_string, conteos) con conteos = {'no_visita', 'cambio_de_mes'}
+    o None si hubo error.
     """
     dia_corte = _get_fecha_corte_helper()
 
@@ -127,7 +162,7 @@ def _vencer_por_inactividad_helper(mes_de_referencia):
     except ValueError:
         error_msg = "Error al calcular las fechas del período. Revisa el día de corte."
         logger.error(error_msg)
-        return (error_msg, [])  # Devolver tupla en caso de error
+        return (error_msg, None)  # Devolver tupla en caso de error
 
     inicio_dt = timezone.make_aware(datetime.combine(inicio_periodo, dt_time.min))
     fin_dt = timezone.make_aware(datetime.combine(fin_periodo, dt_time.max))
@@ -137,268 +172,403 @@ def _vencer_por_inactividad_helper(mes_de_referencia):
         f"HELPER: Iniciando vencimiento por inactividad para el período: {periodo_str}"
     )
 
+    # Un PDV está activo si tuvo algún pago en el período (NOT EXISTS / EXISTS
+    # correlacionado contra PagoComision, sin traer los idpos a Python)
+    pago_en_periodo = Exists(
+        models.PagoComision.objects.filter(
+            idpos=OuterRef('idpos'), fecha_pago__range=[inicio_dt, fin_dt]
+        )
+    )
+    estados_abiertos = ['Pendiente', 'Acumulada']
+
     try:
+        inicio = time.perf_counter()
         with transaction.atomic():
-            # 1. Encontrar PDV que SÍ tuvieron pagos en el período (PDV ACTIVOS)
-            pdv_con_pagos = models.PagoComision.objects.filter(
-                fecha_pago__range=[inicio_dt, fin_dt]
-            ).values_list('idpos', flat=True).distinct()
-            pdv_activos_set = set(pdv_con_pagos)
-            logger.info(
-                f"HELPER: Se encontraron {len(pdv_activos_set)} PDV ACTIVOS en el período."
-            )
-
-            # 2. Encontrar TODOS los PDV que tienen comisiones pendientes o acumuladas
-            pdv_con_comisiones_pendientes = models.Comision.objects.filter(
-                estado__in=['Pendiente', 'Acumulada']
-            ).values_list('idpos', flat=True).distinct()
-            pdv_con_comisiones_pendientes_set = set(pdv_con_comisiones_pendientes)
-
-            # 3. Identificar PDV inactivos (tienen deuda pero NO hicieron pagos)
-            pdv_inactivos = list(pdv_con_comisiones_pendientes_set - pdv_activos_set)
-
-            if not pdv_inactivos:
-                mensaje = "HELPER: No se encontraron PDV inactivos para el período."
-                logger.info(mensaje)
-                # Devolvemos la lista de activos que ya calculamos
-                return (mensaje, list(pdv_activos_set))
-
-            # 4. Actualizar las comisiones de los PDV inactivos
-            num_actualizadas = models.Comision.objects.filter(
-                idpos__in=pdv_inactivos,
-                estado__in=['Pendiente', 'Acumulada']
-            ).update(estado='Vencida', producto='Vencida por no visita')
-
-            mensaje_final = (
-                f"HELPER: Se actualizaron {num_actualizadas} comisiones de "
-                f"{len(pdv_inactivos)} PDV a 'Vencida por no visita'."
-            )
-            logger.info(mensaje_final)
-            # Devolvemos el mensaje Y la lista de PDV activos para el siguiente paso
-            return (mensaje_final, list(pdv_activos_set))
+            pendientes = models.Comision.objects.filter(estado__in=estados_abiertos)
+            if vencer_activos:
+                # Un solo UPDATE: el motivo depende de si el PDV tuvo pagos
+                cambios = {
+                    'estado': 'Vencida',
+                    'producto': Case(
+                        When(pago_en_periodo, then=Value('Vencida por cambio de mes')),
+                        default=Value('Vencida por no visita'),
+                    ),
+                }
+                # Una pasada agrupada por mes da los conteos y los meses que
+                # hay que rehacer en el resumen (casi todos sus grupos cambian)
+                por_mes = list(
+                    pendientes.order_by().values('mes_pago').annotate(
+                        no_visita=Count('id', filter=~pago_en_periodo),
+                        cambio_de_mes=Count('id', filter=pago_en_periodo),
+                    )
+                )
+                conteos = {
+                    motivo: sum(fila[motivo] for fila in por_mes)
+                    for motivo in ('no_visita', 'cambio_de_mes')
+                }
+                num_actualizadas = pendientes.update(**cambios)
+                resumen_comisiones.reconstruir_meses(fila['mes_pago'] for fila in por_mes)
+            else:
+                sin_pagos = pendientes.filter(~pago_en_periodo)
+                cambios = {'estado': 'Vencida', 'producto': 'Vencida por no visita'}
+                resumen_comisiones.mover(sin_pagos, **cambios)
+                num_actualizadas = sin_pagos.update(**cambios)
+                conteos = {'no_visita': num_actualizadas, 'cambio_de_mes': 0}
+        segundos = time.perf_counter() - inicio
+
+        mensaje_final = (
+            f"HELPER: Se actualizaron {num_actualizadas} comisiones: "
+            f"{conteos['no_visita']} a 'Vencida por no visita' y "
+            f"{conteos['cambio_de_mes']} a 'Vencida por cambio de mes' en {segundos:.3f}s."
+        )
+        logger.info(mensaje_final)
+        return (mensaje_final, conteos)
 
     except Exception as e:
         mensaje_error = f"HELPER: Error al vencer comisiones por inactividad: {e}"
         logger.error(mensaje_error, exc_info=True)
-        return (mensaje_error, [])  # Devolver tupla en caso de error
+        return (mensaje_error, None)  # Devolver tupla en caso de error
 
 
 # ---- FIN: FUNCIÓN HELPER CORREGIDA Y MEJORADA ----
 
 
-@shared_task
-def procesar_archivo_comisiones(file_path, user_id):
-    """
-    Tarea de Celery para procesar un archivo Excel de comisiones y notificar por email.
-    """
-    try:
-        # Configuración de locale y lectura de Excel
-        try:
-            locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
-        except locale.Error:
-            locale.setlocale(locale.LC_TIME, 'Spanish_Spain.1252')
-        sheets_dict = pd.read_excel(file_path, sheet_name=None, dtype=str)
-
-        # --- LÓGICA DE VENCIMIENTO CON ORDEN Y FILTRO CORREGIDOS ---
-        first_sheet_name = next(iter(sheets_dict))
-        df_for_month_check = sheets_dict[first_sheet_name]
-
-        meses_en_archivo = pd.to_datetime(
-            df_for_month_check['MES PAGO'], format='%B %Y', errors='coerce'
-        ).dt.to_period('M')
-        mes_nuevo_periodo = meses_en_archivo.dropna().unique()[0]
-        mes_nuevo_fecha = mes_nuevo_periodo.to_timestamp().date()
-        logger.info(f"Mes detectado en el archivo: {mes_nuevo_periodo}")
-
-        ultimo_mes_registrado = models.Comision.objects.aggregate(
-            max_mes=Max('mes_pago')
-        )['max_mes']
-
-        if ultimo_mes_registrado:
-            logger.info(
-                f"Último mes de PAGO en la BD: {ultimo_mes_registrado.strftime('%Y-%m')}"
-            )
-
-            if mes_nuevo_fecha > ultimo_mes_registrado:
-                # PASO 1: Vencer por inactividad PRIMERO. Capturamos ambos resultados.
-                logger.info("El mes del archivo es nuevo. Ejecutando lógica de vencimiento...")
-
-                resultado_inactividad, pdv_activos_del_ciclo = _vencer_por_inactividad_helper(
-                    ultimo_mes_registrado
-                )
+def _borrar_archivo(file_path):
+    if os.path.exists(file_path):
+        intentos = 5
+        for i in range(intentos):
+            try:
+                os.remove(file_path)
                 logger.info(
-                    f"Resultado del vencimiento por inactividad: {resultado_inactividad}"
-                )
-
-                # PASO 2: Vencer por cambio de mes DESPUÉS, USANDO LA LISTA DE PDV ACTIVOS.
-                logger.warning(
-                    "Venciendo comisiones restantes de PDV ACTIVOS por cambio de mes."
+                    f"Archivo temporal {file_path} eliminado con éxito."
                 )
-
-                if pdv_activos_del_ciclo:  # Solo ejecutar si hubo PDV activos
-                    with transaction.atomic():
-                        # AÑADIMOS EL FILTRO 'idpos__in'
-                        num_actualizadas = models.Comision.objects.filter(
-                            estado__in=['Pendiente', 'Acumulada'],
-                            idpos__in=pdv_activos_del_ciclo
-                        ).update(
-                            estado='Vencida',
-                            producto='Vencida por cambio de mes'
-                        )
-                    logger.info(
-                        f"Se actualizaron {num_actualizadas} comisiones de PDV activos "
-                        f"a 'Vencida por cambio de mes'."
+                break
+            except PermissionError:
+                if i < intentos - 1:
+                    logger.warning(
+                        f"Intento {i+1}/{intentos} fallido al borrar {file_path}. "
+                        f"Reintentando en 2 segundos..."
                     )
+                    time.sleep(2)
                 else:
-                    logger.info(
-                        "No hubo PDV activos en el ciclo anterior para vencer por cambio de mes."
+                    logger.error(
+                        f"No se pudo borrar el archivo temporal {file_path} "
+                        f"después de {intentos} intentos."
                     )
 
-        else:
-            logger.info(
-                "No hay comisiones previas. Se omite la validación de vencimiento."
-            )
-        # --- FIN: LÓGICA DE VENCIMIENTO CORREGIDA ---
-
-        # El resto del procesamiento del archivo continúa
-        all_asesores_excel = set()
-        for sheet_name, df in sheets_dict.items():
-            if 'PRIM_LLAMADA_ACTIVACION' in df.columns:
-                numeros_de_fecha = pd.to_numeric(
-                    df['PRIM_LLAMADA_ACTIVACION'], errors='coerce'
-                )
-                s_dates = pd.to_datetime(
-                    numeros_de_fecha,
-                    origin='1899-12-30',
-                    unit='D',
-                    errors='coerce'
-                )
-                df['PRIM_LLAMADA_ACTIVACION'] = s_dates.dt.date.replace(
-                    {pd.NaT: None}
-                )
-            if 'MES LIQUIDACIÓN' in df.columns:
-                s_dates = pd.to_datetime(
-                    df['MES LIQUIDACIÓN'], format='%B %Y', errors='coerce'
-                )
-                df['MES LIQUIDACIÓN'] = s_dates.dt.date.replace({pd.NaT: None})
-            if 'MES PAGO' in df.columns:
-                s_dates = pd.to_datetime(
-                    df['MES PAGO'], format='%B %Y', errors='coerce'
-                )
-                df['MES PAGO'] = s_dates.dt.date.replace({pd.NaT: None})
-            if 'COMISION FINAL' in df.columns:
-                numeric_series = pd.to_numeric(
-                    df['COMISION FINAL'], errors='coerce'
-                )
-                df['COMISION FINAL'] = numeric_series.apply(
-                    lambda x: str(x) if pd.notna(x) else None
-                )
-            if 'ASESOR' in df.columns:
-                all_asesores_excel.update(
-                    df['ASESOR'].dropna().astype(str).unique()
-                )
 
-        usuarios_map = {
-            user.username: user
-            for user in User.objects.filter(username__in=all_asesores_excel)
-        }
-        comisiones_para_crear = []
-
-        for sheet_name, df_sheet in sheets_dict.items():
-            df_sheet = df_sheet.replace({np.nan: None, pd.NaT: None})
-            for index, row in df_sheet.iterrows():
-                iccid = str(row.get('ICCID') or '').strip()
-                producto = str(row.get('PRODUCTO') or '').strip()
-                idpos = str(row.get('IDPOS') or '').strip()
-                punto_de_venta = str(row.get('PUNTO DE VENTA') or '').strip()
-                if not iccid and not producto and not idpos and not punto_de_venta:
-                    continue
-                is_special_case = not iccid and not producto
-                if is_special_case:
-                    if not idpos:
-                        continue
-                else:
-                    if not iccid or not producto:
-                        continue
-                pago_valor = str(row.get('PAGO') or '').strip().lower()
-                estado_final = 'Pendiente'
-                if is_special_case or 'acumulado' in pago_valor:
-                    estado_final = 'Acumulada'
-                asesor_identificador = str(row.get('ASESOR') or '').strip()
-                usuario_encontrado = usuarios_map.get(asesor_identificador)
-                comisiones_para_crear.append(
-                    models.Comision(
-                        asesor_identificador=asesor_identificador,
-                        asesor=usuario_encontrado,
-                        iccid=iccid,
-                        distribuidor=row.get('DISTRIBUIDOR'),
-                        producto=producto,
-                        co_id=row.get('CO_ID'),
-                        prim_llamada_activacion=row.get(
-                            'PRIM_LLAMADA_ACTIVACION'
-                        ),
-                        min=str(row.get('MIN') or ''),
-                        idpos=idpos,
-                        punto_de_venta=punto_de_venta,
-                        ruta=row.get('RUTA'),
-                        comision_final=row.get('COMISION FINAL'),
-                        pago=pago_valor,
-                        mes_liquidacion=row.get('MES LIQUIDACIÓN'),
-                        mes_pago=row.get('MES PAGO'),
-                        estado=estado_final,
-                    )
-                )
+def _directorio_bloques(carga):
+    return f"{carga.ruta_archivo}.bloques"
+
+
+def borrar_archivos_carga(carga):
+    """Bloques y archivo temporal de una carga que ya no se va a reanudar."""
+    if carga.ruta_archivo:
+        shutil.rmtree(_directorio_bloques(carga), ignore_errors=True)
+        _borrar_archivo(carga.ruta_archivo)
 
-        if comisiones_para_crear:
-            with transaction.atomic():
-                models.Comision.objects.bulk_create(
-                    comisiones_para_crear, batch_size=5000
-                )
 
-        registros_creados_total = len(comisiones_para_crear)
+def _vencer_antes_de_cargar(mes_nuevo_fecha):
+    """Vencimiento de las comisiones abiertas si el archivo trae un mes nuevo."""
+    ultimo_mes_registrado = models.Comision.objects.aggregate(
+        max_mes=Max('mes_pago')
+    )['max_mes']
+
+    if ultimo_mes_registrado:
         logger.info(
-            f"Proceso completado. Se crearon {registros_creados_total} nuevos registros."
+            f"Último mes de PAGO en la BD: {ultimo_mes_registrado.strftime('%Y-%m')}"
         )
-        mensaje_exito = (
-            f"Se crearon {registros_creados_total} nuevos registros de comisión."
+
+        if mes_nuevo_fecha > ultimo_mes_registrado:
+            # PDV sin pagos en el ciclo -> 'Vencida por no visita';
+            # PDV con pagos -> 'Vencida por cambio de mes'. Una sola sentencia.
+            logger.info("El mes del archivo es nuevo. Ejecutando lógica de vencimiento...")
+
+            resultado_vencimiento, _ = _vencer_por_inactividad_helper(
+                ultimo_mes_registrado, vencer_activos=True
+            )
+            logger.info(f"Resultado del vencimiento: {resultado_vencimiento}")
+
+    else:
+        logger.info(
+            "No hay comisiones previas. Se omite la validación de vencimiento."
         )
-        send_completion_email(user_id, 'success', mensaje_exito)
-        return (
-            f"Proceso completado. Se crearon {registros_creados_total} nuevos registros."
+
+
+def _marcar_carga_fallida(carga, user_id, error):
+    logger.error(
+        f"La carga de comisiones falló debido a: {error}", exc_info=True
+    )
+    mensaje_error = str(error)
+    if carga is not None:
+        carga.estado = 'error'
+        models.ComisionCarga.objects.filter(pk=carga.pk).update(
+            estado='error', detalle=mensaje_error
         )
+    notificar_usuario(user_id, f"Error al procesar el archivo: {mensaje_error}", 'error', carga=carga)
+    send_completion_email(user_id, 'error', mensaje_error)
 
-    except Exception as e:
-        logger.error(
-            f"La tarea principal falló debido a: {e}", exc_info=True
+
+class BloqueDescartado(Exception):
+    """El bloque ya estaba confirmado o es de un intento anterior: su inserción se deshace."""
+
+
+def _intento_vigente(carga, intento):
+    """
+    Cada ejecución de _ejecutar_carga es un intento nuevo; las tareas de un
+    intento anterior (p. ej. bloques aún en cola cuando otro falló y la carga
+    se reanudó) no hacen nada. `intento` None: tareas encoladas sin intento.
+    """
+    return carga.estado == 'processing' and (intento is None or carga.checkpoint.get('intento') == intento)
+
+
+def _ejecutar_carga(carga, user_id):
+    """
+    Avanza la carga desde su checkpoint: revisión y división del archivo en
+    bloques, vencimiento (una sola vez) y un chord con los bloques que falten
+    por confirmar. Un archivo inválido (p. ej. con dos meses de pago) falla
+    en la división, antes de vencer o insertar nada.
+    """
+    checkpoint = carga.checkpoint
+    if 'bloques' not in checkpoint:
+        # Las hojas se leen en paralelo (COMISIONES_PROCESOS_LECTURA)
+        checkpoint['bloques'] = dividir_libro(
+            carga.ruta_archivo, _directorio_bloques(carga), mes_pago=carga.mes_detectado,
+            procesos=getattr(settings, 'COMISIONES_PROCESOS_LECTURA', 1),
         )
-        mensaje_error = str(e)
-        send_completion_email(user_id, 'error', mensaje_error)
+        checkpoint['hechos'] = {}
+        carga.save(update_fields=['checkpoint'])
+        logger.info(f"Carga {carga.id}: archivo dividido en {len(checkpoint['bloques'])} bloques.")
+
+    if not checkpoint.get('vencimiento'):
+        _vencer_antes_de_cargar(carga.mes_detectado)
+        checkpoint['vencimiento'] = True
+        carga.save(update_fields=['checkpoint'])
+
+    checkpoint['intento'] = intento = checkpoint.get('intento', 0) + 1
+    carga.save(update_fields=['checkpoint'])
+
+    hechos = checkpoint.get('hechos', {})
+    pendientes = [i for i in range(len(checkpoint['bloques'])) if str(i) not in hechos]
+    if not pendientes:
+        finalizar_carga_comisiones.delay([], carga.id, user_id, intento)
+        return 0
+
+    chord(
+        procesar_bloque_comisiones.s(carga.id, indice, user_id, intento) for indice in pendientes
+    )(finalizar_carga_comisiones.s(carga.id, user_id, intento))
+    return len(pendientes)
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def procesar_archivo_comisiones(file_path, user_id, file_name=None, file_hash=None):
+    """
+    Tarea de Celery para procesar un archivo Excel de comisiones y notificar por email.
+    Cada ejecución queda registrada en una ComisionCarga; un archivo con el mismo
+    contenido que una carga vigente se rechaza.
+
+    Los bloques del archivo se cargan en paralelo (procesar_bloque_comisiones) y
+    cada uno queda confirmado en el checkpoint de la carga. Si algo falla, el
+    archivo se conserva y la carga se puede reanudar (reanudar_carga_comisiones).
+    """
+    carga = None
+    lector = None
+    try:
+        # El mes se toma del primer bloque; el libro completo se lee al dividirlo
+        lector = leer_bloques_excel(file_path)
+        primer_bloque = next(lector, None)
+        lector.close()
+        if primer_bloque is None:
+            raise ValueError("El archivo no tiene filas para procesar.")
+
+        df_for_month_check = primer_bloque[1]
+        if 'MES PAGO' not in df_for_month_check.columns:
+            raise ValueError('Falta la columna obligatoria "MES PAGO".')
+
+        meses_en_archivo = meses_desde_texto(df_for_month_check['MES PAGO']).dropna()
+        if meses_en_archivo.empty:
+            raise ValueError('No se encontró un mes válido en "MES PAGO" (Ej: "Diciembre 2025").')
+        mes_nuevo_fecha = meses_en_archivo.iloc[0]
+        logger.info(f"Mes detectado en el archivo: {mes_nuevo_fecha:%Y-%m}")
+
+        file_hash = file_hash or hash_archivo(file_path)
+        # Si el broker reentrega la tarea (worker caído), se retoma la misma carga
+        carga = models.ComisionCarga.objects.filter(
+            hash_archivo=file_hash, ruta_archivo=file_path, estado='processing'
+        ).first()
+        if carga is None:
+            try:
+                carga = models.ComisionCarga.objects.create(
+                    created_by_id=user_id,
+                    file_name=file_name or os.path.basename(file_path),
+                    mes_detectado=mes_nuevo_fecha,
+                    hash_archivo=file_hash,
+                    ruta_archivo=file_path,
+                )
+            except IntegrityError:
+                raise ValueError("Este archivo ya fue cargado y la carga sigue vigente.") from None
+        notificar_usuario(user_id, f"Procesando {carga.file_name}...", carga=carga)
+
+        bloques = _ejecutar_carga(carga, user_id)
+        return f"Carga {carga.id} en proceso: {bloques} bloques enviados."
+
+    except Exception as e:
+        _marcar_carga_fallida(carga, user_id, e)
+        if carga is None:
+            # Sin carga no hay nada que reanudar
+            _borrar_archivo(file_path)
         return f"El proceso falló: {str(e)}"
 
     finally:
-        # Limpieza del archivo
-        locale.setlocale(locale.LC_TIME, '')
-        if os.path.exists(file_path):
-            intentos = 5
-            for i in range(intentos):
-                try:
-                    os.remove(file_path)
-                    logger.info(
-                        f"Archivo temporal {file_path} eliminado con éxito."
-                    )
-                    break
-                except PermissionError:
-                    if i < intentos - 1:
-                        logger.warning(
-                            f"Intento {i+1}/{intentos} fallido al borrar {file_path}. "
-                            f"Reintentando en 2 segundos..."
-                        )
-                        time.sleep(2)
-                    else:
-                        logger.error(
-                            f"No se pudo borrar el archivo temporal {file_path} "
-                            f"después de {intentos} intentos."
-                        )
+        if lector is not None:
+            lector.close()
+
+
+def _confirmar_bloque(carga_id, indice, intento, resultado):
+    """
+    Se ejecuta en la transacción que inserta el bloque: checkpoint y avance.
+    Con la fila de la carga bloqueada se revisa que el bloque no esté ya
+    confirmado (otra tarea con el mismo bloque) ni sea de un intento
+    anterior; si es así, BloqueDescartado deshace la inserción.
+    """
+    carga = models.ComisionCarga.objects.select_for_update().get(pk=carga_id)
+    if not _intento_vigente(carga, intento):
+        raise BloqueDescartado(f"Carga {carga_id}: el bloque {indice} es de un intento anterior.")
+    if str(indice) in carga.checkpoint.get('hechos', {}):
+        raise BloqueDescartado(f"Carga {carga_id}: el bloque {indice} ya estaba confirmado.")
+    hecho = {
+        clave: resultado[clave]
+        for clave in ('filas', 'descartadas', 'duplicadas', 'existentes', 'creadas')
+    }
+    # Las filas repetidas en el archivo se quitaron al dividirlo
+    repetidas = carga.checkpoint['bloques'][indice].get('duplicadas', 0)
+    hecho['filas'] += repetidas
+    hecho['duplicadas'] += repetidas
+    carga.checkpoint.setdefault('hechos', {})[str(indice)] = hecho
+    carga.registros_creados += hecho['creadas']
+    carga.filas_procesadas += hecho['filas']
+    segundos = (timezone.now() - carga.created_at).total_seconds()
+    carga.filas_por_segundo = (
+        round(carga.filas_procesadas / segundos) if segundos > 0 else carga.filas_procesadas
+    )
+    carga.save(update_fields=['checkpoint', 'registros_creados', 'filas_procesadas', 'filas_por_segundo'])
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def procesar_bloque_comisiones(carga_id, indice, user_id, intento=None):
+    """
+    Carga un bloque del manifiesto de la carga. Si el worker muere, el broker
+    reentrega la tarea; un bloque ya confirmado no se vuelve a cargar. Si la
+    carga falló o se reanudó después de encolar la tarea, no hace nada.
+    """
+    carga = models.ComisionCarga.objects.get(pk=carga_id)
+    if not _intento_vigente(carga, intento):
+        logger.info(f"Carga {carga_id}: bloque {indice} omitido (carga en '{carga.estado}' o intento anterior).")
+        return None
+    hechos = carga.checkpoint.get('hechos', {})
+    if str(indice) in hechos:
+        return hechos[str(indice)]
+
+    try:
+        estadisticas = cargar_comisiones(
+            iterar_filas_comisiones(
+                [leer_bloque(carga.checkpoint['bloques'][indice])], mes_pago=carga.mes_detectado
+            ),
+            carga,
+            confirmar=lambda resultado: _confirmar_bloque(carga_id, indice, intento, resultado),
+        )
+    except BloqueDescartado as e:
+        logger.info(str(e))
+        return None
+    except Exception as e:
+        carga.refresh_from_db()
+        if _intento_vigente(carga, intento):
+            _marcar_carga_fallida(carga, user_id, e)
+        raise
+
+    carga.refresh_from_db()
+    notificar_usuario(
+        user_id,
+        f"Procesando {carga.file_name}: {len(carga.checkpoint['hechos'])} de "
+        f"{len(carga.checkpoint['bloques'])} bloques ({carga.filas_por_segundo} filas/s).",
+        carga=carga,
+    )
+    return estadisticas
+
+
+@shared_task
+def finalizar_carga_comisiones(resultados, carga_id, user_id, intento=None):
+    """Cuerpo del chord: cierra la carga cuando todos los bloques están confirmados."""
+    carga = models.ComisionCarga.objects.get(pk=carga_id)
+    if not _intento_vigente(carga, intento):
+        return f"Carga {carga_id}: intento anterior, no se cierra."
+    bloques = carga.checkpoint.get('bloques', [])
+    hechos = carga.checkpoint.get('hechos', {})
+    if len(hechos) < len(bloques):
+        _marcar_carga_fallida(
+            carga, user_id,
+            ValueError(f"Faltan {len(bloques) - len(hechos)} bloques por cargar; reanude la carga."),
+        )
+        return f"Carga {carga_id} incompleta."
+
+    estadisticas = {
+        clave: sum(bloque[clave] for bloque in hechos.values())
+        for clave in ('filas', 'descartadas', 'duplicadas', 'existentes', 'creadas')
+    }
+    registros_creados_total = estadisticas['creadas']
+    segundos = (timezone.now() - carga.created_at).total_seconds()
+
+    logger.info(
+        f"Proceso completado. Se crearon {registros_creados_total} nuevos registros."
+    )
+    mensaje_exito = (
+        f"Se crearon {registros_creados_total} nuevos registros de comisión."
+    )
+    if estadisticas['descartadas'] or estadisticas['duplicadas'] or estadisticas['existentes']:
+        mensaje_exito += (
+            f" Se omitieron {estadisticas['descartadas']} filas inválidas, "
+            f"{estadisticas['duplicadas']} repetidas y "
+            f"{estadisticas['existentes']} que ya estaban cargadas."
+        )
+    carga.estado = 'success'
+    carga.registros_creados = registros_creados_total
+    carga.filas_procesadas = estadisticas['filas']
+    carga.filas_por_segundo = round(estadisticas['filas'] / segundos) if segundos > 0 else estadisticas['filas']
+    carga.detalle = (
+        f"{mensaje_exito} {estadisticas['filas']} filas leídas en {len(bloques)} bloques, "
+        f"{segundos:.1f}s ({carga.filas_por_segundo} filas/s)."
+    )
+    carga.save(update_fields=['estado', 'registros_creados', 'filas_procesadas', 'filas_por_segundo', 'detalle'])
+    notificar_usuario(user_id, mensaje_exito, 'success', carga=carga)
+    send_completion_email(user_id, 'success', mensaje_exito)
+
+    # Limpieza: bloques y archivo temporal ya no hacen falta
+    borrar_archivos_carga(carga)
+    return (
+        f"Proceso completado. Se crearon {registros_creados_total} nuevos registros."
+    )
+
+
+@shared_task
+def reanudar_carga_comisiones(carga_id, user_id):
+    """Retoma una carga fallida desde su checkpoint (sin repetir bloques ni vencimiento)."""
+    carga = models.ComisionCarga.objects.get(pk=carga_id)
+    try:
+        if carga.estado != 'error':
+            raise ValueError(f"La carga {carga_id} está en estado '{carga.estado}'; solo se reanudan cargas con error.")
+        if 'bloques' not in carga.checkpoint and not (carga.ruta_archivo and os.path.exists(carga.ruta_archivo)):
+            raise ValueError("El archivo de la carga ya no existe; hay que subirlo de nuevo.")
+        carga.estado = 'processing'
+        try:
+            carga.save(update_fields=['estado'])
+        except IntegrityError:
+            raise ValueError("Hay otra carga vigente con el mismo archivo.") from None
+        notificar_usuario(user_id, f"Reanudando {carga.file_name}...", carga=carga)
+        bloques = _ejecutar_carga(carga, user_id)
+        return f"Carga {carga.id} reanudada: {bloques} bloques pendientes."
+    except Exception as e:
+        _marcar_carga_fallida(carga, user_id, e)
+        return f"No se pudo reanudar la carga: {str(e)}"
 
 
 # ---- TAREA PROGRAMADA (SIN CAMBIOS, AHORA USA EL HELPER CORREGIDO) ----
@@ -1,3 +1,280 @@
-from django.test import TestCase
+import numpy as np
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from intranet.formulas import (
+    MAX_COMPILADAS_TEXTO, FormulaError, MotorFormulas, normalizar_formula_legacy, parsear_expresion,
+)
+
+
+FORMULAS = [
+    {'id': 100, 'nombre': 'Precio publico', 'price_id': 1, 'formula': "['Valor', '-', 'Descuento']"},
+    {
+        'id': 101, 'nombre': 'Precio sub', 'price_id': 2,
+        'formula': "['(', 'tope', '+', 'ajuste', ')', 'if', 'Valor', '>', '1000000', 'else', '(', 'Costo', '*', 'margen', '+', 'ajuste', ')']",
+    },
+    {'id': 102, 'nombre': 'Precio premium', 'price_id': 3, 'formula': "['precioPublico', '*', 'margen']"},
+    # Sintaxis antigua: '=' como comparación y entradas en minúscula
+    {
+        'id': 3, 'nombre': 'Precio Addi', 'price_id': 4,
+        'formula': "['valor', '*', '1.1', 'if', 'costo', '>', '=', '500000', 'and', 'descuento', '=', '0', 'else', 'valor']",
+    },
+]
+VARIABLES = [
+    {'price_id': 1, 'name': 'margen', 'formula': "['1.12']"},
+    {'price_id': 1, 'name': 'ajuste', 'formula': "['0']"},
+    {'price_id': 2, 'name': 'ajuste', 'formula': "['1000']"},
+    {'price_id': 2, 'name': 'tope', 'formula': "['min', '(', 'Valor', '*', '0.95', ',', 'Costo', '*', 'margen', ')']"},
+]
+
+# Expresiones que recorren todos los nodos permitidos (_NODOS_PERMITIDOS)
+EXPRESIONES = (
+    'Valor - Descuento',
+    'Valor * 1.19 if Valor > 1000000 else Costo * margen',
+    'round(Valor / 1000) * 1000',
+    'min(Valor, Costo * 2) + max(Descuento, 10)',
+    'abs(Costo - Valor) ** 2',
+    'int(Valor / 3) + float(Costo)',
+    'Valor // 7 + Valor % 7',
+    '-Valor + +Costo',
+    'Valor if Costo < Valor and Descuento == 0 else Costo',
+    'Valor if Descuento > 0 or Costo >= 800000 else 0',
+    'Valor if not Descuento else Costo',
+    'Valor if 1000 < Valor <= 2000000 else Costo',
+    'Valor != Costo',
+    'Costo <= Valor',
+    'Valor * iva',
+    '5',
+    '',
+)
+
+
+class EvaluacionPorColumnasTests(SimpleTestCase):
+    """`evaluar_columnas` debe dar lo mismo que `evaluar` fila a fila."""
+
+    def setUp(self):
+        self.motor = MotorFormulas(FORMULAS, VARIABLES)
+        self.columnas = {
+            'Valor': np.array([500000.0, 1500000.0, 2500000.0, 999999.5, 800000.0]),
+            'Costo': np.array([400000.0, 1200000.0, 2600000.0, 800000.0, 800000.0]),
+            'Descuento': np.array([0.0, 50000.0, 0.0, 0.0, 1.0]),
+            'iva': np.array([1.0, 1.19, 1.19, 1.0, 1.0]),
+        }
+        self.largo = len(self.columnas['Valor'])
+
+    def _fila_a_fila(self, compilada):
+        return np.array([
+            float(compilada.evaluar({nombre: float(valores[i]) for nombre, valores in self.columnas.items()}))
+            for i in range(self.largo)
+        ])
+
+    def assertIgualQueFilaAFila(self, compilada):
+        resultado = compilada.evaluar_columnas(self.columnas, self.largo)
+        self.assertEqual(resultado.shape, (self.largo,))
+        np.testing.assert_allclose(resultado, self._fila_a_fila(compilada), rtol=1e-12, err_msg=compilada.nombre)
+
+    def test_expresiones(self):
+        for texto in EXPRESIONES:
+            with self.subTest(texto=texto):
+                self.assertIgualQueFilaAFila(self.motor.compilar_texto(texto, 2, origen=texto or '<vacía>'))
+
+    def test_formulas_con_variables(self):
+        for nombre in self.motor.formulas:
+            with self.subTest(formula=nombre):
+                self.assertIgualQueFilaAFila(self.motor.compilar(nombre))
+
+    def test_and_or_not_son_operaciones_logicas(self):
+        # Sobre arrays, `and`/`or`/`not` de Python levantarían "truth value is ambiguous"
+        for texto, funcion in (
+            ('Valor if Costo < Valor and Descuento == 0 else Costo', '_y'),
+            ('Valor if Descuento > 0 or Costo >= 800000 else 0', '_o'),
+            ('Valor if not Descuento else Costo', '_no'),
+            ('Valor if 1000 < Valor <= 2000000 else Costo', '_y'),
+        ):
+            with self.subTest(texto=texto):
+                compilada = self.motor.compilar_texto(texto, 2)
+                self.assertIn(funcion, compilada.codigo_vectorizado.co_names)
+                self.assertIn('_si', compilada.codigo_vectorizado.co_names)
+
+    def test_entrada_faltante(self):
+        compilada = self.motor.compilar_texto('Valor * Costo', 2)
+        with self.assertRaises(NameError):
+            compilada.evaluar({'Valor': 1.0})
+        with self.assertRaises(NameError):
+            compilada.evaluar_columnas({'Valor': self.columnas['Valor']}, self.largo)
+        self.assertEqual(compilada.evaluar({'Valor': 2.0}, por_defecto=0), 0)
+
+    def test_division_por_cero(self):
+        compilada = self.motor.compilar_texto('Valor / Descuento', 2)
+        with self.assertRaises(ZeroDivisionError):
+            compilada.evaluar({'Valor': 500000.0, 'Descuento': 0.0})
+        with self.assertRaisesRegex(FormulaError, r'3 fila\(s\).*Descuento=0\.0, Valor=500000\.0'):
+            compilada.evaluar_columnas(self.columnas, self.largo)
+
+    def test_desbordamiento(self):
+        compilada = self.motor.compilar_texto('10 ** Valor', 2)
+        with self.assertRaises(OverflowError):
+            compilada.evaluar({'Valor': 500000.0})
+        with self.assertRaisesRegex(FormulaError, 'no da un número'):
+            compilada.evaluar_columnas(self.columnas, self.largo)
+
+    def test_nan(self):
+        compilada = self.motor.compilar_texto('Valor * 1e308 - Costo * 1e308', 2)
+        self.assertTrue(np.isnan(compilada.evaluar({'Valor': 500000.0, 'Costo': 400000.0})))
+        with self.assertRaisesRegex(FormulaError, '5 fila'):
+            compilada.evaluar_columnas(self.columnas, self.largo)
+
+    def test_constante_sin_entradas(self):
+        with self.assertRaisesRegex(FormulaError, 'sus constantes'):
+            self.motor.compilar_texto('1e308 * 10', 2).evaluar_columnas(self.columnas, self.largo)
+
+
+class ValidacionFormulasTests(SimpleTestCase):
+
+    def test_nodos_no_permitidos(self):
+        for texto in (
+            "__import__('os')",
+            'Valor.real',
+            'Valor.__class__',
+            'Valor[0]',
+            '[Valor, Costo]',
+            '(Valor, Costo)',
+            '{Valor: 1}',
+            'lambda: Valor',
+            '(x := Valor)',
+            '[x for x in Valor]',
+            "'texto'",
+            'None',
+            'round(Valor, ndigits=2)',
+            'sum(Valor)',
+            'Valor.bit_length()',
+            'Valor if Valor is Costo else 0',
+            'Valor in Costo',
+            'Valor & Costo',
+            '~Valor',
+            'Valor << 2',
+            "f'{Valor}'",
+        ):
+            with self.subTest(texto=texto), self.assertRaises(FormulaError):
+                parsear_expresion(texto)
+
+    def test_sintaxis_invalida(self):
+        for texto in ('Valor *', 'Valor = 1', '(Valor', 'Valor Costo'):
+            with self.subTest(texto=texto), self.assertRaisesRegex(FormulaError, 'Sintaxis inválida'):
+                parsear_expresion(texto)
+
+    def test_marcadores_y_vacia(self):
+        motor = MotorFormulas([], [])
+        self.assertEqual(motor.compilar_texto('Valor * 2 Sub', 2).evaluar({'Valor': 3}), 6)
+        self.assertEqual(motor.compilar_texto('', 2).evaluar({}), 0)
+
+    def test_no_se_compilan_funciones_por_nombre_de_variable(self):
+        # Una variable llamada como una función no reemplaza a la función
+        motor = MotorFormulas([], [{'price_id': 1, 'name': 'min', 'formula': "['__import__']"}])
+        self.assertEqual(motor.compilar_texto('min(Valor, 2)', 2).evaluar({'Valor': 5}), 2)
+
+    def test_potencia_entera_acotada(self):
+        motor = MotorFormulas([], [])
+        with self.assertRaises(OverflowError):
+            motor.compilar_texto('9 ** 9 ** 9', 2).evaluar({})
+
+
+class ResolucionVariablesTests(SimpleTestCase):
+
+    def test_dependencias(self):
+        motor = MotorFormulas(FORMULAS, VARIABLES)
+        compilada = motor.compilar('Precio sub')
+        self.assertEqual(compilada.dependencias, {(2, 'tope'), (2, 'ajuste'), (1, 'margen')})
+        self.assertEqual(compilada.entradas, {'Valor', 'Costo'})
+        # tope = min(1,9M * 0,95, 1,5M * 1,12); ajuste de la lista 2 sombrea al global
+        self.assertAlmostEqual(compilada.evaluar({'Valor': 1900000, 'Costo': 1500000}), 1680000 + 1000)
+        self.assertAlmostEqual(compilada.evaluar({'Valor': 900000, 'Costo': 500000}), 560000 + 1000)
+
+    def test_alias_precio_publico(self):
+        motor = MotorFormulas(FORMULAS, VARIABLES)
+        compilada = motor.compilar('Precio premium')
+        self.assertAlmostEqual(compilada.evaluar({'Valor': 1000, 'Descuento': 100}), 900 * 1.12)
+
+    def test_ciclo_entre_variables(self):
+        motor = MotorFormulas(FORMULAS, VARIABLES + [
+            {'price_id': 2, 'name': 'a', 'formula': "['b', '+', '1']"},
+            {'price_id': 2, 'name': 'b', 'formula': "['Valor', '*', 'a']"},
+            {'price_id': 2, 'name': 'c', 'formula': "['c', '+', '1']"},
+        ])
+        with self.assertRaisesRegex(FormulaError, 'Dependencia circular.*a -> b -> a'):
+            motor.compilar_texto('a', 2)
+        with self.assertRaisesRegex(FormulaError, 'Dependencia circular.*c -> c'):
+            motor.compilar_texto('Valor + c', 2)
+        # La misma variable usada dos veces no es un ciclo
+        self.assertAlmostEqual(motor.compilar_texto('margen * margen', 2).evaluar({}), 1.12 * 1.12)
+
+    def test_ciclo_con_precio_publico(self):
+        motor = MotorFormulas(
+            [{'id': 100, 'nombre': 'Precio publico', 'price_id': 1, 'formula': "['PrecioPublico', '+', '1']"}],
+            [],
+        )
+        with self.assertRaisesRegex(FormulaError, 'Dependencia circular'):
+            motor.compilar('Precio publico')
+
+    def test_formulas_afectadas(self):
+        motor = MotorFormulas(FORMULAS, VARIABLES)
+        self.assertEqual(motor.formulas_afectadas([(2, 'tope')]), ['Precio sub'])
+        self.assertCountEqual(motor.formulas_afectadas([(1, 'margen')]), ['Precio sub', 'Precio premium'])
+
+    def test_formula_inexistente(self):
+        with self.assertRaisesRegex(FormulaError, 'No existe'):
+            MotorFormulas(FORMULAS, VARIABLES).compilar('Precio inexistente')
+
+
+class SintaxisLegacyTests(SimpleTestCase):
+
+    def test_normalizacion(self):
+        self.assertEqual(normalizar_formula_legacy('valor if costo > = 5 else descuento'), 'Valor if Costo >= 5 else Descuento')
+        self.assertEqual(normalizar_formula_legacy('valor if descuento = 0 else 1'), 'Valor if Descuento == 0 else 1')
+        self.assertEqual(normalizar_formula_legacy('valor if costo < = 5 else 1'), 'Valor if Costo <= 5 else 1')
+
+    def test_solo_ids_antiguos(self):
+        motor = MotorFormulas(FORMULAS + [
+            {'id': 103, 'nombre': 'Precio Fintech', 'price_id': 5, 'formula': "['valor', '*', '2']"},
+        ], VARIABLES)
+        self.assertEqual(motor.formulas['Precio Addi']['texto'], 'Valor * 1.1 if Costo >= 500000 and Descuento == 0 else Valor')
+        self.assertEqual(motor.formulas['Precio Fintech']['texto'], 'valor * 2')
+
+        addi = motor.compilar('Precio Addi')
+        self.assertAlmostEqual(addi.evaluar({'Valor': 1000000, 'Costo': 600000, 'Descuento': 0}), 1100000)
+        self.assertEqual(addi.evaluar({'Valor': 1000000, 'Costo': 600000, 'Descuento': 1}), 1000000)
+        self.assertEqual(addi.evaluar({'Valor': 1000000, 'Costo': 400000, 'Descuento': 0}), 1000000)
+        with self.assertRaises(NameError):
+            motor.compilar('Precio Fintech').evaluar({'Valor': 1})
+
+
+class CompilarTextoTests(SimpleTestCase):
+
+    def test_memoriza_por_texto_y_lista(self):
+        motor = MotorFormulas(FORMULAS, VARIABLES)
+        compilada = motor.compilar_texto("['Costo', '*', 'ajuste']", 2)
+        self.assertIs(motor.compilar_texto('Costo * ajuste', 2), compilada)
+        # Otra lista resuelve otras variables
+        otra = motor.compilar_texto('Costo * ajuste', 3)
+        self.assertIsNot(otra, compilada)
+        self.assertEqual(compilada.evaluar({'Costo': 2}), 2000)
+        self.assertEqual(otra.evaluar({'Costo': 2}), 0)
+
+    def test_tope(self):
+        motor = MotorFormulas(FORMULAS, VARIABLES)
+        primera = motor.compilar_texto('Valor + 0', 2)
+        for i in range(1, MAX_COMPILADAS_TEXTO):
+            motor.compilar_texto(f'Valor + {i}', 2)
+        self.assertEqual(len(motor._compiladas_texto), MAX_COMPILADAS_TEXTO)
+        self.assertIs(motor.compilar_texto('Valor + 0', 2), primera)
+
+        # Al llenarse se vacía y vuelve a empezar
+        motor.compilar_texto(f'Valor + {MAX_COMPILADAS_TEXTO}', 2)
+        self.assertEqual(len(motor._compiladas_texto), 1)
+        self.assertIsNot(motor.compilar_texto('Valor + 0', 2), primera)
+        self.assertLessEqual(len(motor._compiladas_texto), MAX_COMPILADAS_TEXTO)
+
+    def test_error_no_se_memoriza(self):
+        motor = MotorFormulas(FORMULAS, VARIABLES)
+        with self.assertRaises(FormulaError):
+            motor.compilar_texto('Valor.real', 2)
+        self.assertEqual(motor._compiladas_texto, {})
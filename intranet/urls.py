@@ -66,6 +66,7 @@ urlpatterns = [
     path('prices/<int:id>/', views.prices),
     path('variables/', views.variables_prices),
     path('variables/<int:id>/', views.variables_prices),
+    path('recalcular-precios', views.recalcular_precios),
     path('formulas/', views.formulas_prices),
     path('formulas/<int:id>/', views.formulas_prices),
 
@@ -77,6 +78,7 @@ urlpatterns = [
 
     path('historico-pendientes-cajero/', views.historico_pendientes_cajero, name='historico_pendientes_cajero'),
     path('get_filtros_precios/', views.get_filtros_precios, name='get_filtros_precios'),
+    path('get_filtros_precios/cache/', views.estadisticas_cache_precios, name='estadisticas_cache_precios'),
     path('buscar-precios/', views.buscar_precios, name='buscar_precios'),
     path('get_reportes_por_fecha/', views.get_reportes_por_fecha, name='get-reportes-por-fecha'),
     path('translate-products-prepago/admin', views.delete_translate_product_admin),
@@ -122,6 +124,7 @@ urlpatterns = [
     path('admin/usuarios/<str:username>/', views.usuario_detail, name='usuario_detail'),
     path("admin/comisiones/ultima-carga/", views.ultima_carga_comisiones),
     path("admin/comisiones/rollback-ultima-carga/", views.rollback_ultima_carga_comisiones),
+    path("admin/comisiones/reanudar-carga/", views.reanudar_carga_comisiones_view),
 
     path(
         'admin/comisiones-pendientes/',
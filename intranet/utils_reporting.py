@@ -1,10 +1,12 @@
 # utils_reporting.py
+import json
 from decimal import Decimal
 
-from django.db.models import Sum, Count
+from django.db import connection
+from django.db.models import F, Q, Sum, Count
 from django.db.models.functions import Coalesce
 
-from .models import Comision, PagoComision
+from .models import Comision, PagoComision, PagoComisionMetodo
 
 
 def decimal_or_zero(value):
@@ -64,6 +66,29 @@ def build_estado_chart(qs):
     ]
 
 
+def metodos_pago_por_pagos(pagos_ids):
+    """
+    Valor total y cantidad de pagos por método para los PagoComision
+    `pagos_ids` (lista o subconsulta de ids). Un solo GROUP BY sobre
+    PagoComisionMetodo; los totales no bajan de cero.
+    """
+    data = (
+        PagoComisionMetodo.objects
+        .filter(pago_id__in=pagos_ids)
+        .values('metodo')
+        .annotate(suma=Sum('valor'), cantidad=Count('pago_id', distinct=True))
+        .order_by('metodo')
+    )
+    return [
+        {
+            'metodo': item['metodo'],
+            'total_valor': max(decimal_or_zero(item['suma']), Decimal('0')),
+            'total_cantidad': item['cantidad'],
+        }
+        for item in data
+    ]
+
+
 def build_metodos_pago_chart(qs):
     """
     Agrega métodos de pago SOLO para pagos que estén vinculados
@@ -71,33 +96,138 @@ def build_metodos_pago_chart(qs):
     Nota: si un PagoComision contiene comisiones de varios meses,
     aparecerá en varios filtros, pero es consistente con el uso actual.
     """
-    pagos_qs = (
-        PagoComision.objects
-        .filter(comisiones_pagadas__in=qs)
-        .distinct()
+    return metodos_pago_por_pagos(
+        qs.filter(pagos__isnull=False).values('pagos_id')
+    )
+
+
+CLAVE_GRUPO_ASESOR = ('mes_pago', 'asesor_identificador', 'producto', 'estado')
+
+
+def _reporte_asesor_orm(qs, limite, desplazamiento):
+    """Lo mismo que reporte_asesor_agregado con consultas del ORM (motores distintos de PostgreSQL)."""
+    grupos_qs = (
+        qs.values(*CLAVE_GRUPO_ASESOR)
+        .annotate(cantidad=Count('id'), comision_final_total=Sum('comision_final'))
+        .order_by(F('mes_pago').desc(nulls_first=True), 'asesor_identificador', 'producto', 'estado')
+    )
+    grupos = list(grupos_qs[desplazamiento:desplazamiento + limite])
+
+    # ids y comprobante solo de los grupos de la página
+    detalle = {}
+    if grupos:
+        filtro = Q()
+        for grupo in grupos:
+            filtro |= Q(**{campo: grupo[campo] for campo in CLAVE_GRUPO_ASESOR})
+        filas = qs.filter(filtro).values_list(*CLAVE_GRUPO_ASESOR, 'id', 'pagos__comprobante_url')
+        for *clave, pk, comprobante in filas:
+            ids, comprobantes = detalle.setdefault(tuple(clave), (set(), []))
+            ids.add(pk)
+            if comprobante is not None and clave[3] == 'Pagada':
+                comprobantes.append(comprobante)
+    for grupo in grupos:
+        ids, comprobantes = detalle.get(tuple(grupo[campo] for campo in CLAVE_GRUPO_ASESOR), (set(), []))
+        grupo['individual_ids'] = sorted(ids)
+        grupo['comprobante_url'] = max(comprobantes, default=None)
+
+    kpis = qs.aggregate(
+        filas=Count('id'),
+        pagado=Sum('comision_final', filter=Q(estado='Pagada'), default=0),
+        pendiente=Sum('comision_final', filter=Q(estado__in=['Pendiente', 'Acumulada']), default=0),
     )
+    metodos = metodos_pago_por_pagos(qs.filter(estado='Pagada', pagos__isnull=False).values('pagos_id'))
+    metodos.sort(key=lambda item: item['total_valor'], reverse=True)
+    return {
+        'total_grupos': grupos_qs.count(),
+        'kpis': kpis,
+        'distribucion_estado': build_estado_chart(qs),
+        'metodos_pago': metodos,
+        'grupos': grupos,
+    }
+
 
-    metodos_totales = {}  # { 'Nequi': {'total_valor': Decimal, 'total_cantidad': int}, ... }
-
-    for pago in pagos_qs:
-        metodos = pago.metodos_pago or {}
-        for metodo, valor in metodos.items():
-            valor_dec = decimal_or_zero(valor)
-            if metodo not in metodos_totales:
-                metodos_totales[metodo] = {
-                    'total_valor': Decimal('0'),
-                    'total_cantidad': 0,
-                }
-            metodos_totales[metodo]['total_valor'] += valor_dec
-            metodos_totales[metodo]['total_cantidad'] += 1
-
-    result = []
-    for metodo, info in metodos_totales.items():
-        total_valor = max(info['total_valor'], Decimal('0'))
-        total_cantidad = max(info['total_cantidad'], 0)
-        result.append({
-            'metodo': metodo,
-            'total_valor': total_valor,
-            'total_cantidad': total_cantidad,
-        })
-    return result
+def reporte_asesor_agregado(qs, limite, desplazamiento):
+    """
+    Reporte del asesor en una sola sentencia (PostgreSQL) sobre las comisiones
+    ya filtradas de `qs`. El CTE `base` se materializa una vez y de él salen:
+      - total_grupos y la página de grupos (mes_pago, asesor, producto,
+        estado) con LIMIT/OFFSET; los ids y el comprobante solo se buscan
+        para los grupos de la página,
+      - KPIs (filas, pagado, pendiente), distribución por estado y
+        métodos de pago de los pagos ligados a comisiones 'Pagada'.
+    En otros motores (SQLite local) el mismo resultado sale de varias
+    consultas del ORM.
+    """
+    if connection.vendor != 'postgresql':
+        return _reporte_asesor_orm(qs, limite, desplazamiento)
+
+    sql_base, params_base = qs.values(
+        'id', 'mes_pago', 'asesor_identificador', 'producto', 'estado', 'comision_final', 'pagos_id'
+    ).order_by().query.sql_with_params()
+    tabla_pagos = PagoComision._meta.db_table
+    tabla_metodos = PagoComisionMetodo._meta.db_table
+
+    sql = f"""
+        WITH base (id, mes_pago, asesor_identificador, producto, estado, comision_final, pago_id) AS (
+            {sql_base}
+        ),
+        grupos AS (
+            SELECT mes_pago, asesor_identificador, producto, estado,
+                   count(*) AS cantidad, sum(comision_final) AS comision_final_total
+            FROM base
+            GROUP BY mes_pago, asesor_identificador, producto, estado
+        ),
+        pagina AS (
+            SELECT * FROM grupos
+            ORDER BY mes_pago DESC, asesor_identificador, producto, estado
+            LIMIT %s OFFSET %s
+        ),
+        detalle AS (
+            SELECT g.mes_pago, g.asesor_identificador, g.producto, g.estado,
+                   g.cantidad, g.comision_final_total,
+                   array_agg(DISTINCT b.id ORDER BY b.id) AS individual_ids,
+                   max(p.comprobante_url) FILTER (WHERE b.estado = 'Pagada') AS comprobante_url
+            FROM pagina g
+            JOIN base b
+              ON b.asesor_identificador = g.asesor_identificador AND b.estado = g.estado
+             AND b.mes_pago IS NOT DISTINCT FROM g.mes_pago AND b.producto IS NOT DISTINCT FROM g.producto
+            LEFT JOIN {tabla_pagos} p ON p.id = b.pago_id AND p.comprobante_url IS NOT NULL
+            GROUP BY g.mes_pago, g.asesor_identificador, g.producto, g.estado, g.cantidad, g.comision_final_total
+        ),
+        metodos AS (
+            SELECT m.metodo, sum(m.valor) AS total_valor, count(DISTINCT m.pago_id) AS total_cantidad
+            FROM {tabla_metodos} m
+            WHERE m.pago_id IN (SELECT pago_id FROM base WHERE estado = 'Pagada' AND pago_id IS NOT NULL)
+            GROUP BY m.metodo
+        )
+        SELECT
+            (SELECT count(*) FROM grupos),
+            (SELECT json_build_object(
+                'filas', count(*),
+                'pagado', coalesce(sum(comision_final) FILTER (WHERE estado = 'Pagada'), 0),
+                'pendiente', coalesce(sum(comision_final) FILTER (WHERE estado IN ('Pendiente', 'Acumulada')), 0)
+            ) FROM base),
+            (SELECT coalesce(json_agg(json_build_object('estado', estado, 'count', n) ORDER BY estado), '[]')
+             FROM (SELECT estado, count(*) AS n FROM base GROUP BY estado) d),
+            (SELECT coalesce(json_agg(json_build_object(
+                'metodo', metodo, 'total_valor', greatest(total_valor, 0), 'total_cantidad', total_cantidad
+             ) ORDER BY total_valor DESC), '[]') FROM metodos),
+            (SELECT coalesce(json_agg(row_to_json(d) ORDER BY d.mes_pago DESC, d.asesor_identificador, d.producto, d.estado), '[]')
+             FROM detalle d)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*params_base, limite, desplazamiento])
+        total_grupos, kpis, distribucion, metodos, grupos = cursor.fetchone()
+
+    # Según el driver, json llega ya decodificado o como texto
+    kpis, distribucion, metodos, grupos = (
+        json.loads(valor) if isinstance(valor, str) else valor
+        for valor in (kpis, distribucion, metodos, grupos)
+    )
+    return {
+        'total_grupos': total_grupos,
+        'kpis': kpis,
+        'distribucion_estado': distribucion,
+        'metodos_pago': metodos,
+        'grupos': grupos,
+    }
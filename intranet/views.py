@@ -4,7 +4,6 @@ import base64
 import calendar
 import io
 import json
-import locale
 import logging
 import operator
 import os
@@ -15,7 +14,7 @@ import string
 import tempfile
 import traceback
 import uuid
-import decimal
+import hashlib
 from django.conf import settings
 from django.core.mail import EmailMessage, get_connection
 from .tasks import enviar_transparency_email
@@ -67,15 +66,13 @@ from drf_yasg.utils import swagger_auto_schema
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User, Group
-from django.contrib.postgres.aggregates import ArrayAgg
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage, FileSystemStorage
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.db import IntegrityError, transaction
 from django.db.models import (
-    Case, Count, DecimalField, F, Max, OuterRef, Prefetch, Q, Subquery, Sum,
-    Value, When
+    Case, Count, DecimalField, F, Max, Prefetch, Q, Sum, When
 )
 from django.db.models.functions import Coalesce, Lag, TruncDay, TruncMonth
 from django.db.models.signals import pre_save
@@ -85,8 +82,6 @@ from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.dateparse import parse_date, parse_datetime
 from django.views.decorators.csrf import csrf_exempt
-from django.contrib.postgres.aggregates import ArrayAgg
-from django.db.models import Value
 from .models import Permisos, Permisos_usuarios
 
 from rest_framework import viewsets, permissions
@@ -108,17 +103,18 @@ from rest_framework import status
 from rest_framework.decorators import (
     api_view, parser_classes, permission_classes, schema
 )
-from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.exceptions import AuthenticationFailed, NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework_simplejwt.views import TokenObtainPairView
 
 
 # 4. Local Application Imports
 from sqlControl.sqlControl import Sql_conexion
-from . import models
+from . import models, resumen_comisiones
 from .models import (
     ActaEntrega, Comision, ImagenLogin, PagoComision, Perfil, Permisos_usuarios,
     ReporteDetalleVenta
@@ -129,7 +125,20 @@ from .serializers import (
     PagoComisionAdminSerializer, UserDataSerializer
 )
 from .services import process_sales_report_file
-from .tasks import procesar_archivo_comisiones
+from .formulas import FormulaError, obtener_motor
+from .motor_precios import calcular_matriz_prepago, normalize_string
+from .snapshot_precios import calcular_snapshot_carga, ultimos_snapshots
+from .ingesta_precios import guardar_carga_precios
+from .cache_precios import cache_filtros, cargas_recientes, marcas_disponibles
+from .cache_comisiones import cachear_respuesta
+from .paginacion import ORDEN_COMISIONES, ComisionesKeysetPagination
+from .recalculo_precios import RecalculoError, recalcular_por_variables
+from .ingesta_comisiones import abrir_libro, bloques_de_hoja, meses_desde_texto
+from .utils_reporting import metodos_pago_por_pagos, reporte_asesor_agregado
+from .historial_precios import (
+    descuentos_vigentes, fecha_ultima_carga, formatear_historial, historial_precios,
+)
+from .tasks import borrar_archivos_carga, procesar_archivo_comisiones, reanudar_carga_comisiones
 from .permissions import admin_permission_required # Asegúrate de que esta importación sea correcta
 from .sharepoint_utils import upload_comision_image
 from .sharepoint_utils import download_comision_image
@@ -908,21 +917,22 @@ def admin_pago_detail(request, pk):
                     fp = pago.fecha_pago.date()
                     mes_pago_destino = fp.replace(day=1)
 
-                # 2) Procesar comisiones
-                for com in comisiones_relacionadas:
-                    if es_comision_ledger(com):
-                        # Registro artificial (PAGO REGISTRADO, SALDO PENDIENTE, etc.) → se borra
-                        com.delete()
-                    else:
-                        # Comisión original: la devolvemos a Pendiente en el mes destino
-                        com.estado = 'Pendiente'  # o 'Acumulada' según tu negocio
-                        com.pagos = None
+                # 2) Procesar comisiones (el resumen mensual se ajusta al salir del bloque)
+                with resumen_comisiones.actualizar(c.pk for c in comisiones_relacionadas):
+                    for com in comisiones_relacionadas:
+                        if es_comision_ledger(com):
+                            # Registro artificial (PAGO REGISTRADO, SALDO PENDIENTE, etc.) → se borra
+                            com.delete()
+                        else:
+                            # Comisión original: la devolvemos a Pendiente en el mes destino
+                            com.estado = 'Pendiente'  # o 'Acumulada' según tu negocio
+                            com.pagos = None
 
-                        # Si tenemos mes_destino, movemos la comisión a ese mes
-                        if mes_pago_destino is not None:
-                            com.mes_pago = mes_pago_destino
+                            # Si tenemos mes_destino, movemos la comisión a ese mes
+                            if mes_pago_destino is not None:
+                                com.mes_pago = mes_pago_destino
 
-                        com.save()
+                            com.save()
 
                 # 3) Borrar el PagoComision
                 pago.delete()
@@ -963,6 +973,11 @@ def comisiones_pendientes_list(request):
       - idpos
       - fecha_inicio, fecha_fin (YYYY-MM-DD)
 
+    GET - Paginación:
+      - por defecto por número de página (?page=, con total exacto)
+      - ?cursor= (vacío en la primera página) pagina por cursor sin OFFSET;
+        ?conteo=estimado agrega el total estimado (ver paginacion.py)
+
     POST - Crea una comisión pendiente manual:
       Campos esperados:
         - idpos (str)  -> CÓDIGO DEL PDV (p.ej. 339152)
@@ -975,7 +990,7 @@ def comisiones_pendientes_list(request):
 
     # ------------------------- GET -------------------------
     if request.method == 'GET':
-        qs = Comision.objects.all()
+        qs = Comision.objects.select_related('asesor')
 
         # 🔹 Estados: si no viene nada, por defecto Pendiente + Acumulada
         estados = request.GET.getlist('estado')
@@ -999,11 +1014,9 @@ def comisiones_pendientes_list(request):
         idpos = request.GET.get('idpos')
         if idpos:
             # Si le pasas el código exacto (339152) matchea;
-            # si es cadena parcial/nombre, también gracias a icontains.
-            qs = qs.filter(
-                Q(idpos__iexact=idpos) |  # código exacto
-                Q(idpos__icontains=idpos)  # por si mandas algo parcial
-            )
+            # si es cadena parcial/nombre, también gracias a icontains
+            # (que ya incluye la coincidencia exacta, sin el OR de antes).
+            qs = qs.filter(idpos__icontains=idpos)
 
         fecha_inicio = request.GET.get('fecha_inicio')
         fecha_fin = request.GET.get('fecha_fin')
@@ -1023,14 +1036,17 @@ def comisiones_pendientes_list(request):
         qs = qs.filter(
             Q(pagos__isnull=True) |
             Q(producto__startswith="SALDO PENDIENTE")
-        ).order_by(
-            '-prim_llamada_activacion',
-            '-fecha_carga',
-            '-id'
-        )
+        ).order_by(*ORDEN_COMISIONES)  # orden del índice parcial de pendientes
 
-        paginator = StandardResultsSetPagination()
-        page = paginator.paginate_queryset(qs, request)
+        if 'cursor' in request.GET:
+            paginator = ComisionesKeysetPagination()
+        else:
+            paginator = StandardResultsSetPagination()
+        try:
+            page = paginator.paginate_queryset(qs, request)
+        except NotFound as e:
+            # Página o cursor inválido; admin_permission_required lo volvería un 500
+            return Response({'detail': e.detail}, status=status.HTTP_404_NOT_FOUND)
         serializer = ComisionPendienteAdminSerializer(page, many=True)
 
         # 👈 ESTE RETURN ES CLAVE
@@ -1132,6 +1148,7 @@ def comisiones_pendientes_list(request):
                 observacion=observacion,
             )
             comision.save()
+            resumen_comisiones.sumar(Comision.objects.filter(pk=comision.pk))
 
             serializer = ComisionPendienteAdminSerializer(comision)
             return Response(serializer.data, status=201)
@@ -1181,13 +1198,16 @@ def comision_pendiente_detail(request, pk):
             partial=partial
         )
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic(), resumen_comisiones.actualizar([comision.pk]):
+                serializer.save()
             return Response(serializer.data)
         return Response(serializer.errors, status=400)
 
     # ---------- DELETE ----------
     elif request.method == 'DELETE':
-        comision.delete()
+        with transaction.atomic():
+            resumen_comisiones.restar(Comision.objects.filter(pk=comision.pk))
+            comision.delete()
         return Response(status=204)
 
         
@@ -1449,6 +1469,7 @@ from django.db.models import Sum, Q
 
 @api_view(['GET'])
 @asesor_permission_required(allow_supervisor=True, allow_admin=True)
+@cachear_respuesta
 def reporte_comparativa_view(request):
     """
     Genera datos para el gráfico comparativo (mes actual vs anterior).
@@ -1766,6 +1787,11 @@ def pagar_comisiones_view(request):
         )
 
         # 1. Consolidar las comisiones originales que se están pagando
+        # (sin FOR UPDATE: las filas ya están bloqueadas y no se agrupa con bloqueo)
+        resumen_comisiones.mover(
+            models.Comision.objects.filter(pk__in=comision_ids, estado__in=['Pendiente', 'Acumulada']),
+            estado='Consolidada',
+        )
         comisiones_a_pagar.update(estado='Consolidada', pagos=pago)
 
         # 2. Si se usó saldo acumulado, crear un registro para reflejarlo
@@ -1838,7 +1864,10 @@ def pagar_comisiones_view(request):
                 iccid=f"AJUSTE-{pago.id}",
                 pagos=pago,
             )
-            
+
+        # 5. Registros creados por el pago al resumen mensual
+        resumen_comisiones.sumar(models.Comision.objects.filter(pagos=pago).exclude(estado='Consolidada'))
+
     return Response({"mensaje": "Pago procesado con éxito."}, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
@@ -1921,37 +1950,43 @@ def reporte_general_view(request):
     rutas_filter = request.query_params.getlist('rutas')
     estados_filter = request.query_params.getlist('estados')
 
-    # 2. Construir el queryset base
+    # 2. Querysets base: los totales salen del resumen mensual (ComisionResumenMensual),
+    #    los métodos de pago todavía se buscan desde Comision
     base_queryset = models.Comision.objects.exclude(estado='Consolidada')
+    resumen_queryset = models.ComisionResumenMensual.objects.exclude(estado='Consolidada')
 
-    # 3. Aplicar filtros dinámicamente
+    # 3. Aplicar filtros dinámicamente (mismos campos en ambos)
+    filtros = Q()
     if fecha_inicio_str and fecha_fin_str:
         try:
             fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').date()
             fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date()
-            base_queryset = base_queryset.filter(mes_pago__range=[fecha_inicio, fecha_fin])
+            filtros &= Q(mes_pago__range=[fecha_inicio, fecha_fin])
         except (ValueError, TypeError):
             pass
 
     if rutas_filter:
-        base_queryset = base_queryset.filter(ruta__in=rutas_filter)
+        filtros &= Q(ruta__in=rutas_filter)
 
     if estados_filter:
-        base_queryset = base_queryset.filter(estado__in=estados_filter)
+        filtros &= Q(estado__in=estados_filter)
+
+    base_queryset = base_queryset.filter(filtros)
+    resumen_queryset = resumen_queryset.filter(filtros)
 
     # 4. Calcular los KPIs
-    kpis_data = base_queryset.aggregate(
-        pagado=Sum('comision_final', filter=Q(estado='Pagada'), default=0),
-        pendiente=Sum('comision_final', filter=Q(estado__in=['Pendiente', 'Acumulada']), default=0),
-        vencido=Sum('comision_final', filter=Q(estado='Vencida'), default=0)
+    kpis_data = resumen_queryset.aggregate(
+        pagado=Sum('total', filter=Q(estado='Pagada'), default=0),
+        pendiente=Sum('total', filter=Q(estado__in=['Pendiente', 'Acumulada']), default=0),
+        vencido=Sum('total', filter=Q(estado='Vencida'), default=0)
     )
     
     total_comisiones = (kpis_data.get('pagado') or 0) + (kpis_data.get('pendiente') or 0) + (kpis_data.get('vencido') or 0)
 
     # 5. Preparar datos para las gráficas
-    evolucion_mensual = base_queryset.annotate(month=TruncMonth('mes_pago')).values('month').annotate(
-        pagado=Sum('comision_final', filter=Q(estado='Pagada'), default=0),
-        pendiente=Sum('comision_final', filter=Q(estado__in=['Pendiente', 'Acumulada', 'Vencida']), default=0)
+    evolucion_mensual = resumen_queryset.annotate(month=TruncMonth('mes_pago')).values('month').annotate(
+        pagado=Sum('total', filter=Q(estado='Pagada'), default=0),
+        pendiente=Sum('total', filter=Q(estado__in=['Pendiente', 'Acumulada', 'Vencida']), default=0)
     ).order_by('month')
 
     evolucion_chart_data = [
@@ -1959,23 +1994,16 @@ def reporte_general_view(request):
         for item in evolucion_mensual
     ]
 
-    distribucion_estado = base_queryset.values('estado').annotate(total=Sum('comision_final')).order_by('estado')
-
-    # Lógica de métodos de pago
-    pagos_ids = base_queryset.exclude(pagos__isnull=True).values_list('pagos_id', flat=True).distinct()
-    pagos_filtrados = models.PagoComision.objects.filter(id__in=pagos_ids)
-    valor_por_metodo = defaultdict(float)
-    cantidad_por_metodo = defaultdict(int)
+    distribucion_estado = [
+        {'estado': item['estado'], 'total': item['suma']}
+        for item in resumen_queryset.values('estado').annotate(suma=Sum('total')).order_by('estado')
+    ]
 
-    for pago in pagos_filtrados:
-        if isinstance(pago.metodos_pago, dict):
-            for metodo, valor in pago.metodos_pago.items():
-                valor_por_metodo[metodo] += float(valor)
-                cantidad_por_metodo[metodo] += 1
-    
+    # Métodos de pago: un GROUP BY sobre PagoComisionMetodo de los pagos del filtro
+    pagos_ids = base_queryset.exclude(pagos__isnull=True).values('pagos_id')
     reporte_metodos_pago = [
-        {'metodo': metodo, 'total_valor': total_valor, 'total_cantidad': cantidad_por_metodo.get(metodo, 0)}
-        for metodo, total_valor in valor_por_metodo.items()
+        {**item, 'total_valor': float(item['total_valor'])}
+        for item in metodos_pago_por_pagos(pagos_ids)
     ]
 
     # 6. Construir la respuesta final (con la corrección aplicada)
@@ -2131,6 +2159,7 @@ def fecha_corte_view(request):
 
 @api_view(['GET'])
 @asesor_permission_required(allow_supervisor=True, allow_admin=True)
+@cachear_respuesta
 def reporte_asesor_view(request):
     """
     Genera el reporte para el asesor.
@@ -2188,8 +2217,24 @@ def reporte_asesor_view(request):
         if idpos_filtro and idpos_filtro != 'todos':
             queryset_con_filtros = filtrar_por_idpos_o_nombre(queryset_con_filtros, idpos_filtro)
 
-        # Si no hay nada tras filtros, respondemos rápido
-        if not queryset_con_filtros.exists():
+        # 4. Una sola sentencia (CTE): grupos de la página, KPIs, distribución
+        #    y métodos de pago; la paginación va en el SQL (LIMIT/OFFSET)
+        #    Mismos valores de ?page= que PageNumberPagination: número o 'last'
+        tamano_pagina = 20
+        numero_pagina = request.query_params.get('page', 1)
+        ultima = numero_pagina in PageNumberPagination.last_page_strings
+        try:
+            pagina = 1 if ultima else int(numero_pagina)
+        except (TypeError, ValueError):
+            # Página inválida (404), salvo que no haya datos
+            pagina = None
+
+        reporte = reporte_asesor_agregado(
+            queryset_con_filtros, tamano_pagina, (max(pagina or 1, 1) - 1) * tamano_pagina
+        )
+
+        # Si no hay nada tras filtros, respondemos con la estructura vacía
+        if not reporte['kpis']['filas']:
             data = {
                 "kpis": {
                     "totalPagado": 0.0,
@@ -2209,53 +2254,18 @@ def reporte_asesor_view(request):
             }
             return Response(data)
 
-        # 4. Precalcular comprobantes por grupo (UN SOLO QUERY)
-        # Clave: (mes_pago, asesor_identificador, producto, estado)
-        comprobantes_por_grupo = {}
-
-        pagadas_con_comprobante = (
-            queryset_con_filtros
-            .filter(
-                estado='Pagada',
-                pagos__isnull=False,
-                pagos__comprobante_url__isnull=False,
+        total_grupos = reporte['total_grupos']
+        if ultima and total_grupos > tamano_pagina:
+            pagina = -(-total_grupos // tamano_pagina)
+            reporte = reporte_asesor_agregado(
+                queryset_con_filtros, tamano_pagina, (pagina - 1) * tamano_pagina
             )
-            .values(
-                'mes_pago',
-                'asesor_identificador',
-                'producto',
-                'estado',
-                'pagos__comprobante_url',
-            )
-            .distinct()
-        )
-
-        for row in pagadas_con_comprobante:
-            key = (
-                row['mes_pago'],
-                row['asesor_identificador'],
-                row['producto'],
-                row['estado'],
-            )
-            comprobantes_por_grupo[key] = row['pagos__comprobante_url']
-
-        # 5. Agrupación para la tabla
-        grouped_results = (
-            queryset_con_filtros
-            .values('mes_pago', 'asesor_identificador', 'producto', 'estado')
-            .annotate(
-                cantidad=Count('id'),
-                comision_final_total=Sum('comision_final'),
-                individual_ids=Coalesce(ArrayAgg('id', distinct=True), Value([])),
-            )
-            .order_by('-mes_pago', 'asesor_identificador')
-        )
+        if pagina is None or pagina < 1 or (pagina - 1) * tamano_pagina >= total_grupos:
+            return Response({"detail": "Página inválida."}, status=status.HTTP_404_NOT_FOUND)
 
+        # 5. Tabla agrupada
         resultados = []
-        for item in grouped_results:
-            if not item['cantidad']:
-                continue
-
+        for item in reporte['grupos']:
             unique_id = (
                 f"agrupado-{item['estado']}-"
                 f"{item['mes_pago']}-"
@@ -2263,14 +2273,6 @@ def reporte_asesor_view(request):
                 f"{item['producto']}"
             )
 
-            key = (
-                item['mes_pago'],
-                item['asesor_identificador'],
-                item['producto'],
-                item['estado'],
-            )
-            comprobante_url = comprobantes_por_grupo.get(key)
-
             resultados.append({
                 'id': unique_id,
                 'agrupado': True,
@@ -2280,66 +2282,37 @@ def reporte_asesor_view(request):
                 'comision_final': item['comision_final_total'] or 0,
                 'estado': item['estado'],
                 'mes_pago': item['mes_pago'],
-                'individual_ids': item['individual_ids'],
-                'comprobante_url': comprobante_url,
+                'individual_ids': item['individual_ids'] or [],
+                'comprobante_url': item['comprobante_url'],
             })
 
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        paginated_results = paginator.paginate_queryset(resultados, request)
-        detalle_final = paginator.get_paginated_response(paginated_results).data
-
-        # 6. KPIs y distribución
-        kpis_raw = queryset_con_filtros.aggregate(
-            total_pagado=Sum('comision_final', filter=Q(estado='Pagada'), default=0),
-            total_pendiente=Sum('comision_final', filter=Q(estado__in=['Pendiente', 'Acumulada']), default=0),
-        )
-
-        total_pagado = decimal_or_zero(kpis_raw.get('total_pagado'))
-        total_pendiente = decimal_or_zero(kpis_raw.get('total_pendiente'))
-
-        if total_pagado < 0:
-            total_pagado = Decimal('0')
-        if total_pendiente < 0:
-            total_pendiente = Decimal('0')
+        url = request.build_absolute_uri()
+        siguiente = None
+        if pagina * tamano_pagina < total_grupos:
+            siguiente = replace_query_param(url, 'page', pagina + 1)
+        anterior = None
+        if pagina > 1:
+            anterior = (
+                remove_query_param(url, 'page') if pagina == 2
+                else replace_query_param(url, 'page', pagina - 1)
+            )
+        detalle_final = {
+            'count': total_grupos,
+            'next': siguiente,
+            'previous': anterior,
+            'results': resultados,
+        }
 
+        # 6. KPIs (nunca negativos)
+        total_pagado = max(decimal_or_zero(reporte['kpis']['pagado']), Decimal('0'))
+        total_pendiente = max(decimal_or_zero(reporte['kpis']['pendiente']), Decimal('0'))
         total_comisiones = total_pagado + total_pendiente
 
-        distribucion_estado_qs = (
-            queryset_con_filtros
-            .values('estado')
-            .annotate(count=Count('id'))
-            .order_by('estado')
-        )
-
-        distribucion_estado = list(distribucion_estado_qs)
-
-        # --- Métodos de pago (solo pagos ligados al queryset filtrado) ---
-        pago_ids = queryset_con_filtros.filter(
-            estado='Pagada',
-            pagos__isnull=False
-        ).values_list('pagos_id', flat=True).distinct()
-
-        pagos_relevantes = models.PagoComision.objects.filter(id__in=pago_ids)
-
-        aggregated_methods = defaultdict(lambda: {'total_valor': Decimal('0'), 'total_cantidad': 0})
-
-        for pago in pagos_relevantes:
-            if isinstance(pago.metodos_pago, dict):
-                for metodo, valor in pago.metodos_pago.items():
-                    valor_dec = decimal_or_zero(valor)
-                    aggregated_methods[metodo]['total_valor'] += valor_dec
-                    aggregated_methods[metodo]['total_cantidad'] += 1
-
+        distribucion_estado = reporte['distribucion_estado']
         metodos_pago_stats = [
-            {
-                'metodo': metodo,
-                'total_valor': float(max(data['total_valor'], Decimal('0'))),
-                'total_cantidad': max(data['total_cantidad'], 0),
-            }
-            for metodo, data in aggregated_methods.items()
+            {**item, 'total_valor': float(item['total_valor'])}
+            for item in reporte['metodos_pago']
         ]
-        metodos_pago_stats.sort(key=lambda x: x['total_valor'], reverse=True)
 
         # 7. Respuesta final
         data = {
@@ -2378,6 +2351,10 @@ def ultima_carga_comisiones(request):
         "created_by": carga.created_by.username if carga.created_by else None,
         "mes_detectado": carga.mes_detectado,
         "registros_creados": carga.registros_creados,
+        "filas_procesadas": carga.filas_procesadas,
+        "filas_por_segundo": carga.filas_por_segundo,
+        "bloques_total": len(carga.checkpoint.get("bloques", [])),
+        "bloques_cargados": len(carga.checkpoint.get("hechos", {})),
         "detalle": carga.detalle,
     })
 
@@ -2392,11 +2369,17 @@ def rollback_ultima_carga_comisiones(request):
     if ultima and ultima.estado == "processing":
         return Response({"detail": "Hay una carga en proceso. No se puede revertir ahora."}, status=409)
 
-    carga = models.ComisionCarga.objects.filter(estado="success").order_by("-created_at").first()
+    # Una carga con error puede haber insertado parte de sus bloques: también se revierte
+    carga = models.ComisionCarga.objects.filter(estado__in=["success", "error"]).order_by("-created_at").first()
     if not carga:
-        return Response({"detail": "No hay cargas exitosas para revertir."}, status=404)
+        return Response({"detail": "No hay cargas para revertir."}, status=404)
 
     with transaction.atomic():
+        # Bloquea la carga: un bloque que se esté confirmando termina antes o se descarta
+        carga = models.ComisionCarga.objects.select_for_update().get(pk=carga.pk)
+        if carga.estado not in ("success", "error"):
+            return Response({"detail": "La carga cambió de estado. Intente de nuevo."}, status=409)
+
         # Guardamos pagos relacionados ANTES de borrar comisiones
         pagos_ids = list(
             models.Comision.objects
@@ -2405,8 +2388,10 @@ def rollback_ultima_carga_comisiones(request):
             .distinct()
         )
 
-        total_comisiones = models.Comision.objects.filter(carga=carga).count()
-        models.Comision.objects.filter(carga=carga).delete()
+        # Comision no tiene dependientes: es un solo DELETE por el índice de carga
+        comisiones_carga = models.Comision.objects.filter(carga=carga)
+        resumen_comisiones.restar(comisiones_carga)
+        total_comisiones, _ = comisiones_carga.delete()
 
         pagos_deleted = 0
         if delete_pagos_orphans and pagos_ids:
@@ -2423,6 +2408,9 @@ def rollback_ultima_carga_comisiones(request):
         carga.detalle = (carga.detalle or "") + f"\nRollback por {request.user.username}. Comisiones borradas: {total_comisiones}. Pagos huérfanos borrados: {pagos_deleted}."
         carga.save(update_fields=["estado", "rolled_back_at", "rolled_back_by", "detalle"])
 
+    # Ya no se puede reanudar
+    borrar_archivos_carga(carga)
+
     return Response({
         "detail": "Rollback ejecutado correctamente.",
         "carga_id": carga.id,
@@ -2430,8 +2418,33 @@ def rollback_ultima_carga_comisiones(request):
         "pagos_huerfanos_borrados": pagos_deleted,
     })
     
+@api_view(["POST"])
+@admin_permission_required
+def reanudar_carga_comisiones_view(request):
+    """Reanuda desde su checkpoint la última carga con error (o la indicada en carga_id)."""
+    cargas = models.ComisionCarga.objects.filter(estado="error")
+    carga_id = request.data.get("carga_id")
+    if carga_id:
+        cargas = cargas.filter(id=carga_id)
+    carga = cargas.order_by("-created_at").first()
+    if not carga:
+        return Response({"detail": "No hay cargas con error para reanudar."}, status=404)
+
+    reanudar_carga_comisiones.delay(carga.id, request.user.id)
+    return Response(
+        {
+            "detail": "La carga se está reanudando en segundo plano.",
+            "carga_id": carga.id,
+            "bloques_cargados": len(carga.checkpoint.get("hechos", {})),
+            "bloques_total": len(carga.checkpoint.get("bloques", [])),
+        },
+        status=status.HTTP_202_ACCEPTED,
+    )
+
+
 @api_view(['GET'])
 @asesor_permission_required(allow_supervisor=True, allow_admin=True)
+@cachear_respuesta
 def filtros_reporte_view(request):
     """
     Devuelve los filtros para el dashboard de comisiones.
@@ -2675,103 +2688,82 @@ def carga_comisiones_view(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    # Guardamos la configuración de idioma actual para restaurarla después
-    current_locale = locale.setlocale(locale.LC_TIME)
+    # === SECCIÓN 3: VALIDACIÓN DE CONTENIDO DEL EXCEL ===
     try:
-        # Intentamos configurar el idioma a español (varios intentos según SO)
+        # Solo lectura y solo el primer bloque: el archivo completo lo
+        # recorre la tarea, aquí no se carga en memoria
+        libro = abrir_libro(archivo)
         try:
-            locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
-        except locale.Error:
-            try:
-                locale.setlocale(locale.LC_TIME, 'es_ES')
-            except locale.Error:
-                try:
-                    # Windows típico
-                    locale.setlocale(locale.LC_TIME, 'Spanish_Spain.1252')
-                except locale.Error:
-                    try:
-                        locale.setlocale(locale.LC_TIME, 'Spanish')
-                    except locale.Error:
-                        # Si nada funciona, seguimos con el locale actual
-                        pass
-
-        # === SECCIÓN 3: VALIDACIÓN DE CONTENIDO DEL EXCEL ===
-        try:
-            xls = pd.ExcelFile(archivo)
-
             # REGLA 1: Debe tener exactamente una hoja.
-            if len(xls.sheet_names) != 1:
+            if len(libro.sheetnames) != 1:
                 return Response(
-                    {'errores': [f'Archivo rechazado: Debe contener exactamente una hoja, pero se encontraron {len(xls.sheet_names)}.']},
+                    {'errores': [f'Archivo rechazado: Debe contener exactamente una hoja, pero se encontraron {len(libro.sheetnames)}.']},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            df = pd.read_excel(xls, sheet_name=0, dtype=str)
+            df = next(bloques_de_hoja(libro.worksheets[0]), None)
+        finally:
+            libro.close()
 
-            # REGLA 2: La columna 'MES PAGO' es obligatoria.
-            if 'MES PAGO' not in df.columns:
-                return Response(
-                    {'errores': ['Archivo rechazado: Falta la columna obligatoria "MES PAGO".']},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # REGLA 3: Todos los registros deben pertenecer a un único mes de PAGO.
-            # En el Excel viene algo como: "Diciembre 2025"
-            col_mes_pago = (
-                df['MES PAGO']
-                .astype(str)
-                .str.strip()
-                .str.lower()
-                .str.replace(r'\s+', ' ', regex=True)  # normaliza espacios
+        # REGLA 2: La columna 'MES PAGO' es obligatoria.
+        if df is None or 'MES PAGO' not in df.columns:
+            return Response(
+                {'errores': ['Archivo rechazado: Falta la columna obligatoria "MES PAGO".']},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-            # Ejemplo esperado tras normalización: "diciembre 2025"
-            meses_pago = pd.to_datetime(
-                col_mes_pago,
-                format='%B %Y',
-                errors='coerce'
-            ).dt.to_period('M')
-
-            meses_validos = meses_pago.dropna()
-            meses_unicos = meses_validos.nunique()
-
-            if meses_unicos > 1:
-                meses_distintos = ", ".join(
-                    sorted({str(m) for m in meses_validos.unique()})
-                )
-                return Response(
-                    {'errores': [f'Archivo rechazado: Solo se permite un mes de PAGO por archivo, pero se encontraron estos meses: {meses_distintos}.']},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        # REGLA 3: Todos los registros deben pertenecer a un único mes de PAGO.
+        # En el Excel viene algo como: "Diciembre 2025". Aquí se revisa el
+        # primer bloque; la tarea rechaza el archivo si otro bloque trae otro mes.
+        # Los nombres de mes se interpretan con una tabla propia, sin tocar el locale
+        meses_validos = meses_desde_texto(df['MES PAGO']).dropna()
+        meses_unicos = meses_validos.nunique()
 
-            if meses_unicos == 0:
-                return Response(
-                    {'errores': ['Archivo rechazado: No se encontraron registros con un formato de mes válido en "MES PAGO" (Ej: "Diciembre 2025").']},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        if meses_unicos > 1:
+            meses_distintos = ", ".join(
+                sorted({f'{m:%Y-%m}' for m in meses_validos.unique()})
+            )
+            return Response(
+                {'errores': [f'Archivo rechazado: Solo se permite un mes de PAGO por archivo, pero se encontraron estos meses: {meses_distintos}.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        except Exception:
+        if meses_unicos == 0:
             return Response(
-                {'errores': ['No se pudo leer el archivo. Verifique que sea un formato Excel (.xlsx) válido.']},
+                {'errores': ['Archivo rechazado: No se encontraron registros con un formato de mes válido en "MES PAGO" (Ej: "Diciembre 2025").']},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-    finally:
-        # Restauramos el locale original para no afectar otras partes de la app
-        try:
-            locale.setlocale(locale.LC_TIME, current_locale)
-        except Exception:
-            # En caso extremo de error, lo ignoramos para no romper la petición
-            pass
+    except Exception:
+        return Response(
+            {'errores': ['No se pudo leer el archivo. Verifique que sea un formato Excel (.xlsx) válido.']},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
     # === SECCIÓN 4: GUARDADO Y EJECUCIÓN DE TAREA ASÍNCRONA ===
+    huella = hashlib.sha256()
     with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_f:
         archivo.seek(0)
         for chunk in archivo.chunks():
             temp_f.write(chunk)
+            huella.update(chunk)
         file_path = temp_f.name
+    file_hash = huella.hexdigest()
 
-    procesar_archivo_comisiones.delay(file_path, request.user.id)
+    # REGLA 4: El mismo archivo no se carga dos veces (salvo que la carga se haya revertido)
+    carga_previa = (
+        models.ComisionCarga.objects
+        .filter(hash_archivo=file_hash, estado__in=['processing', 'success'])
+        .first()
+    )
+    if carga_previa:
+        os.remove(file_path)
+        return Response(
+            {'errores': [f'Archivo rechazado: Este archivo ya fue cargado (carga #{carga_previa.id} del {timezone.localtime(carga_previa.created_at):%Y-%m-%d %H:%M}).']},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    procesar_archivo_comisiones.delay(file_path, request.user.id, archivo.name, file_hash)
 
     return Response(
         {'mensaje': 'Archivo validado y aceptado. El procesamiento ha comenzado en segundo plano.'},
@@ -2937,6 +2929,41 @@ def variables_prices(request, id=None):
         else:
             return Response({'error': 'El campo id es requerido en la URL.'}, status=400)
 
+@api_view(['POST'])
+@token_required
+def recalcular_precios(request):
+    """
+    Recalcula solo las listas que dependen de las variables indicadas sobre la
+    última carga (o 'carga') y guarda el resultado como una carga derivada.
+    'variables' admite ids de Variables_prices o {'price': id, 'name': nombre}
+    (esto último sirve para variables ya eliminadas o renombradas).
+    """
+    variables = request.data.get('variables', [])
+    if not variables:
+        return Response({'error': 'El campo "variables" es requerido.'}, status=400)
+
+    cambios = set()
+    ids = [v for v in variables if not isinstance(v, dict)]
+    for variable in models.Variables_prices.objects.filter(id__in=ids):
+        cambios.add((variable.price_id, variable.name))
+    for v in variables:
+        if isinstance(v, dict) and v.get('price') and v.get('name'):
+            cambios.add((int(v['price']), v['name']))
+    if not cambios:
+        return Response({'error': 'Ninguna de las variables indicadas existe.'}, status=400)
+
+    carga = None
+    if request.data.get('carga'):
+        carga = models.Carga.objects.filter(id=request.data['carga']).first()
+        if carga is None:
+            return Response({'error': 'La carga seleccionada no existe.'}, status=404)
+
+    try:
+        _, resumen = recalcular_por_variables(cambios, carga)
+    except (RecalculoError, FormulaError) as e:
+        return Response({'error': str(e)}, status=400)
+    return Response({'data': resumen})
+
 @api_view(['GET', 'POST', 'PUT' ,'DELETE'])
 @token_required # <-- APLICA EL NUEVO DECORADOR
 def prices(request, id=None):
@@ -2996,11 +3023,6 @@ def prices(request, id=None):
 @token_required # 2. Aplica el decorador para manejar la autenticación
 def get_filtros_precios(request):
     try:
-        try:
-            locale.setlocale(locale.LC_TIME, 'es_CO.UTF-8')
-        except locale.Error:
-            locale.setlocale(locale.LC_TIME, 'es')
-
         # 3. El decorador ya validó el token y nos da el usuario en request.user
         usuario = request.user
         
@@ -3029,13 +3051,12 @@ def get_filtros_precios(request):
         
         else:
             lista_precios_final = [{'id': k, 'nombre': v} for k, v in todas_las_listas_map.items()]
-            productos = models.Lista_precio.objects.values_list('producto', flat=True).distinct()
-            marcas = sorted(list(set([p.split(' ')[0].upper() for p in productos if p])))
-            cargas = models.Carga.objects.all().order_by('-fecha_carga')[:50]
-            for carga in cargas:
+            # Marcas y cargas salen del cache de dos niveles (ver cache_precios.py)
+            marcas = marcas_disponibles()
+            for carga_id, fecha_carga in cargas_recientes():
                 fechas_validas_formateadas.append({
-                    "valor": carga.id,
-                    "texto": carga.fecha_carga.strftime("%d de %B de %Y - %H:%M")
+                    "valor": carga_id,
+                    "texto": f"{fecha_carga:%d} de {MESES_ES[fecha_carga.month]} de {fecha_carga:%Y - %H:%M}"
                 })
 
         return Response({
@@ -3048,51 +3069,38 @@ def get_filtros_precios(request):
         return Response({'detail': f'Error interno en get_filtros_precios: {str(e)}'}, status=500)
 
 
-def motor_de_evaluacion_recursivo(formula_string, price_list_id, context, mapa_variables, cache_variables):
-    cache_key = (formula_string, price_list_id)
-    if cache_key in cache_variables:
-        return cache_variables[cache_key]
-
-    variables_en_formula = re.findall(r'[a-zA-Z_][a-zA-Z0-9_]*', formula_string)
-    contexto_local = context.copy()
-
-    for var_name in set(variables_en_formula):
-        if var_name in contexto_local:
-            continue
-
-        variables_especificas = mapa_variables.get(price_list_id, {})
-        variable_obj = variables_especificas.get(var_name)
+@api_view(['GET'])
+@token_required
+def estadisticas_cache_precios(request):
+    """Contadores de aciertos/fallos del cache de filtros de precios en este proceso."""
+    return Response({'pid': os.getpid(), **cache_filtros.estadisticas()})
 
-        if not variable_obj:
-            variables_globales = mapa_variables.get(1, {})
-            variable_obj = variables_globales.get(var_name)
 
-        if variable_obj:
-            if variable_obj.formula is None:
-                valor_variable = Decimal('0')
-            else:
-                valor_variable = motor_de_evaluacion_recursivo(variable_obj.formula, price_list_id, context, mapa_variables, cache_variables)
-            contexto_local[var_name] = valor_variable
-        else:
-            # LOG de variable faltante
-            print(f"⚠️ Variable '{var_name}' no encontrada en contexto ni en mapa_variables para price_list_id={price_list_id}")
-            contexto_local[var_name] = Decimal('0')
+def motor_de_evaluacion_recursivo(formula_string, price_list_id, context, mapa_variables=None, cache_variables=None):
+    """
+    Evalúa una fórmula con el motor compilado (ver formulas.py).
+    Las variables se resuelven desde el grafo compilado de Variables_prices;
+    `mapa_variables` se mantiene solo por compatibilidad de firma.
+    Variables faltantes valen 0 y cualquier error devuelve 0.
+    """
+    cache_key = (formula_string, price_list_id)
+    if cache_variables is not None and cache_key in cache_variables:
+        return cache_variables[cache_key]
 
     try:
-        resultado = Decimal(eval(formula_string, {"__builtins__": None}, contexto_local))
-        cache_variables[cache_key] = resultado
-        return resultado
+        compilada = obtener_motor().compilar_texto(formula_string, price_list_id)
+        faltantes = compilada.entradas.difference(context)
+        if faltantes:
+            print(f"⚠️ Variables {sorted(faltantes)} no encontradas en contexto ni en variables para price_list_id={price_list_id}")
+        resultado = Decimal(compilada.evaluar(context, por_defecto=Decimal('0')))
     except Exception as e:
-        print(f"❌ ERROR evaluando la fórmula '{formula_string}' con contexto {contexto_local}: {type(e)}")
+        print(f"❌ ERROR evaluando la fórmula '{formula_string}' con contexto {context}: {type(e)}")
         return Decimal('0')
 
+    if cache_variables is not None:
+        cache_variables[cache_key] = resultado
+    return resultado
 
-# Función para normalizar cadenas
-def normalize_string(s):
-    if not isinstance(s, str):
-        return ""
-    s = re.sub(r'[\s\xa0-]+', ' ', s).strip()
-    return s.lower()
 
 @api_view(['GET'])
 def get_reportes_por_fecha(request):
@@ -3167,41 +3175,6 @@ def calculate_dynamic_total(equipo_sin_iva, kits):
     
     return equipo_sin_iva + iva_equipo + valor_sim + iva_sim + kit_total
 
-def apply_iva_kit_rules(equipo_sin_iva, nombre_lista, kits_list, base_iva_excluido, TASA_IVA):
-    """
-    Función centralizada para aplicar las reglas de negocio del IVA y los Kits.
-    """
-    kits_modificados = [dict(k) for k in kits_list] # Crear una copia para no alterar los datos originales
-    iva_equipo = Decimal('0')
-
-    if equipo_sin_iva > base_iva_excluido:
-        # REGLA 1: Si el equipo supera el umbral del IVA.
-        iva_equipo = equipo_sin_iva * TASA_IVA
-        kit_iva_nombre = "kit " + nombre_lista.replace("Precio ", "").lower()
-        for kit in kits_modificados:
-            if kit.get('nombre', '').lower() == kit_iva_nombre:
-                kit['valor'] = 0.0 # Anula el kit correspondiente
-                break
-    else:
-        # REGLA 2: Si el equipo NO supera el umbral del IVA.
-        if nombre_lista.lower() == 'precio premium':
-            # CORRECCIÓN: Para "Precio Premium" bajo el umbral, no se hace ninguna modificación.
-            pass
-        else:
-            # REGLA 2.2 (GENERAL): Para otras listas, el IVA se representa en el "Kit Premium".
-            iva_as_kit_premium = equipo_sin_iva * TASA_IVA
-            kit_found = False
-            for kit in kits_modificados:
-                if kit.get('nombre', '').lower() == 'kit premium':
-                    kit['valor'] = float(iva_as_kit_premium)
-                    kit_found = True
-                    break
-            if not kit_found:
-                kits_modificados.append({'nombre': 'Kit Premium', 'valor': float(iva_as_kit_premium)})
-    
-    return iva_equipo, kits_modificados
-
-
 @api_view(['POST'])
 # @token_required # Descomenta si usas este decorador
 def buscar_precios(request):
@@ -3219,24 +3192,19 @@ def buscar_precios(request):
         if not listas_precios_nombres:
             return Response({'data': [], 'fecha_actual': 'N/A'})
 
-        # --- SECCIÓN DE CONSULTAS A LA BASE DE DATOS (SIN CAMBIOS) ---
         productos_qs = models.Traducciones.objects.filter(active=True)
         if marcas_seleccionadas:
-            productos_qs = productos_qs.filter(stok__iregex=r'(' + '|'.join(marcas_seleccionadas) + r')\s')
+            productos_qs = productos_qs.filter(marca__in={str(m).strip().upper() for m in marcas_seleccionadas})
         if referencia:
             productos_qs = productos_qs.filter(Q(equipo__icontains=referencia) | Q(stok__icontains=referencia))
 
-        mapa_traducciones = {normalize_string(p.stok): p.equipo for p in productos_qs}
-        
+        stoks_normalizados = {normalize_string(stok) for stok in productos_qs.values_list('stok', flat=True)}
+        if not stoks_normalizados:
+            return Response({'data': [], 'fecha_actual': 'N/A'})
+
+        # --- Todo lo demás ya viene resuelto en PrecioSnapshot (ver snapshot_precios.py) ---
         if carga_id_actual == 'todas':
-            latest_price_ids_subquery = (
-                models.Lista_precio.objects
-                .filter(nombre__in=listas_precios_nombres)
-                .values('producto', 'nombre')
-                .annotate(latest_id=Max('id'))
-                .values('latest_id')
-            )
-            precios_actuales_qs = models.Lista_precio.objects.filter(id__in=latest_price_ids_subquery).select_related('carga').order_by('-carga__fecha_carga', '-id')
+            snapshots = ultimos_snapshots(listas_precios_nombres, stoks_normalizados)
             fecha_actual_str = 'Todas (últimos registros)'
         else:
             if not carga_id_actual:
@@ -3249,144 +3217,49 @@ def buscar_precios(request):
             
             if not carga_actual:
                 return Response({'data': [], 'fecha_actual': 'No hay datos cargados'})
-            
-            precios_actuales_qs = models.Lista_precio.objects.filter(
-                carga=carga_actual,
-                nombre__in=listas_precios_nombres
-            ).select_related('carga')
-            fecha_actual_str = carga_actual.fecha_carga.strftime('%d de %B de %Y')
-            
-        productos_lp_raw = precios_actuales_qs.values_list('producto', flat=True).distinct()
-        producto_lp_a_stok = {p_name: normalize_string(p_name) for p_name in productos_lp_raw if normalize_string(p_name) in mapa_traducciones}
-        stoks_encontrados_lp = list(producto_lp_a_stok.keys())
-        
-        if not stoks_encontrados_lp:
-            return Response({'data': [], 'fecha_actual': fecha_actual_str})
-            
-        precios_actuales_qs = precios_actuales_qs.filter(producto__in=stoks_encontrados_lp)
-
-        subquery_precio_anterior = models.Lista_precio.objects.filter(
-            producto=OuterRef('producto'),
-            nombre=OuterRef('nombre'),
-            carga__fecha_carga__lt=OuterRef('carga__fecha_carga')
-        ).order_by('-carga__fecha_carga').values('id')[:1]
-
-        precios_actuales_con_anterior = precios_actuales_qs.annotate(
-            id_precio_anterior=Subquery(subquery_precio_anterior)
-        )
-
-        ids_anteriores_a_buscar = [p.id_precio_anterior for p in precios_actuales_con_anterior if p.id_precio_anterior is not None]
-        precios_anteriores_encontrados = models.Lista_precio.objects.filter(id__in=ids_anteriores_a_buscar)
-        mapa_precios_anteriores = {p.id: p for p in precios_anteriores_encontrados}
 
-        all_cargas_ids = models.Lista_precio.objects.filter(producto__in=stoks_encontrados_lp).values_list('carga_id', flat=True).distinct()
-        
-        all_kits_data = models.Lista_precio.objects.filter(carga_id__in=all_cargas_ids, producto__in=stoks_encontrados_lp, nombre__icontains='Kit').exclude(nombre__icontains='Descuento Kit')
-        all_costos_data = models.Lista_precio.objects.filter(carga_id__in=all_cargas_ids, producto__in=stoks_encontrados_lp, nombre='Costo')
-        all_descuentos_data = models.Lista_precio.objects.filter(carga_id__in=all_cargas_ids, producto__in=stoks_encontrados_lp, nombre='descuento')
-        
-        mapa_kits = defaultdict(list)
-        mapa_costos = {}
-        mapa_descuentos = {}
+            snapshots = models.PrecioSnapshot.objects.filter(
+                carga=carga_actual,
+                nombre__in=listas_precios_nombres,
+                producto_normalizado__in=stoks_normalizados,
+            )
+            # Cargas anteriores al snapshot que aún no se han reconstruido
+            # (reconstruir_snapshot_precios): se calculan sin guardar
+            if not carga_actual.snapshots.exists():
+                snapshots = calcular_snapshot_carga(
+                    carga_actual, nombres=listas_precios_nombres, productos_normalizados=stoks_normalizados,
+                )
+            fecha_carga = carga_actual.fecha_carga
+            fecha_actual_str = f"{fecha_carga:%d} de {MESES_ES[fecha_carga.month]} de {fecha_carga:%Y}"
 
-        for kit in all_kits_data:
-            key = (normalize_string(kit.producto), kit.carga_id)
-            mapa_kits[key].append({'nombre': kit.nombre, 'valor': float(kit.valor)})
-        
-        for costo in all_costos_data:
-            key = (normalize_string(costo.producto), costo.carga_id)
-            mapa_costos[key] = costo.valor
+        if filtro_variacion:
+            snapshots = [snap for snap in snapshots if snap.indicador == filtro_variacion]
+        if filtro_promo:
+            snapshots = [snap for snap in snapshots if snap.es_promo]
 
-        for descuento in all_descuentos_data:
-            key = (normalize_string(descuento.producto), descuento.carga_id)
-            mapa_descuentos[key] = descuento.valor
-            
-        # --- PROCESAMIENTO DE DATOS ---
-        new_data = []
-        base_iva_excluido = Decimal('1152228')
+        sim = Decimal('2000')
         TASA_IVA = Decimal('0.19')
-        
-        for precio_actual in precios_actuales_con_anterior:
-            prod_raw = precio_actual.producto
-            prod_lower = normalize_string(prod_raw)
-            nombre_lista = precio_actual.nombre
-            carga_id = precio_actual.carga_id
-            
-            equipo_sin_iva_actual = precio_actual.valor
-            kits_actuales_raw = mapa_kits.get((prod_lower, carga_id), [])
-            
-            # Aplicar reglas al precio actual (necesario para la visualización y el cálculo de variación)
-            iva_equipo_actual, kits_data_to_send = apply_iva_kit_rules(equipo_sin_iva_actual, nombre_lista, kits_actuales_raw, base_iva_excluido, TASA_IVA)
-            
-            valor_anterior_bruto = None
-            kits_anteriores_to_send = []
-            carga_id_anterior = None
-            iva_equipo_anterior = Decimal('0') # Inicializar IVA anterior
-            
-            precio_anterior_obj = mapa_precios_anteriores.get(precio_actual.id_precio_anterior)
-
-            if precio_anterior_obj:
-                carga_id_anterior = precio_anterior_obj.carga_id
-                valor_anterior_bruto = precio_anterior_obj.valor
-                kits_anteriores_raw = mapa_kits.get((prod_lower, carga_id_anterior), [])
-                kits_anteriores_to_send = kits_anteriores_raw
-                # Se calcula el IVA del equipo anterior para una comparación justa
-                iva_equipo_anterior, _ = apply_iva_kit_rules(valor_anterior_bruto, nombre_lista, kits_anteriores_raw, base_iva_excluido, TASA_IVA)
-            
-            # --- ZONA DE MODIFICACIÓN ---
-            # La variación se calcula comparando el precio del equipo + su IVA respectivo.
-            variacion = {'indicador': 'neutral', 'diferencial': 0.0, 'porcentaje': 0.0}
-            
-            if valor_anterior_bruto is not None:
-                # 1. Se define el total a comparar: Precio Base del Equipo + IVA del Equipo
-                total_comparable_actual = equipo_sin_iva_actual + iva_equipo_actual
-                total_comparable_anterior = valor_anterior_bruto + iva_equipo_anterior
-                
-                if total_comparable_anterior > 0:
-                    # 2. CÁLCULO DEL DIFERENCIAL
-                    diferencial = total_comparable_actual - total_comparable_anterior
-                    
-                    indicador = 'up' if diferencial > 0 else 'down' if diferencial < 0 else 'neutral'
-                    
-                    # 3. CÁLCULO DEL PORCENTAJE
-                    porcentaje = (diferencial / total_comparable_anterior) * 100
-                    
-                    variacion = {
-                        'indicador': indicador, 
-                        'diferencial': float(round(diferencial, 0)), # Redondear al entero más cercano
-                        'porcentaje': float(round(porcentaje, 0)) # Redondear al entero más cercano (ej: 12.79 -> 13)
-                    }
-            
-            # --- FIN DE LA ZONA DE MODIFICACIÓN ---
-
-            if filtro_variacion and variacion['indicador'] != filtro_variacion:
-                continue
-
-            es_promo = Decimal(mapa_descuentos.get((prod_lower, carga_id), Decimal('0'))) > 0
-            if filtro_promo and not es_promo:
-                continue
-            
-            total_display = equipo_sin_iva_actual + iva_equipo_actual + Decimal('2000') + (Decimal('2000') * TASA_IVA) + sum(Decimal(str(k.get('valor', '0'))) for k in kits_data_to_send)
-
+        new_data = []
+        for snap in snapshots:
             new_data.append({
-                'equipo': prod_raw,
-                'nombre_lista': nombre_lista,
-                'precio simcard': float(Decimal('2000')),
-                'IVA simcard': float(Decimal('2000') * TASA_IVA),
-                'equipo sin IVA': float(equipo_sin_iva_actual),
-                'IVA equipo': float(iva_equipo_actual),
-                'kits': kits_data_to_send,
-                'indicador': variacion['indicador'],
-                'diferencial': variacion['diferencial'], # <-- Este valor ahora será el correcto
-                'porcentaje': variacion['porcentaje'], # <-- Y este también
-                'costo': float(mapa_costos.get((prod_lower, carga_id), Decimal('0'))),
-                'descuento': float(mapa_descuentos.get((prod_lower, carga_id), Decimal('0'))),
-                'total_kit_calculado': float(total_display),
-                'Promo': es_promo,
-                'valor_anterior': float(valor_anterior_bruto) if valor_anterior_bruto is not None else 0,
-                'costo_anterior': float(mapa_costos.get((prod_lower, carga_id_anterior), Decimal('0'))) if carga_id_anterior else 0.0,
-                'descuento_anterior': float(mapa_descuentos.get((prod_lower, carga_id_anterior), Decimal('0'))) if carga_id_anterior else 0.0,
-                'kits_anteriores': [dict(k) for k in kits_anteriores_to_send],
+                'equipo': snap.producto,
+                'nombre_lista': snap.nombre,
+                'precio simcard': float(sim),
+                'IVA simcard': float(sim * TASA_IVA),
+                'equipo sin IVA': float(snap.valor),
+                'IVA equipo': float(snap.iva_equipo),
+                'kits': snap.kits,
+                'indicador': snap.indicador,
+                'diferencial': float(snap.diferencial),
+                'porcentaje': float(snap.porcentaje),
+                'costo': float(snap.costo),
+                'descuento': float(snap.descuento),
+                'total_kit_calculado': float(snap.total),
+                'Promo': snap.es_promo,
+                'valor_anterior': float(snap.valor_anterior) if snap.valor_anterior is not None else 0,
+                'costo_anterior': float(snap.costo_anterior),
+                'descuento_anterior': float(snap.descuento_anterior),
+                'kits_anteriores': snap.kits_anteriores,
             })
 
         return Response({'data': new_data, 'fecha_actual': fecha_actual_str})
@@ -3395,10 +3268,6 @@ def buscar_precios(request):
         print(f"ERROR en /buscar_precios: {str(e)}")
         return Response({'detail': f'Error interno: {str(e)}'}, status=500)
 
-
-
-
-    
 @api_view(['GET', 'POST', 'DELETE'])
 def black_list(request, id=None):
     if request.method == 'GET':
@@ -5322,74 +5191,15 @@ def guardar_precios(request):
     cabecera = request.data.get('cabecera', [])
     items = request.data.get('items', [])
     iva_excepciones = request.data.get('iva_excepciones', [])  # NUEVO
+    # Entradas de las fórmulas que devolvió translate_prepago (para recalcular luego)
+    entradas = request.data.get('entradas', [])
 
     if not items:
         return Response({'error': 'No hay items para guardar.'}, status=400)
 
-    nueva_carga = models.Carga.objects.create()
-    
-    lista_de_precios_para_crear = []
-    
-    # Creamos un diccionario para mapear los nombres de la cabecera a sus índices
-    header_map = {item['text']: i for i, item in enumerate(cabecera)}
-
-    # Identificamos el índice de la columna del producto
-    product_name_index = header_map.get('Equipo')
-
-    for precio_row in items:
-        # Extraemos el nombre del producto de su columna correcta
-        if product_name_index is not None and product_name_index < len(precio_row):
-            producto = precio_row[product_name_index]
-        else:
-            # Si no se encuentra el nombre del producto, omitimos esta fila
-            continue
+    _, estadisticas = guardar_carga_precios(cabecera, items, iva_excepciones, entradas)
 
-        # Iteramos sobre todos los campos de la cabecera, excepto el del producto
-        for nombre_campo, index in header_map.items():
-            if nombre_campo == 'Equipo':
-                continue  # Omitimos la columna del producto
-
-            if index < len(precio_row):
-                valor_raw = precio_row[index]
-                
-                # Validamos que el valor sea un número antes de intentar guardarlo
-                if valor_raw is not None:
-                    try:
-                        # Limpiamos el valor de comas (,) y lo convertimos a un decimal
-                        valor = decimal.Decimal(str(valor_raw).replace(',', ''))
-                    except (decimal.InvalidOperation, ValueError):
-                        # Si la conversión falla, mostramos un mensaje en la consola y saltamos este registro
-                        print(
-                            f"Omitiendo valor inválido '{valor_raw}' "
-                            f"para el producto '{producto}' en el campo '{nombre_campo}'"
-                        )
-                        continue
-                        
-                    lista_de_precios_para_crear.append(
-                        models.Lista_precio(
-                            producto=producto,
-                            nombre=nombre_campo,
-                            valor=valor,
-                            carga=nueva_carga
-                        )
-                    )
-    
-    if lista_de_precios_para_crear:
-        models.Lista_precio.objects.bulk_create(lista_de_precios_para_crear)
-
-    # ==== NUEVO: guardar excepciones de IVA para prepago ====
-    if isinstance(iva_excepciones, list):
-        # Limpiamos vacíos / None
-        iva_excepciones_limpias = [p for p in iva_excepciones if p]
-
-        # Para prepago, pisamos las excepciones anteriores
-        models.IvaExcepcion.objects.filter(tipo='prepago').delete()
-        models.IvaExcepcion.objects.bulk_create([
-            models.IvaExcepcion(producto=p, tipo='prepago')
-            for p in iva_excepciones_limpias
-        ])
-
-    return Response({'data': 'Datos guardados exitosamente'})
+    return Response({'data': 'Datos guardados exitosamente', 'estadisticas': estadisticas})
 
 
 @api_view(['POST'])
@@ -5439,33 +5249,15 @@ def prueba_formula(request):
     formula = request.data['funtion']
     diccionario = request.data['dic']
     nombre = request.data['price']
-    if isinstance(formula, list):
-        formula = ' '.join(formula)
-    else:
-        formula = ' '.join(formula.split())
     variables = {k: float(v) for k, v in diccionario.items()}
-    variables2 = models.Variables_prices.objects.filter(price=nombre['id'])
-    variables2 = {variable.name : ' '.join(variable.formula.split()) for variable in variables2}
-    variables3 = models.Variables_prices.objects.filter(price=1)
-    variables3 = {variable.name : ' '.join(variable.formula.split()) for variable in variables3}
-    variables2 = variables2 | variables3
-    consulta = models.Formula.objects.filter(nombre='Precio publico').first()
-    formula_publico = consulta.formula
-    formula_lista = ast.literal_eval(formula_publico)
-    formula2 = ' '.join(formula_lista)
-    variables2 = variables2 | {'precioPublico': formula2, 'PrecioPublico': formula2}
-    for i in range(10):
-        for key, value in variables2.items():
-            formula = formula.replace(key,value)    
-    # formula = formula.replace('=','==')
-    # formula = formula.replace('> ==','>=')
-    # formula = formula.replace('< ==','<=')
-    resultado = eval(formula, variables)
-    print(formula)
-    print(diccionario)
-    print(resultado)
-    print(nombre)
-    return Response({'data':resultado})
+    try:
+        compilada = obtener_motor().compilar_texto(formula, nombre['id'])
+        resultado = compilada.evaluar(variables)
+    except FormulaError as e:
+        return Response({'error': str(e)}, status=400)
+    except NameError as e:
+        return Response({'error': f'Variable no definida: {e}'}, status=400)
+    return Response({'data': resultado})
 
 @api_view(['POST'])
 def contactanos(request):
@@ -6187,19 +5979,19 @@ def translate_prepago(requests):
         df_equipos.columns = ['equipo', 'valor', 'descuento', 'costo']
         
         precios = models.Formula.objects.all().order_by('id')
-        
-        all_variables_prices = models.Variables_prices.objects.all().values()
-        variables_by_price = {}
-        for var in all_variables_prices:
-            price_id = var['price_id']
-            if price_id not in variables_by_price:
-                variables_by_price[price_id] = {}
-            variables_by_price[price_id][var['name']] = ' '.join(var['formula'].split())
+
+        # Cada fórmula se compila una sola vez (no por fila)
+        motor = obtener_motor()
+        try:
+            formulas_compiladas = {precio.id: motor.compilar(precio.nombre) for precio in precios}
+        except FormulaError as e:
+            return Response({'error': str(e)}, status=400)
 
         equipos_origen = df_equipos['equipo']
         equipos_translate = df_translates['equipo']
         equipos_no_encontrados = equipos_origen[~equipos_origen.isin(equipos_translate)]
 
+        entradas = []
         if len(equipos_no_encontrados) > 0:
             validate = False
             data_response = equipos_no_encontrados.to_list()
@@ -6208,126 +6000,23 @@ def translate_prepago(requests):
             validate = True
             nuevo_df = df_equipos.merge(df_translates, on='equipo', how='left')
             nuevo_df = nuevo_df.drop_duplicates()
-            
-            data_response = []
-            cabecera = [{'text': 'Equipo', 'value': '0'}]
-            
-            contador = 1
-            for precio in precios:
-                cabecera.append({'text': precio.nombre, 'value': str(contador)})
-                contador += 1
-                if 'Precio Fintech' in precio.nombre:
-                    cabecera.append({'text': 'Kit Fintech', 'value': str(contador)})
-                    contador += 1
-                elif 'Precio Addi' in precio.nombre:
-                    cabecera.append({'text': 'Kit Addi', 'value': str(contador)})
-                    contador += 1
-                elif 'Precio premium' in precio.nombre:
-                    cabecera.append({'text': 'Kit Premium', 'value': str(contador)})
-                    contador += 1
-                elif 'Precio sub' in precio.nombre:
-                    cabecera.append({'text': 'Kit Sub', 'value': str(contador)})
-                    contador += 1
-                elif 'Precio Adelantos Valle' in precio.nombre:
-                    cabecera.append({'text': 'Kit Valle', 'value': str(contador)})
-                    contador += 1
-            
-            cabecera.append({'text': 'descuento', 'value': str(contador)})
-            
-            lista_produtos = set()
-            formula_publico_obj = models.Formula.objects.filter(nombre='Precio publico').first()
-            formula2 = ' '.join(ast.literal_eval(formula_publico_obj.formula)) if formula_publico_obj else ''
-
-            for _, row in nuevo_df.iterrows():
-                # row['stok'] es el nombre final del producto
-                if row['stok'] in lista_produtos:
-                    continue
-                lista_produtos.add(row['stok'])
-
-                # ==== NUEVO: saber si este producto es excepción de IVA ====
-                forzar_iva = row['stok'] in iva_excepciones
-                
-                temp_data = [row['stok']]
-                for precio in precios:
-                    variables2 = variables_by_price.get(precio.price_id_id, {})
-                    if precio.price_id_id != 1:
-                        variables1 = variables_by_price.get(1, {})
-                        variables2 = {**variables1, **variables2}
-                    
-                    dict_formula = ast.literal_eval(precio.formula)
-                    formula = ' '.join(dict_formula)
-                    
-                    if precio.id < 9:
-                        formula = formula.replace('=','==')
-                        formula = formula.replace('> ==','>=')
-                        formula = formula.replace('< ==','<=')
-                        formula = formula.replace('costo','Costo')
-                        formula = formula.replace('valor','Valor')
-                        formula = formula.replace('descuento','Descuento')
-                    
-                    formula = formula.replace('precioPublico', formula2)
-                    variables2 = {
-                        **variables2,
-                        'precioPublico': formula2,
-                        'PrecioPublico': formula2,
-                        'Sub': '',
-                        'Premium': '',
-                        'Fintech': '',
-                        'Addi': '',
-                        'Valle': ''
-                    }
 
-                    for i in range(10):
-                        for key, value in variables2.items():
-                            formula = formula.replace(key, value)
-                    
-                    variables = {
-                        'Valor': row['valor'],
-                        'Costo': row['costo'],
-                        'Descuento': row['descuento'],
-                        'iva': iva
-                    }
-                    
-                    kit = 0
-                    kit_comprobante = False
-                    
-                    try:
-                        resultado = eval(formula, variables)
-                    except NameError:
-                        resultado = 0 
-
-                    if (
-                        'Precio Fintech' in precio.nombre
-                        or 'Precio Addi' in precio.nombre
-                        or 'Precio Adelantos Valle' in precio.nombre
-                    ):
-                        kit_comprobante = True
-                        # aquí mantengo tu lógica original, porque el umbral
-                        # mezcla resultado + 2380 y valor original
-                        if resultado + 2380 >= iva and row['valor'] < iva:
-                            kit = resultado - iva + 2380
-                            resultado = iva - 2380
-
-                    elif 'Precio premium' in precio.nombre:
-                        kit_comprobante = True
-                        # ==== AQUÍ aplicamos el "precio >= iva" O excepción ====
-                        if row['valor'] >= iva or forzar_iva:
-                           kit = resultado * 0.19
-
-                    elif 'Precio sub' in precio.nombre:
-                        kit_comprobante = True
-                        # ==== AQUÍ tambén ====
-                        if row['valor'] >= iva or forzar_iva:
-                            kit = resultado * 0.19
-                    
-                    temp_data.append(resultado)
-                    if kit_comprobante:
-                        temp_data.append(kit)
-                
-                temp_data.append(row['descuento'])
-                data_response.append(temp_data)
+            # Todas las listas se calculan por columnas (ver motor_precios.py)
+            try:
+                cabecera, data_response = calcular_matriz_prepago(
+                    nuevo_df, precios, formulas_compiladas, iva_excepciones, iva
+                )
+            except FormulaError as e:
+                return Response({'error': str(e)}, status=400)
+            entradas = (
+                nuevo_df.drop_duplicates('stok', keep='first')[['stok', 'valor', 'costo', 'descuento']]
+                .values.tolist()
+            )
 
-        return Response({'validate': validate, 'data': data_response, 'crediminuto': [], 'cabecera': cabecera})
+        return Response({
+            'validate': validate, 'data': data_response, 'crediminuto': [], 'cabecera': cabecera,
+            'entradas': entradas,
+        })
 
 
 
@@ -6337,71 +6026,21 @@ class ListaProductosPrepagoEquipo(APIView):
         try:
             precio = request.data['precio']
             equipo = request.data['equipo']
-            
-            qs = models.Lista_precio.objects.filter(
-                producto=equipo, 
-                nombre=precio
-            ).order_by('-carga__fecha_carga')
-            
-            if not qs.exists():
-                return Response({'data': []})
-            
-            df = pd.DataFrame(list(qs.values('producto', 'valor', 'carga__fecha_carga')))
-            df.rename(columns={'valor': 'valor_actual', 'carga__fecha_carga': 'fecha'}, inplace=True)
-            df['valor_anterior'] = df['valor_actual'].shift(-1)
-            df.fillna({'valor_anterior': 0}, inplace=True)
-            df['variation'] = df.apply(calcular_variacion, axis=1)
-
-            sim = Decimal('2000')
-            base = Decimal('1152228')
-            new_data = []
-
-            for _, row in df.iterrows():
-                variacion_data = row.get('variation')
-                valor_actual = Decimal(row.get('valor_actual', 0))
-                iva = valor_actual * Decimal('0.19') if valor_actual >= base else Decimal('0')
-
-                tem_data = {
-                    'equipo': row.get('producto'),
-                    'fecha': row.get('fecha'),
-                    'equipo sin IVA': float(valor_actual),
-                    'valor_anterior': float(row.get('valor_anterior', 0)),
-                    'precio simcard': float(sim),
-                    'IVA simcard': float(sim * Decimal('0.19')),
-                    'IVA equipo': float(iva),
-                    'total': float(sim * Decimal('1.19') + valor_actual + iva),
-                    'indicador': variacion_data.get('indicador'),
-                    'diferencial': variacion_data.get('diferencial'),
-                    'porcentaje': variacion_data.get('porcentaje'),
-                }
-                new_data.append(tem_data)
-            
-            return Response({'data': new_data})
+
+            filas, siguiente = historial_precios(
+                precio,
+                equipo=equipo,
+                solo_ultimo=bool(request.data.get('solo_ultimo', False)),
+                cursor=request.data.get('cursor'),
+                limite=request.data.get('limite'),
+            )
+            return Response({'data': formatear_historial(filas), 'siguiente': siguiente})
+        except (KeyError, ValueError) as e:
+            return Response({'detail': f'Parámetros inválidos: {str(e)}'}, status=400)
         except Exception as e:
             print(f"ERROR en /lista-productos-prepago-equipo: {str(e)}")
             return Response({'detail': f'Error interno: {str(e)}'}, status=500)
 
-def calcular_variacion(row):
-    valor_anterior_raw = row.get('valor_anterior')
-
-    if pd.isna(valor_anterior_raw):
-        return {'indicador': 'neutral', 'diferencial': 0, 'porcentaje': 0}
-
-    valor_actual = float(row.get('valor_actual', 0))
-    valor_anterior = float(valor_anterior_raw)
-
-    if valor_actual == valor_anterior:
-        return {'indicador': 'neutral', 'diferencial': 0, 'porcentaje': 0}
-
-    elif valor_actual > valor_anterior:
-        dif = valor_actual - valor_anterior
-        percentage = (dif / valor_anterior) * 100 if valor_anterior > 0 else 100.0
-        return {'indicador': 'up', 'diferencial': dif, 'porcentaje': round(percentage, 2)}
-
-    elif valor_actual < valor_anterior:
-        dif = valor_anterior - valor_actual
-        percentage = (dif / valor_anterior) * 100 if valor_anterior > 0 else 0
-        return {'indicador': 'down', 'diferencial': dif, 'porcentaje': round(percentage, 2)}
 # views.py 
 
 @api_view(['POST'])
@@ -6538,56 +6177,30 @@ def lista_productos_prepago(request):
             if not precio_nombre:
                 return Response({'error': 'El campo "precio" es obligatorio'}, status=400)
 
-            todos_los_precios = models.Lista_precio.objects.filter(nombre=precio_nombre).order_by('producto', '-dia')
-            df = pd.DataFrame(list(todos_los_precios.values()))
-
-            if df.empty:
+            filas, siguiente = historial_precios(
+                precio_nombre,
+                solo_ultimo=bool(request.data.get('solo_ultimo', True)),
+                cursor=request.data.get('cursor'),
+                limite=request.data.get('limite'),
+            )
+            if not filas and not request.data.get('cursor'):
                 return Response({'data': [], 'fecha_actual': 'N/A'})
 
-            df['valor_anterior'] = df.groupby('producto')['valor'].shift(-1)
-            df.fillna({'valor_anterior': 0}, inplace=True)
-            
-            df_final = df.drop_duplicates('producto', keep='first').copy()
-            df_final.rename(columns={'valor': 'valor_actual'}, inplace=True)
-
-            df_descuentos = pd.DataFrame(list(models.Lista_precio.objects.filter(nombre='descuento').order_by('producto', '-dia').values()))
-            if not df_descuentos.empty:
-                df_descuentos = df_descuentos.drop_duplicates('producto', keep='first')[['producto', 'valor']].rename(columns={'valor': 'descuento'})
-                df_final = pd.merge(df_final, df_descuentos, on='producto', how='left')
-            df_final.fillna({'descuento': 0}, inplace=True)
-            
-            df_final['variation'] = df_final.apply(calcular_variacion, axis=1)
-
-            sim = Decimal('2000')
-            base = Decimal('1152228')
-            new_data = []
+            descuentos = {}
+            if precio_nombre == 'Precio publico':
+                descuentos = descuentos_vigentes({f['producto_normalizado'] for f in filas})
 
-            for _, row in df_final.iterrows():
-                variacion_data = row.get('variation')
-                valor_actual = Decimal(row.get('valor_actual', 0))
-                iva = valor_actual * Decimal('0.19') if valor_actual >= base else Decimal('0')
-                
-                tem_data = {
-                    'equipo': row.get('producto'),
-                    'precio simcard': float(sim),
-                    'IVA simcard': float(sim * Decimal('0.19')),
-                    'equipo sin IVA': float(valor_actual),
-                    'IVA equipo': float(iva),
-                    'total': float(sim * Decimal('1.19') + valor_actual + iva),
-                    'valor_anterior': float(row.get('valor_anterior', 0)),
-                    'indicador': variacion_data.get('indicador'),
-                    'diferencial': variacion_data.get('diferencial'),
-                    'porcentaje': variacion_data.get('porcentaje'),
-                }
-                if precio_nombre == 'Precio publico' and row.get('descuento', 0) > 0:
+            new_data = formatear_historial(filas)
+            for fila, tem_data in zip(filas, new_data):
+                if descuentos.get(fila['producto_normalizado'], 0) > 0:
                     tem_data['Promo'] = 'PROMO'
-                
-                new_data.append(tem_data)
-            
-            fecha_carga = df_final['dia'].max()
-            fecha_formateada = fecha_carga.strftime('%d de %B de %Y') if fecha_carga else "N/A"
-            
-            return Response({'data': new_data, 'fecha_actual': fecha_formateada})
+
+            fecha_carga = fecha_ultima_carga(precio_nombre)
+            fecha_formateada = (
+                f"{fecha_carga:%d} de {MESES_ES[fecha_carga.month]} de {fecha_carga:%Y}" if fecha_carga else "N/A"
+            )
+
+            return Response({'data': new_data, 'fecha_actual': fecha_formateada, 'siguiente': siguiente})
 
         except Exception as e:
             traceback.print_exc()